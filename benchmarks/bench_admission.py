@@ -0,0 +1,89 @@
+"""Всплеск входящих обновлений: задержка ответа без очереди и с очередью.
+
+Обработчик моделирует ответ LLM, время которого растет с числом
+одновременных запросов (upstream делит пропускную способность), обновления
+приходят вдвое быстрее, чем их успевают обработать.
+
+Запуск: python benchmarks/bench_admission.py [обновлений] [обновлений_в_секунду]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.bot.admission import AdmissionQueue  # noqa: E402
+
+
+BASE_LATENCY = 0.2   # Ответ без конкуренции, секунды
+CAPACITY = 50        # Сколько запросов upstream держит без замедления
+
+
+class Upstream:
+    """Модель upstream: при перегрузке каждый запрос замедляется."""
+
+    def __init__(self) -> None:
+        self.in_flight = 0
+
+    async def call(self) -> None:
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(BASE_LATENCY * max(1.0, self.in_flight / CAPACITY))
+        finally:
+            self.in_flight -= 1
+
+
+def percentile(values: list, share: float) -> float:
+    """Перцентиль по отсортированному списку."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def run(updates: int, rate: float, queue: AdmissionQueue = None) -> None:
+    """Подать обновления с постоянной скоростью и собрать задержки."""
+    upstream = Upstream()
+    latencies = []
+    shed = []
+
+    async def handle() -> None:
+        started = time.perf_counter()
+        if queue is not None and not await queue.acquire():
+            shed.append(time.perf_counter() - started)
+            return
+        try:
+            await upstream.call()
+        finally:
+            if queue is not None:
+                queue.release()
+        latencies.append(time.perf_counter() - started)
+
+    tasks = []
+    for _ in range(updates):
+        tasks.append(asyncio.create_task(handle()))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+    label = "admission" if queue is not None else "unbounded"
+    print(
+        f"{label:>9}: answered {len(latencies):>5}, p50 {percentile(latencies, 0.5):6.2f} s, "
+        f"p95 {percentile(latencies, 0.95):6.2f} s, max {max(latencies):6.2f} s; "
+        f"shed {len(shed):>5} (reply after {percentile(shed, 0.95) * 1000:.0f} ms p95)"
+    )
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 2 * CAPACITY / BASE_LATENCY
+    asyncio.run(run(updates, rate))
+    asyncio.run(run(updates, rate, AdmissionQueue(concurrency=CAPACITY, max_queue=100, max_wait=1.0)))
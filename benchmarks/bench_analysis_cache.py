@@ -0,0 +1,95 @@
+"""Повторяющиеся стикеры и мемы: vision запросы без кэша и с кэшем анализов.
+
+Популярность стикеров распределена по Ципфу (несколько популярных
+стикеров присылают постоянно, длинный хвост - редко). Обработчик
+BotHandlers настоящий, сеть заменена: скачивание отдает 40 КБ, vision
+запрос "отвечает" за VISION_LATENCY.
+
+Запуск: python benchmarks/bench_analysis_cache.py [сообщений] [разных_стикеров]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("HISTORY_BACKEND", "memory")
+
+from aiogram.types import Sticker  # noqa: E402
+
+from src.bot.handlers import BotHandlers  # noqa: E402
+from src.config.settings import settings  # noqa: E402
+from src.multimodal.analysis_cache import AnalysisCache  # noqa: E402
+
+
+STICKER_BYTES = 40 * 1024
+VISION_LATENCY = 0.002  # Секунды; реальный запрос - единицы секунд
+
+
+def make_messages(count: int, distinct: int) -> list:
+    """Сообщения со стикерами, популярность по Ципфу."""
+    rng = random.Random(42)
+    weights = [1 / rank for rank in range(1, distinct + 1)]
+    stickers = [
+        Sticker(file_id=f"file{index}", file_unique_id=f"uniq{index}", type="regular", width=512, height=512,
+                is_animated=False, is_video=False, emoji="😂", set_name="memes", file_size=STICKER_BYTES)
+        for index in range(distinct)
+    ]
+    messages = []
+    for sticker in rng.choices(stickers, weights, k=count):
+        message = MagicMock()
+        message.photo = None
+        message.caption = None
+        message.sticker = sticker
+        message.answer = AsyncMock()
+        message.bot.send_chat_action = AsyncMock()
+        messages.append(message)
+    return messages
+
+
+async def measure(name: str, messages: list, cache_enabled: bool) -> None:
+    bot = MagicMock()
+    bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path="stickers/file.webp", file_size=None))
+    bot.download_file = AsyncMock(side_effect=lambda *args, **kwargs: SimpleNamespace(read=lambda: b"\0" * STICKER_BYTES))
+    handlers = BotHandlers(bot, MagicMock())
+
+    async def analyze_image(image_data: bytes, caption: str) -> str:
+        await asyncio.sleep(VISION_LATENCY)
+        return "Ах, этот стикер. Оригинально, как прошлогодний мем."
+
+    with patch.object(handlers.image_processor, "analyze_image", AsyncMock(side_effect=analyze_image)) as vision, \
+         patch.object(settings, "MEDIA_CACHE_ENABLED", cache_enabled), \
+         patch("src.bot.handlers.analysis_cache", AnalysisCache(path="")) as cache:
+        started = time.perf_counter()
+        for message in messages:
+            await handlers.sticker_handler(message)
+        elapsed = time.perf_counter() - started
+
+    downloaded = handlers.media.get_stats()["downloaded_bytes"]
+    hit_rate = cache.get_stats()["hit_rate"] if cache_enabled else 0.0
+    print(f"{name:8s}: vision calls {vision.await_count:5d}, downloaded {downloaded / 1024 / 1024:6.1f} MB, "
+          f"hit rate {hit_rate:4.0%}, {elapsed * 1000 / len(messages):.2f} ms/message")
+
+
+async def main(count: int, distinct: int) -> None:
+    messages = make_messages(count, distinct)
+    print(f"messages={count}, distinct stickers={distinct} (Zipf)")
+    await measure("no cache", messages, cache_enabled=False)
+    await measure("cache", messages, cache_enabled=True)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    asyncio.run(main(count, distinct))
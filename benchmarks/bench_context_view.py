@@ -0,0 +1,91 @@
+"""Путь чтения истории: get_context_messages + сборка и кодирование payload.
+
+Сравнивает пересборку контекста на каждый запрос (новые словари, копия
+среза, сериализация всей истории) с кэшированным снимком ContextMessages.
+
+Запуск: python benchmarks/bench_context_view.py [сообщений_в_истории]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.llm.client import LLMClient  # noqa: E402
+from src.utils.history import HistoryManager, _session_key  # noqa: E402
+
+
+USER_TEXT = "Ну и что ты на это скажешь, умник? Объясни мне смысл жизни, только покороче."
+BOT_TEXT = "Скажу, что вопрос гениален примерно как инструкция к табуретке. Смысл жизни - не задавать таких вопросов."
+
+
+def rebuilt_context(history: HistoryManager, user_id: str):
+    """Прежний путь: новый список свежих словарей на каждый вызов."""
+    return [
+        {"role": msg.role, "content": msg.content}
+        for msg in history.user_sessions[_session_key(user_id)]
+    ]
+
+
+def rebuilt_request(client: LLMClient, history: HistoryManager, user_id: str) -> bytes:
+    context = rebuilt_context(history, user_id)
+    payload = client._prepare_payload(USER_TEXT, context)
+    return client.payload_encoder.encode(payload)
+
+
+def view_request(client: LLMClient, history: HistoryManager, user_id: str) -> bytes:
+    context = history.get_context_messages(user_id)
+    payload = client._prepare_payload(USER_TEXT, context)
+    return client.payload_encoder.encode(payload)
+
+
+def measure(name: str, func, client: LLMClient, history: HistoryManager, turns: bool, number: int) -> None:
+    """Время и выделенная память на запрос; turns - с добавлением реплик между запросами."""
+    user_id = "100000001"
+
+    def run() -> None:
+        for _ in range(number):
+            if turns:
+                history.add_message(user_id, "user", USER_TEXT)
+            func(client, history, user_id)
+            if turns:
+                history.add_message(user_id, "assistant", BOT_TEXT)
+
+    run()  # Прогрев
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    func(client, history, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<10} {elapsed / number * 1e6:7.1f} us/request, peak alloc {peak - before:6d} B")
+
+
+def main() -> None:
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    client = LLMClient()
+    number = 20000
+    for turns in (False, True):
+        print("with add_message between requests" if turns else "repeated reads")
+        for name, func in (("rebuilt", rebuilt_request), ("view", view_request)):
+            history = HistoryManager(max_messages=size)
+            for i in range(size):
+                history.add_message("100000001", "user" if i % 2 == 0 else "assistant",
+                                    USER_TEXT if i % 2 == 0 else BOT_TEXT)
+            measure(name, func, client, history, turns, number)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    main()
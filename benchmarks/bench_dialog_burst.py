@@ -0,0 +1,85 @@
+"""Серии коротких сообщений: число запросов к LLM с очередью диалога и без нее.
+
+Каждый пользователь присылает серию из нескольких сообщений с паузами
+0.1-0.4 с, ответ LLM занимает 1 с (модель задержки, без сети).
+
+Запуск: python benchmarks/bench_dialog_burst.py [пользователей] [сообщений_в_серии]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.bot.dialogs import DialogActors  # noqa: E402
+from src.utils.history import HistoryManager  # noqa: E402
+
+
+LLM_LATENCY = 1.0
+
+
+class Bench:
+    """Счетчики одного прогона."""
+
+    def __init__(self) -> None:
+        self.history = HistoryManager(max_bytes=0)
+        self.calls = 0
+        self.stale = 0  # Запросы, чей контекст не видел прошлый ответ пользователю
+
+    async def answer(self, user_id: str, texts: list) -> None:
+        """Ответить так же, как message_handler: контекст, запись, LLM, запись."""
+        context = self.history.get_context_messages(user_id)
+        self.history.add_message(user_id, "user", "\n".join(texts))
+        if context and context[-1]["role"] != "assistant":
+            self.stale += 1
+        self.calls += 1
+        await asyncio.sleep(LLM_LATENCY)
+        self.history.add_message(user_id, "assistant", "ответ")
+
+
+async def burst(user_id: str, size: int, rng: random.Random, send) -> float:
+    """Серия сообщений пользователя; вернуть время до последнего ответа."""
+    started = time.perf_counter()
+    pending = []
+    for i in range(size):
+        pending.append(asyncio.create_task(send(user_id, f"сообщение {i}")))
+        await asyncio.sleep(rng.uniform(0.1, 0.4))
+    await asyncio.gather(*pending)
+    return time.perf_counter() - started
+
+
+async def run(users: int, size: int, coalesce: bool) -> None:
+    """Прогнать серии всех пользователей одновременно."""
+    bench = Bench()
+    if coalesce:
+        actors = DialogActors(lambda user_id, texts: bench.answer(user_id, texts))
+        send = actors.submit
+    else:
+        async def send(user_id: str, text: str) -> None:
+            await bench.answer(user_id, [text])
+
+    rng = random.Random(42)
+    durations = await asyncio.gather(*(burst(str(user), size, rng, send) for user in range(users)))
+    label = "actors" if coalesce else "direct"
+    print(
+        f"{label:>7}: LLM calls {bench.calls:>6} ({bench.calls / users:.2f}/user), "
+        f"racing contexts {bench.stale:>6}, "
+        f"last reply after {sum(durations) / users:.2f} s"
+    )
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    for coalesce in (False, True):
+        asyncio.run(run(users, size, coalesce))
@@ -0,0 +1,59 @@
+"""Бюджет памяти HistoryManager: точность оценки и потолок при росте числа пользователей.
+
+Каждое сообщение - отдельная строка (как текст из Telegram), поэтому
+tracemalloc видит и текст, и структуры.
+
+Запуск: python benchmarks/bench_history_budget.py [пользователей] [символов] [бюджет_МиБ]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.utils.history import HistoryManager  # noqa: E402
+
+
+def measure(users: int, chars: int, max_bytes: int, per_session: int = 20) -> None:
+    """Заполнить менеджер уникальными сообщениями и сравнить оценку с tracemalloc."""
+    gc.collect()
+    tracemalloc.start()
+    manager = HistoryManager(max_bytes=max_bytes)
+    started = time.perf_counter()
+    for i in range(per_session):
+        for user in range(users):
+            # Пользователи пишут по очереди: все сессии остаются активными
+            text = f"{user}:{i} " + "ж" * chars
+            manager.add_message(str(100_000_000 + user), "user", text)
+    elapsed = time.perf_counter() - started
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = manager.get_stats()
+    budget = f"{max_bytes / 1024 / 1024:.0f} MiB" if max_bytes else "none"
+    print(
+        f"budget={budget:>8}: traced {current / 1024 / 1024:6.1f} MiB (peak {peak / 1024 / 1024:6.1f}), "
+        f"estimated {stats['resident_bytes'] / 1024 / 1024:6.1f} MiB, "
+        f"sessions {stats['sessions']}, evictions {stats['evictions']}, "
+        f"add_message {elapsed / (users * per_session) * 1e6:.2f} us"
+    )
+    del manager
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    chars = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000
+    budget_mib = int(sys.argv[3]) if len(sys.argv) > 3 else 64
+    print(f"users={users} chars/message={chars} messages/session=20")
+    measure(users, chars, 0)
+    measure(users, chars, budget_mib * 1024 * 1024)
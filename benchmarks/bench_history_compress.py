@@ -0,0 +1,88 @@
+"""Сжатие простаивающих сессий: память до/после и цена распаковки.
+
+Тексты собираются случайно из набора фраз, каждое сообщение - отдельная
+строка, как текст из Telegram.
+
+Запуск: python benchmarks/bench_history_compress.py [пользователей] [сообщений_на_сессию]
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.utils.history import HistoryManager  # noqa: E402
+
+
+PHRASES = [
+    "Ну конечно, именно этого вопроса мне и не хватало для полного счастья.",
+    "Скажу, что вопрос гениален примерно как инструкция к табуретке.",
+    "Подскажи, как настроить роутер, чтобы интернет не пропадал по вечерам?",
+    "Я уже перезагружал его три раза, и ничего не изменилось.",
+    "Поразительно, техника снова не прочитала твои мысли.",
+    "А можно рецепт борща, но чтобы без свеклы и капусты?",
+    "Борщ без свеклы и капусты - это смелое кулинарное заявление.",
+    "Почему кот смотрит на меня так, будто я ему что-то должен?",
+    "Потому что ты ему действительно должен, по кошачьим законам.",
+    "Напиши, пожалуйста, короткое поздравление для коллеги с днем рождения.",
+]
+
+
+def make_text(rng: random.Random, index: int) -> str:
+    """Сообщение из 2-5 случайных фраз."""
+    return f"{index}. " + " ".join(rng.choice(PHRASES) for _ in range(rng.randint(2, 5)))
+
+
+def measure(users: int, per_session: int) -> None:
+    rng = random.Random(1)
+    gc.collect()
+    tracemalloc.start()
+    manager = HistoryManager(max_bytes=0, compress_after=60)
+    for user in range(users):
+        user_id = str(100_000_000 + user)
+        for i in range(per_session):
+            manager.add_message(user_id, "user" if i % 2 == 0 else "assistant", make_text(rng, i))
+    gc.collect()
+    before, _ = tracemalloc.get_traced_memory()
+    estimated_before = manager.resident_bytes
+
+    started = time.perf_counter()
+    compressed = manager.compress_idle_sessions(now=time.monotonic() + 120)
+    pack_time = time.perf_counter() - started
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sample = [str(100_000_000 + user) for user in range(0, users, max(1, users // 1000))]
+    started = time.perf_counter()
+    for user_id in sample:
+        manager.get_context_messages(user_id)
+    unpack_time = (time.perf_counter() - started) / len(sample)
+
+    print(
+        f"users={users} messages/session={per_session}: "
+        f"{before / 1024 / 1024:.1f} MiB -> {after / 1024 / 1024:.1f} MiB "
+        f"({after / before:.0%}), estimate {estimated_before / 1024 / 1024:.1f} -> "
+        f"{manager.get_stats()['resident_bytes'] / 1024 / 1024:.1f} MiB\n"
+        f"  compress pass: {compressed} sessions in {pack_time * 1000:.0f} ms "
+        f"({pack_time / compressed * 1e6:.0f} us/session), "
+        f"first access after idle: {unpack_time * 1e6:.0f} us"
+    )
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    sizes = [int(sys.argv[2])] if len(sys.argv) > 2 else [4, 10, 20]
+    for per_session in sizes:
+        measure(users, per_session)
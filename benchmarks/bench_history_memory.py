@@ -0,0 +1,58 @@
+"""Бенчмарк памяти HistoryManager: байт на сессию при 10k/100k пользователей.
+
+Запуск: python benchmarks/bench_history_memory.py [сообщений_на_сессию]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from src.utils.history import HistoryManager  # noqa: E402
+
+
+# Общие строки: меряем накладные расходы структуры, а не текст сообщений
+USER_TEXT = "Ну и что ты на это скажешь?"
+BOT_TEXT = "Скажу, что вопрос гениален примерно как инструкция к табуретке."
+
+
+def measure(users: int, per_session: int) -> None:
+    """Заполнить менеджер и вывести память и время на сессию."""
+    gc.collect()
+    tracemalloc.start()
+    manager = HistoryManager(max_bytes=0)
+    started = time.perf_counter()
+    for user in range(users):
+        # Telegram ID приходят как строки из str(message.from_user.id)
+        user_id = str(100_000_000 + user)
+        for i in range(per_session):
+            manager.add_message(user_id, "user" if i % 2 == 0 else "assistant",
+                                USER_TEXT if i % 2 == 0 else BOT_TEXT)
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"users={users:>7} messages/session={per_session:>2}: "
+        f"{current / users:7.0f} B/session, {current / 1024 / 1024:7.1f} MiB total, "
+        f"add_message {elapsed / (users * per_session) * 1e6:.2f} us"
+    )
+    del manager
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    sizes = [int(sys.argv[1])] if len(sys.argv) > 1 else [6, 20, 40]
+    for per_session in sizes:
+        for users in (10_000, 100_000):
+            measure(users, per_session)
@@ -0,0 +1,116 @@
+"""Запись истории в Redis: отдельные команды, пайплайн на сообщение и пачки.
+
+По умолчанию запускает локальный FakeRedis; для настоящего сервера
+передайте его адрес третьим аргументом.
+
+Запуск: python benchmarks/bench_history_redis.py [сообщений] [пользователей] [redis://...]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+import redis.asyncio as redis  # noqa: E402
+
+from src.utils.fake_redis import FakeRedis  # noqa: E402
+from src.utils.history import HistoryManager  # noqa: E402
+from src.utils.history_store import RedisHistoryStore, _encode_message  # noqa: E402
+
+
+TEXT = "Скажу, что вопрос гениален примерно как инструкция к табуретке."
+
+
+async def bench_separate_commands(url: str, total: int, users: int) -> None:
+    """Наивный вариант: RPUSH, LTRIM и EXPIRE отдельными запросами."""
+    client = redis.from_url(url)
+    started = time.perf_counter()
+    for i in range(total):
+        key = f"bench:naive:{100_000_000 + i % users}"
+        await client.rpush(key, _encode_message(("user", TEXT, time.time(), 20)))
+        await client.ltrim(key, -20, -1)
+        await client.expire(key, 3600)
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    print(f"separate commands:  {total / elapsed:8.0f} msg/s, {elapsed / total * 1e6:.0f} us per message")
+
+
+async def bench_pipeline_per_message(url: str, total: int, users: int) -> None:
+    """Один MULTI/EXEC пайплайн на сообщение."""
+    store = RedisHistoryStore(url, prefix="bench:pipe")
+    await store.start()
+    started = time.perf_counter()
+    for i in range(total):
+        store.append(str(100_000_000 + i % users), ("user", TEXT, time.time(), 20))
+        await store.flush()
+    elapsed = time.perf_counter() - started
+    await store.close()
+    print(f"pipeline/message:   {total / elapsed:8.0f} msg/s, {elapsed / total * 1e6:.0f} us per message")
+
+
+async def bench_write_behind(url: str, total: int, users: int) -> None:
+    """Фоновая запись: все накопленное за круг - одним пайплайном."""
+    manager = HistoryManager(store=RedisHistoryStore(url, prefix="bench:behind"))
+    await manager.start()
+    started = time.perf_counter()
+    for i in range(total):
+        manager.add_message(str(100_000_000 + i % users), "user", TEXT)
+        if i % 100 == 99:
+            # Отдаем управление event loop, как между апдейтами Telegram
+            await asyncio.sleep(0)
+    await manager.store.flush()
+    elapsed = time.perf_counter() - started
+    stats = manager.store.get_stats()
+    print(
+        f"write-behind:       {total / elapsed:8.0f} msg/s, "
+        f"{stats['flushes']} pipelines, {stats['flushed_ops'] / max(stats['flushes'], 1):.0f} ops each"
+    )
+
+    # Горячая сессия: сверка версии против полной перезагрузки
+    key = str(100_000_000)
+    await manager.ensure_loaded(key)
+    rounds = 1000
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await manager.ensure_loaded(key)
+    validate = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await manager.store.load(key)
+    reload = (time.perf_counter() - started) / rounds
+    print(
+        f"hot session check:  {validate * 1e6:.0f} us (GET version) vs "
+        f"{reload * 1e6:.0f} us full reload of {manager.get_user_message_count(key)} messages"
+    )
+    await manager.close()
+
+
+async def main(total: int, users: int, url: str) -> None:
+    server = None
+    if not url:
+        server = FakeRedis()
+        url = await server.start()
+    print(f"messages={total} users={users} redis={url}")
+    try:
+        await bench_separate_commands(url, total, users)
+        await bench_pipeline_per_message(url, total, users)
+        await bench_write_behind(url, total, users)
+    finally:
+        if server is not None:
+            await server.close()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 2_000
+    url = sys.argv[3] if len(sys.argv) > 3 else ""
+    asyncio.run(main(total, users, url))
@@ -0,0 +1,98 @@
+"""Пропускная способность SQLite хранилища истории при непрерывной записи.
+
+Сравнивает отложенную запись пачками (SQLiteHistoryStore) с коммитом
+на каждое сообщение и меряет ленивую загрузку сессии.
+
+Запуск: python benchmarks/bench_history_sqlite.py [сообщений] [пользователей]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.utils.history import HistoryManager  # noqa: E402
+from src.utils.history_store import SQLiteHistoryStore  # noqa: E402
+
+
+TEXT = "Скажу, что вопрос гениален примерно как инструкция к табуретке."
+
+
+async def bench_write_behind(path: str, total: int, users: int) -> None:
+    """Отложенная запись: добавление в event loop + фоновый сброс."""
+    manager = HistoryManager(store=SQLiteHistoryStore(path, flush_interval=0.05, batch_size=1000))
+    await manager.start()
+
+    loop_time = 0.0
+    max_stall = 0.0
+    started = time.perf_counter()
+    for i in range(total):
+        call_started = time.perf_counter()
+        manager.add_message(str(100_000_000 + i % users), "user", TEXT)
+        call_time = time.perf_counter() - call_started
+        loop_time += call_time
+        max_stall = max(max_stall, call_time)
+        if i % 1000 == 999:
+            # Отдаем управление event loop, как между апдейтами Telegram
+            await asyncio.sleep(0)
+    await manager.store.flush()
+    elapsed = time.perf_counter() - started
+    stats = manager.store.get_stats()
+
+    print(
+        f"write-behind: {total / elapsed:9.0f} msg/s sustained, "
+        f"add_message avg {loop_time / total * 1e6:.1f} us (max {max_stall * 1000:.2f} ms), "
+        f"{stats['flushes']} flushes, avg {stats['flush_avg_ms']:.1f} ms"
+    )
+    await manager.close()
+
+    # Ленивая загрузка после "перезапуска"
+    restarted = HistoryManager(store=SQLiteHistoryStore(path))
+    await restarted.start()
+    started = time.perf_counter()
+    for user in range(min(users, 1000)):
+        await restarted.ensure_loaded(str(100_000_000 + user))
+    load_time = (time.perf_counter() - started) / min(users, 1000)
+    print(f"lazy load: {load_time * 1000:.2f} ms per session ({restarted.get_user_message_count(str(100_000_000))} messages)")
+    await restarted.close()
+
+
+def bench_commit_per_message(path: str, total: int, users: int) -> None:
+    """Наивный вариант: отдельная транзакция на сообщение в event loop."""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_key TEXT, "
+        "role TEXT, content TEXT, created REAL, tokens INTEGER)"
+    )
+    started = time.perf_counter()
+    for i in range(total):
+        with conn:
+            conn.execute(
+                "INSERT INTO messages (user_key, role, content, created, tokens) VALUES (?, ?, ?, ?, ?)",
+                (str(100_000_000 + i % users), "user", TEXT, time.time(), 20),
+            )
+    elapsed = time.perf_counter() - started
+    conn.close()
+    print(f"commit per message: {total / elapsed:9.0f} msg/s, {elapsed / total * 1e6:.1f} us blocking per message")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"messages={total} users={users}")
+        bench_commit_per_message(os.path.join(directory, "naive.db"), total, users)
+        asyncio.run(bench_write_behind(os.path.join(directory, "history.db"), total, users))
@@ -0,0 +1,70 @@
+"""Нагрузочный тест LLMClient против локального имитатора OpenRouter.
+
+Запуск: python benchmarks/bench_llm_offline.py [запросов] [одновременно]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from src.llm.backend import LLMBackend  # noqa: E402
+from src.llm.client import LLMClient  # noqa: E402
+from src.llm.fake_openrouter import FakeOpenRouter, FakeOpenRouterConfig  # noqa: E402
+from src.llm.transport import HttpTransport  # noqa: E402
+
+
+def percentile(values, q: float) -> float:
+    """Перцентиль по отсортированному списку."""
+    index = min(len(values) - 1, int(len(values) * q))
+    return values[index]
+
+
+async def run(total: int, concurrency: int) -> None:
+    server = FakeOpenRouter(
+        FakeOpenRouterConfig(latency=0.3, latency_sigma=0.6, error_rate=0.01, rate_limit_rate=0.02, retry_after=0.2),
+        seed=42,
+    )
+    base_url = await server.start()
+    transport = HttpTransport()
+    client = LLMClient(LLMBackend(base_url, "fake-key", transport))
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await client.send_message(f"Вопрос номер {i}", [], f"user_{i % 1000}")
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+
+    await transport.close()
+    await server.close()
+
+    latencies.sort()
+    print(f"requests={total} concurrency={concurrency} elapsed={elapsed:.2f}s rps={total / elapsed:.1f}")
+    print(
+        f"latency p50={percentile(latencies, 0.5) * 1000:.0f}ms "
+        f"p95={percentile(latencies, 0.95) * 1000:.0f}ms "
+        f"p99={percentile(latencies, 0.99) * 1000:.0f}ms"
+    )
+    print(f"server: {server.get_stats()}")
+    print(f"limiter: {client.limiter.get_stats()}")
+    print(f"pool: {transport.get_stats()}")
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(run(total, concurrency))
@@ -0,0 +1,127 @@
+"""Прием медиа: прежнее скачивание целиком против проверки до скачивания.
+
+Скачивание идет через настоящий Bot.download_file aiogram, сеть заменена
+генератором частей. Смесь: обычные фото (Telegram присылает 4 размера,
+раньше брался наибольший), документы-изображения по 25 МБ (из них половина
+без file_size в метаданных) и обычные документы-PNG по 2 МБ.
+
+Запуск: python benchmarks/bench_media_ingest.py [сообщений]
+"""
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.types import Document, PhotoSize  # noqa: E402
+
+from src.bot.media import MediaIngestor, MediaRejected  # noqa: E402
+from src.multimodal.image_processor import ImageProcessor  # noqa: E402
+
+
+MB = 1024 * 1024
+PHOTO_SIZES = [(90, 1_500), (320, 20_000), (800, 90_000), (1280, 230_000), (2560, 900_000)]
+
+
+def make_messages(count: int) -> list:
+    """Смесь сообщений с медиа."""
+    messages = []
+    for index in range(count):
+        if index % 10 < 7:
+            photo = [PhotoSize(file_id=f"{side}:{size}", file_unique_id=f"p{index}:{side}", width=side,
+                               height=side * 3 // 4, file_size=size) for side, size in PHOTO_SIZES]
+            messages.append(SimpleNamespace(photo=photo, sticker=None, document=None))
+        elif index % 10 < 9:
+            messages.append(SimpleNamespace(photo=None, sticker=None, document=Document(
+                file_id=f"0:{2 * MB}", file_unique_id=f"d{index}", mime_type="image/png", file_size=2 * MB)))
+        else:
+            known = index % 20 == 9
+            messages.append(SimpleNamespace(photo=None, sticker=None, document=Document(
+                file_id=f"0:{25 * MB}", file_unique_id=f"d{index}", mime_type="image/png",
+                file_size=25 * MB if known else None)))
+    return messages
+
+
+class Network:
+    """Счетчик байт, отданных фиктивным сервером Telegram."""
+
+    def __init__(self) -> None:
+        self.sent = 0
+
+    async def stream_content(self, url: str, chunk_size: int, **kwargs):
+        remaining = int(url.rsplit(":", 1)[1])
+        while remaining > 0:
+            chunk = min(chunk_size, remaining)
+            remaining -= chunk
+            self.sent += chunk
+            yield b"\0" * chunk
+
+
+async def get_file(file_id: str, **kwargs) -> SimpleNamespace:
+    """File с путем, по которому сервер знает размер."""
+    return SimpleNamespace(file_path=file_id, file_size=None)
+
+
+async def legacy(bot: Bot, message, processor: ImageProcessor) -> None:
+    """Прежние обработчики: наибольшее фото, скачивание целиком, проверка потом."""
+    file_id = message.photo[-1].file_id if message.photo else message.document.file_id
+    file_info = await bot.get_file(file_id)
+    data = (await bot.download_file(file_info.file_path)).read()
+    len(data) > processor.max_size
+
+
+async def ingest(media: MediaIngestor, message) -> None:
+    """Новый прием медиа."""
+    try:
+        await media.download(media.select(message))
+    except MediaRejected:
+        pass
+
+
+async def measure(name: str, messages: list, call) -> None:
+    network = Network()
+    bot = Bot("123456:BENCH-token")
+    bot.session.api = SimpleNamespace(is_local=False, file_url=lambda token, path: f"file:{path}")
+    with patch.object(Bot, "get_file", side_effect=get_file), \
+         patch.object(bot.session, "stream_content", network.stream_content):
+        tracemalloc.start()
+        started = time.perf_counter()
+        for message in messages:
+            await call(bot, message)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    await bot.session.close()
+    print(f"{name:7s}: downloaded {network.sent / MB:8.1f} MB, peak memory {peak / MB:5.1f} MB, "
+          f"{elapsed * 1000 / len(messages):6.2f} ms/message")
+
+
+async def main(count: int) -> None:
+    messages = make_messages(count)
+    processor = ImageProcessor()
+    print(f"messages={count}: 70% photos, 20% PNG 2 MB, 10% PNG 25 MB (half without file_size)")
+    await measure("legacy", messages, lambda bot, message: legacy(bot, message, processor))
+
+    def media_for(bot: Bot) -> MediaIngestor:
+        return MediaIngestor(bot, max_bytes=processor.max_size, max_side=processor.max_side,
+                             target_side=max(processor.max_dimensions))
+
+    await measure("ingest", messages, lambda bot, message: ingest(media_for(bot), message))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    asyncio.run(main(count))
@@ -0,0 +1,116 @@
+"""Всплеск исходящих сообщений: прямые вызовы Bot API против планировщика.
+
+Фиктивный Telegram (make_request сессии) применяет flood control: больше
+GLOBAL_RATE запросов за секунду на бота или больше CHAT_BURST за секунду в
+один чат - ответ 429 с retry_after. Время ускорено в SCALE раз, лимиты
+умножены на SCALE. Пользователи получают по 3 сообщения почти
+одновременно, среди них ответы на команды /status.
+
+Запуск: python benchmarks/bench_outbound.py [пользователей]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from collections import defaultdict, deque
+from unittest.mock import patch
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+
+from src.bot.outbound import OutboundMiddleware, OutboundScheduler, send_priority  # noqa: E402
+from src.llm.timings import Histogram  # noqa: E402
+
+
+SCALE = 10
+GLOBAL_RATE = 30 * SCALE
+CHAT_BURST = 3
+
+
+class FakeTelegram:
+    """Flood control по скользящему окну в 1/SCALE секунды."""
+
+    def __init__(self) -> None:
+        self.window = 1 / SCALE
+        self.global_sent: deque = deque()
+        self.chat_sent = defaultdict(deque)
+        self.rejected = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(0.002)  # Сеть
+        now = time.monotonic()
+        chat = self.chat_sent[method.chat_id]
+        for sent in (self.global_sent, chat):
+            while sent and sent[0] <= now - self.window:
+                sent.popleft()
+        if len(self.global_sent) >= GLOBAL_RATE / SCALE or len(chat) >= CHAT_BURST:
+            self.rejected += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        self.global_sent.append(now)
+        chat.append(now)
+        return True
+
+
+async def measure(name: str, users: int, scheduled: bool) -> None:
+    telegram = FakeTelegram()
+    bot = Bot("123456:BENCH-token")
+    scheduler = OutboundScheduler(global_rate=GLOBAL_RATE, chat_rate=SCALE, group_rate=SCALE,
+                                  chat_burst=CHAT_BURST, global_burst=GLOBAL_RATE / SCALE * 0.2)  # Как по умолчанию без ускорения
+    if scheduled:
+        # retry_after Telegram в секундах, а время ускорено - делим на SCALE
+        scheduler_penalize = scheduler.penalize
+        scheduler.penalize = lambda chat_id, retry_after: scheduler_penalize(chat_id, retry_after / SCALE)
+        bot.session.middleware(OutboundMiddleware(scheduler, max_retries=3, max_retry_after=60))
+        await scheduler.start()
+
+    latency = {True: Histogram(), False: Histogram()}
+    lost = 0
+    rng = random.Random(7)
+
+    async def reply(chat_id: int, command: bool) -> None:
+        nonlocal lost
+        await asyncio.sleep(rng.random() / SCALE * 5)
+        token = send_priority.set(command)
+        started = time.monotonic()
+        try:
+            await bot.send_message(chat_id, "🎭 Ответ")
+            latency[command].observe((time.monotonic() - started) * SCALE)
+        except TelegramRetryAfter:
+            lost += 1
+        finally:
+            send_priority.reset(token)
+
+    with patch.object(bot.session, "make_request", telegram.make_request):
+        tasks = [reply(user, command=index == 0 and user % 15 == 0)
+                 for user in range(users) for index in range(3)]
+        await asyncio.gather(*tasks)
+    await scheduler.close()
+    await bot.session.close()
+
+    normal, command = latency[False].snapshot(), latency[True].snapshot()
+    print(f"{name:9s}: 429 from Telegram {telegram.rejected:5d}, lost replies {lost:4d}, "
+          f"p95 command {command['p95_ms'] / 1000:5.1f} s, p95 other {normal['p95_ms'] / 1000:5.1f} s "
+          f"(real time)")
+
+
+async def main(users: int) -> None:
+    print(f"users={users}, messages={users * 3}, limits: {GLOBAL_RATE // SCALE}/s global, "
+          f"{CHAT_BURST}/s per chat (time x{SCALE})")
+    await measure("direct", users, scheduled=False)
+    await measure("scheduler", users, scheduled=True)
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    asyncio.run(main(users))
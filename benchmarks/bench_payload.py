@@ -0,0 +1,75 @@
+"""Микробенчмарк подготовки и сериализации payload для LLM.
+
+Сравнивает прежний путь (новый словарь системного промпта на каждый запрос
+и json.dumps целиком, как делает aiohttp для json=) с PayloadEncoder.
+
+Запуск: python benchmarks/bench_payload.py
+"""
+import json
+import os
+import sys
+import timeit
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from src.config.settings import settings  # noqa: E402
+from src.llm.client import LLMClient  # noqa: E402
+
+
+def make_context(size: int):
+    """Сгенерировать историю диалога из size сообщений."""
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Сообщение номер {i}: ну и что ты на это скажешь, умник?",
+        }
+        for i in range(size)
+    ]
+
+
+def legacy_encode(client: LLMClient, message: str, context) -> bytes:
+    """Прежний путь: свежий системный dict и полная сериализация."""
+    messages = [{"role": "system", "content": client.system_prompt}]
+    messages.extend(context[-19:])
+    messages.append({"role": "user", "content": message})
+    payload = {
+        "model": settings.OPENROUTER_MODEL,
+        "messages": messages,
+        "temperature": settings.LLM_TEMPERATURE,
+        "max_tokens": settings.LLM_MAX_TOKENS,
+    }
+    return json.dumps(payload).encode("utf-8")
+
+
+def encoder_encode(client: LLMClient, message: str, context) -> bytes:
+    """Новый путь: общий системный dict и кэшированный префикс."""
+    payload = client._prepare_payload(message, context)
+    return client.payload_encoder.encode(payload)
+
+
+def main() -> None:
+    client = LLMClient()
+    message = "Объясни мне смысл жизни, только покороче"
+    number = 20000
+
+    print(f"system prompt: {len(client.system_prompt)} chars")
+    for size in (0, 6, 19):
+        context = make_context(size)
+        legacy = min(timeit.repeat(lambda: legacy_encode(client, message, context), number=number, repeat=5))
+        new = min(timeit.repeat(lambda: encoder_encode(client, message, context), number=number, repeat=5))
+        legacy_bytes = len(legacy_encode(client, message, context))
+        new_bytes = len(encoder_encode(client, message, context))
+        print(
+            f"context={size:2d}: legacy {legacy / number * 1e6:7.2f} us, {legacy_bytes} B | "
+            f"encoder {new / number * 1e6:7.2f} us, {new_bytes} B | "
+            f"x{legacy / new:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
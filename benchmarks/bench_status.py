@@ -0,0 +1,104 @@
+"""Цена /status: прежний замер на месте против готового снимка.
+
+Прежний путь ждал пробный запрос к LLM (здесь - 0.8 с ответа upstream) и
+psutil.cpu_percent(interval=0.1), который блокирует event loop. Во время
+запросов /status в фоне тикает таймер каждые 10 мс: его опоздание -
+то, насколько /status задерживает остальных пользователей.
+
+Запуск: python benchmarks/bench_status.py [запросов_status] [сессий]
+"""
+import asyncio
+import os
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("HISTORY_BACKEND", "memory")
+
+import psutil  # noqa: E402
+
+from src.bot.status import StatusCollector  # noqa: E402
+from src.llm.client import LLMClient  # noqa: E402
+from src.utils.history import HistoryManager  # noqa: E402
+
+
+LLM_PROBE_LATENCY = 0.8  # Ответ upstream на пробный запрос, секунды
+
+
+async def legacy_status(history: HistoryManager) -> None:
+    """Прежний _get_system_status без форматирования."""
+    await asyncio.sleep(LLM_PROBE_LATENCY)
+    len(history.user_sessions)
+    psutil.cpu_percent(interval=0.1)
+    psutil.virtual_memory()
+    psutil.boot_time()
+
+
+async def snapshot_status(collector: StatusCollector) -> None:
+    """Новый путь: чтение готового снимка."""
+    snapshot = collector.snapshot
+    snapshot.sessions, snapshot.messages, snapshot.cpu_percent
+
+
+async def measure(name: str, call, requests: int) -> None:
+    """Задержка /status и максимальное опоздание фонового таймера."""
+    lag = 0.0
+    stop = False
+
+    async def ticker() -> None:
+        nonlocal lag
+        while not stop:
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - expected)
+
+    ticking = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    stop = True
+    await ticking
+    latencies.sort()
+    print(f"{name:9s}: /status p50 {latencies[len(latencies) // 2] * 1000:8.2f} ms, "
+          f"max {latencies[-1] * 1000:8.2f} ms, event loop stall {lag * 1000:6.1f} ms, "
+          f"LLM probes {requests if call.__name__ == 'legacy' else 0}")
+
+
+async def main(requests: int, sessions: int) -> None:
+    history = HistoryManager(max_bytes=0)
+    for user in range(sessions):
+        for index in range(10):
+            history.add_message(user, "user" if index % 2 == 0 else "assistant", f"Сообщение {index}")
+    collector = StatusCollector(interval=15.0, history=history, client=LLMClient())
+
+    async def legacy() -> None:
+        await legacy_status(history)
+
+    async def snapshot() -> None:
+        await snapshot_status(collector)
+
+    await collector.start()
+    try:
+        print(f"sessions={sessions}, messages={sessions * 10}, "
+              f"snapshot collection {collector.snapshot.collect_ms:.2f} ms every {collector.interval:.0f} s")
+        await measure("legacy", legacy, requests)
+        await measure("snapshot", snapshot, requests)
+    finally:
+        await collector.close()
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    sessions = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    asyncio.run(main(requests, sessions))
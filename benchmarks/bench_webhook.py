@@ -0,0 +1,145 @@
+"""Пропускная способность приема обновлений через webhook.
+
+Отправляет синтетические обновления Telegram (текстовые сообщения от разных
+пользователей) POST запросами с секретом, как это делает Telegram.
+
+Без --url поднимает webhook сервер в этом же процессе с обработчиком-счетчиком
+и меряет и прием (ответ 200), и обработку. С --url шлет обновления на уже
+запущенный экземпляр (BOT_MODE=webhook, ответы пользователям при этом уйдут
+в Telegram API с фиктивными chat_id и завершатся ошибкой - это нормально).
+
+Запуск: python benchmarks/bench_webhook.py [--updates N] [--concurrency N]
+        [--url http://127.0.0.1:8080/telegram/webhook --secret SECRET]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.types import Message  # noqa: E402
+
+from src.bot.webhook import SECRET_HEADER, create_webhook_app  # noqa: E402
+
+
+LOCAL_SECRET = "bench-secret"
+LOCAL_PATH = "/telegram/webhook"
+
+
+def make_update(update_id: int, users: int) -> dict:
+    """Синтетическое обновление с текстовым сообщением."""
+    user_id = 100_000_000 + update_id % users
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "text": f"Сообщение номер {update_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Бенчмарк"},
+        },
+    }
+
+
+async def post_updates(url: str, secret: str, updates: int, concurrency: int, users: int) -> tuple:
+    """Отправить обновления; вернуть (время, ответы не 200, задержки запросов)."""
+    counter = itertools.count(1)
+    failures = 0
+    latencies = []
+
+    async def sender(session: aiohttp.ClientSession) -> None:
+        nonlocal failures
+        for update_id in counter:
+            if update_id > updates:
+                return
+            started = time.perf_counter()
+            async with session.post(url, json=make_update(update_id, users),
+                                    headers={SECRET_HEADER: secret}) as response:
+                await response.read()
+                if response.status != 200:
+                    failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return elapsed, failures, sorted(latencies)
+
+
+def report(label: str, updates: int, elapsed: float, failures: int, latencies: list) -> None:
+    """Вывести итог прогона."""
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(
+        f"{label}: {updates} updates in {elapsed:.2f} s = {updates / elapsed:,.0f} updates/s, "
+        f"POST p50 {p50:.1f} ms, p99 {p99:.1f} ms, non-200 {failures}"
+    )
+
+
+async def run_local(updates: int, concurrency: int, users: int) -> None:
+    """Поднять webhook сервер в процессе и нагрузить его."""
+    handled = 0
+    done = asyncio.Event()
+    dp = Dispatcher()
+
+    async def count(message: Message) -> None:
+        nonlocal handled
+        handled += 1
+        if handled == updates:
+            done.set()
+
+    dp.message.register(count)
+    bot = Bot("123456:BENCH-token")
+    runner = web.AppRunner(create_webhook_app(dp, bot, LOCAL_SECRET, LOCAL_PATH))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    port = runner.addresses[0][1]
+    try:
+        started = time.perf_counter()
+        elapsed, failures, latencies = await post_updates(
+            f"http://127.0.0.1:{port}{LOCAL_PATH}", LOCAL_SECRET, updates, concurrency, users
+        )
+        report("accepted", updates, elapsed, failures, latencies)
+        await asyncio.wait_for(done.wait(), 30)
+        print(f" handled: {handled} updates, all processed after {time.perf_counter() - started:.2f} s")
+    finally:
+        await runner.cleanup()
+
+
+def main() -> None:
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description="Webhook intake throughput")
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=40, help="Как WEBHOOK_MAX_CONNECTIONS")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--url", default="", help="Webhook запущенного экземпляра")
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET запущенного экземпляра")
+    args = parser.parse_args()
+
+    if args.url:
+        elapsed, failures, latencies = asyncio.run(
+            post_updates(args.url, args.secret, args.updates, args.concurrency, args.users)
+        )
+        report("accepted", args.updates, elapsed, failures, latencies)
+    else:
+        asyncio.run(run_local(args.updates, args.concurrency, args.users))
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.CRITICAL)
+    main()
@@ -0,0 +1,98 @@
+"""Пропускная способность супервизора с 1/2/4/8 процессами-воркерами.
+
+Обработчик воркера делает работу, которая в боте занимает CPU: проверка
+текста регулярными выражениями validators.py, декодирование и уменьшение
+изображения PIL и сериализация JSON запроса к LLM. Сети нет.
+
+Запуск: python benchmarks/bench_workers.py [обновлений] [воркеры через запятую]
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+
+# Добавляем корневую папку в path для корректных импортов
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Фиктивные значения, чтобы settings не требовал .env
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "bench")
+os.environ.setdefault("OPENROUTER_API_KEY", "bench")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from src.bot.supervisor import Supervisor  # noqa: E402
+
+
+USERS = 1000
+
+
+def make_update(update_id: int) -> dict:
+    """Синтетическое обновление с текстовым сообщением."""
+    user_id = 100_000_000 + update_id % USERS
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0,
+            "text": f"Подскажи, как настроить роутер, чтобы интернет не пропадал? 🙏 #{update_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Бенчмарк"},
+        },
+    }
+
+
+def run_worker() -> None:
+    """Процесс-воркер с CPU-нагруженным обработчиком."""
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Message
+    from PIL import Image
+
+    from src.bot.worker import UpdateWorker
+    from src.utils.validators import validator
+
+    picture = io.BytesIO()
+    Image.effect_noise((640, 480), 64).convert("RGB").save(picture, format="JPEG")
+    picture = picture.getvalue()
+
+    async def handler(message: Message) -> None:
+        validator.validate_user_message(message.text)
+        image = Image.open(io.BytesIO(picture))
+        image.thumbnail((256, 256))
+        json.dumps({"messages": [{"role": "user", "content": message.text}] * 20}, ensure_ascii=False)
+
+    dp = Dispatcher()
+    dp.message.register(handler)
+    asyncio.run(UpdateWorker(dp, Bot("123456:BENCH-token"), heartbeat_interval=0.05).serve())
+
+
+async def measure(workers: int, updates: int) -> None:
+    """Раздать обновления workers воркерам и дождаться обработки."""
+    supervisor = Supervisor(workers=workers, command=[sys.executable, os.path.abspath(__file__), "--worker"],
+                            heartbeat_timeout=30.0, startup_timeout=300.0, queue_max=updates)
+    await supervisor.start()
+    try:
+        await supervisor.wait_ready()
+        started = time.perf_counter()
+        for update_id in range(updates):
+            supervisor.dispatch(make_update(update_id))
+        while supervisor.get_stats()["handled"] < updates:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+    finally:
+        await supervisor.close()
+    print(f"workers={workers}: {updates} updates in {elapsed:.2f} s = {updates / elapsed:,.0f} updates/s")
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv:
+        run_worker()
+        sys.exit(0)
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    counts = [int(count) for count in sys.argv[2].split(",")] if len(sys.argv) > 2 else [1, 2, 4, 8]
+    print(f"CPU cores: {os.cpu_count()}")
+    for workers in counts:
+        asyncio.run(measure(workers, updates))
@@ -0,0 +1,173 @@
+"""Ограниченная очередь входящих обновлений со сбросом лишней нагрузки."""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message, TelegramObject
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Флаг обработчика, работа которого проходит через очередь
+ADMISSION_FLAG = "admission"
+
+OVERLOAD_REPLY = (
+    "🚦 Поздравляю, ты в очереди за сарказмом, и она сейчас длиннее, чем в МФЦ. "
+    "Все мои остроумные нейроны заняты. Попробуй через минутку - "
+    "обещаю не стать за это время добрее."
+)
+
+
+class AdmissionQueue:
+    """
+    Ограничение одновременной тяжелой работы бота.
+
+    Не больше concurrency обработчиков выполняются одновременно, остальные
+    ждут в очереди по порядку прихода. Если очередь заполнена или ожидание
+    дольше max_wait, обновление сбрасывается: пользователь сразу получает
+    короткий ответ вместо ответа через полминуты.
+    """
+
+    def __init__(self, concurrency: int = settings.ADMISSION_CONCURRENCY,
+                 max_queue: int = settings.ADMISSION_QUEUE_MAX,
+                 max_wait: float = settings.ADMISSION_QUEUE_MAX_WAIT) -> None:
+        """
+        Инициализация очереди.
+
+        Args:
+            concurrency: Сколько обработчиков выполняются одновременно
+            max_queue: Максимальная длина очереди ожидания
+            max_wait: Максимальное ожидание в очереди в секундах
+        """
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.in_flight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+        # Статистика
+        self.admitted = 0
+        self.shed_full = 0
+        self.shed_timeout = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def acquire(self) -> bool:
+        """
+        Дождаться своей очереди.
+
+        Returns:
+            True если обработку можно начинать, False если обновление сброшено
+        """
+        if self.in_flight < self.concurrency and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+        if len(self._waiters) >= self.max_queue:
+            self.shed_full += 1
+            return False
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Место уже выдано в момент отмены - возвращаем его
+                self.release()
+            else:
+                future.cancel()
+                self._remove_waiter(future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed_timeout += 1
+                return False
+            raise
+        finally:
+            self._record_wait(time.monotonic() - started)
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        """Освободить место и пустить следующего из очереди."""
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.concurrency:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику очереди."""
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed_full + self.shed_timeout,
+            "shed_full": self.shed_full,
+            "shed_timeout": self.shed_timeout,
+            "wait_avg_ms": (self.wait_total / self.waits * 1000) if self.waits else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+        }
+
+    def _remove_waiter(self, future: "asyncio.Future[None]") -> None:
+        """Убрать ожидающего из очереди."""
+        try:
+            self._waiters.remove(future)
+        except ValueError:
+            pass
+
+    def _record_wait(self, wait: float) -> None:
+        """Учесть время ожидания в очереди."""
+        self.waits += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Middleware aiogram: обработчики с флагом admission проходят через очередь.
+
+    Команды без флага (/start, /help) выполняются сразу - они дешевые.
+    """
+
+    def __init__(self, queue: AdmissionQueue, reply: str = OVERLOAD_REPLY) -> None:
+        self.queue = queue
+        self.reply = reply
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not get_flag(data, ADMISSION_FLAG):
+            return await handler(event, data)
+
+        if not await self.queue.acquire():
+            await self._shed(event)
+            return None
+        try:
+            return await handler(event, data)
+        finally:
+            self.queue.release()
+
+    async def _shed(self, event: TelegramObject) -> None:
+        """Ответить на сброшенное обновление, не занимая очередь."""
+        user = getattr(event, "from_user", None)
+        logger.warning(f"Update shed by admission queue for user {user.id if user else None}",
+                       **self.queue.get_stats())
+        if isinstance(event, Message):
+            try:
+                await event.answer(self.reply)
+            except Exception as e:
+                logger.warning(f"Failed to send overload reply: {e}")
+
+
+# Глобальная очередь входящих обновлений
+admission_queue = AdmissionQueue()
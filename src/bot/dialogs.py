@@ -0,0 +1,168 @@
+"""Очереди сообщений пользователей: по одному актору на диалог."""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+from src.config.settings import settings
+from src.utils.logger import logger
+from src.utils.validators import validator
+
+
+# Обработчик пачки сообщений одного пользователя
+BatchHandler = Callable[[str, List[Message]], Awaitable[None]]
+
+# Сообщение в очереди: само сообщение, ожидание его обработки и время прихода
+_Entry = Tuple[Message, "asyncio.Future[None]", float]
+
+
+class _Mailbox:
+    """Входящие сообщения пользователя и задача, которая их разбирает."""
+
+    __slots__ = ("items", "last_arrival", "task")
+
+    def __init__(self) -> None:
+        self.items: List[_Entry] = []
+        self.last_arrival = 0.0
+        self.task: Optional["asyncio.Task[None]"] = None
+
+
+class DialogActors:
+    """
+    Последовательная обработка сообщений каждого пользователя.
+
+    У пользователя с непустой очередью есть ровно одна задача-актор: она
+    ждет, пока поток сообщений не затихнет на debounce секунд (но не дольше
+    max_wait с первого), и передает накопленную пачку обработчику одним
+    вызовом. Сообщения, пришедшие во время ответа, уходят следующей пачкой,
+    поэтому контекст диалога всегда читается после записи прошлого ответа.
+    Объединенный текст пачки не длиннее max_chars, как и одно сообщение:
+    не поместившееся сообщение начинает следующую пачку.
+    Опустевший актор завершается, простаивающие пользователи задач не держат.
+    """
+
+    def __init__(self, handler: BatchHandler,
+                 debounce: float = settings.DIALOG_DEBOUNCE,
+                 max_wait: float = settings.DIALOG_MAX_WAIT,
+                 max_batch: int = settings.DIALOG_MAX_BATCH,
+                 max_chars: int = validator.MAX_MESSAGE_LENGTH) -> None:
+        """
+        Инициализация очередей.
+
+        Args:
+            handler: Корутина обработки пачки сообщений пользователя
+            debounce: Пауза без новых сообщений, после которой пачка уходит
+                (0 - сразу; объединяются только пришедшие во время ответа)
+            max_wait: Максимальная задержка первого сообщения пачки в секундах
+            max_batch: Максимум сообщений в одной пачке
+            max_chars: Максимум символов в тексте пачки, склеенном через перевод строки
+        """
+        self.handler = handler
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.max_batch = max(1, max_batch)
+        self.max_chars = max_chars
+        self._mailboxes: Dict[str, _Mailbox] = {}
+
+        # Статистика
+        self.messages = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.failures = 0
+
+    async def submit(self, user_id: str, message: Message) -> None:
+        """
+        Поставить сообщение в очередь пользователя.
+
+        Возвращает управление, когда пачка с этим сообщением обработана.
+        Отмена ожидающего не отменяет обработку.
+        """
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        mailbox = self._mailboxes.get(user_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[user_id] = _Mailbox()
+        mailbox.last_arrival = time.monotonic()
+        mailbox.items.append((message, future, mailbox.last_arrival))
+        self.messages += 1
+
+        if mailbox.task is None:
+            mailbox.task = asyncio.create_task(self._run(user_id, mailbox))
+        await asyncio.shield(future)
+
+    async def close(self) -> None:
+        """Остановить всех акторов, не дожидаясь их очередей."""
+        tasks = [mailbox.task for mailbox in self._mailboxes.values() if mailbox.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._mailboxes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику очередей."""
+        return {
+            "active": len(self._mailboxes),
+            "queued": sum(len(mailbox.items) for mailbox in self._mailboxes.values()),
+            "messages": self.messages,
+            "batches": self.batches,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+        }
+
+    async def _run(self, user_id: str, mailbox: _Mailbox) -> None:
+        """Цикл актора: пачка за пачкой, пока очередь не опустеет."""
+        try:
+            while mailbox.items:
+                await self._settle(mailbox)
+                size = self._batch_size(mailbox.items)
+                batch = mailbox.items[:size]
+                del mailbox.items[:size]
+                await self._handle(user_id, batch)
+        finally:
+            # Между проверкой пустой очереди и этим местом нет await,
+            # поэтому новое сообщение не может потеряться
+            for _, future, _ in mailbox.items:
+                if not future.done():
+                    future.cancel()
+            mailbox.items.clear()
+            mailbox.task = None
+            if self._mailboxes.get(user_id) is mailbox:
+                del self._mailboxes[user_id]
+
+    async def _settle(self, mailbox: _Mailbox) -> None:
+        """Дождаться затишья в потоке сообщений или заполнения пачки."""
+        if self.debounce <= 0:
+            return
+        deadline = mailbox.items[0][2] + self.max_wait
+        while self._batch_size(mailbox.items) == len(mailbox.items) < self.max_batch:
+            delay = min(mailbox.last_arrival + self.debounce, deadline) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def _batch_size(self, items: List[_Entry]) -> int:
+        """Сколько первых сообщений очереди войдет в пачку (хотя бы одно)."""
+        length = -1  # Перевод строки нужен только между сообщениями
+        for size, (message, _, _) in enumerate(items[:self.max_batch]):
+            length += len(getattr(message, "text", None) or "") + 1
+            if size and length > self.max_chars:
+                return size
+        return min(len(items), self.max_batch)
+
+    async def _handle(self, user_id: str, batch: List[_Entry]) -> None:
+        """Обработать пачку и разбудить всех, кто ее ждет."""
+        self.batches += 1
+        self.coalesced += len(batch) - 1
+        try:
+            await self.handler(user_id, [message for message, _, _ in batch])
+        except asyncio.CancelledError:
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            # Обработчик сам отвечает пользователю об ошибках, здесь - только страховка
+            self.failures += 1
+            logger.error(f"Dialog actor failed for user {user_id}: {e}")
+        for _, future, _ in batch:
+            if not future.done():
+                future.set_result(None)
@@ -1,8 +1,6 @@
 """Обработчики сообщений Telegram бота."""
-import asyncio
 import time
-import psutil
-from datetime import datetime
+from typing import List, Optional, Tuple
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
@@ -10,32 +8,68 @@ from aiogram.types import Message
 from src.config.settings import settings
 from src.utils.logger import logger
 from src.llm.client import llm_client
+from src.llm.streaming import FallbackText
+from src.llm.summarizer import history_summarizer
+from src.llm.timings import latency_recorder
+from src.llm.transport import http_transport
 from src.utils.history import history_manager
 from src.utils.validators import validator
+from src.multimodal.analysis_cache import analysis_cache
 from src.multimodal.image_processor import ImageProcessor
+from src.bot.admission import ADMISSION_FLAG, AdmissionMiddleware, admission_queue
+from src.bot.dialogs import DialogActors
+from src.bot.media import MediaIngestor, MediaRejected
+from src.bot.outbound import (
+    SEND_PRIORITY_FLAG, OutboundMiddleware, SendPriorityMiddleware, outbound_scheduler
+)
+from src.bot.status import LLM_DEGRADED, LLM_OK, status_collector
+from src.bot.streaming import StreamingReply
+from src.bot.supervisor import Supervisor, create_routing_dispatcher
+from src.bot.webhook import run_webhook
 
 
 class BotHandlers:
     """Класс для организации обработчиков бота."""
     
+    # Типы обновлений, на которые есть обработчики: супервизор запрашивает
+    # их у Telegram, не создавая обработчиков
+    UPDATE_TYPES = ["message"]
+    
     def __init__(self, bot: Bot, dp: Dispatcher) -> None:
         """Инициализация обработчиков."""
         self.bot = bot
         self.dp = dp
         self.image_processor = ImageProcessor()
+        # Отправки в чаты идут под лимиты Telegram и переживают RetryAfter
+        self.bot.session.middleware(OutboundMiddleware(outbound_scheduler))
+        # Фото, стикеры и документы проверяются до скачивания по лимитам процессора
+        self.media = MediaIngestor(
+            bot,
+            max_bytes=self.image_processor.max_size,
+            max_side=self.image_processor.max_side,
+            target_side=max(self.image_processor.max_dimensions),
+        )
+        # Текстовые сообщения пользователя идут в LLM строго по очереди
+        self.dialogs = DialogActors(self._answer_dialog)
         self._register_handlers()
     
     def _register_handlers(self) -> None:
         """Регистрация всех обработчиков."""
-        self.dp.message.register(self.start_handler, CommandStart())
-        self.dp.message.register(self.help_handler, Command("help"))
-        self.dp.message.register(self.clear_handler, Command("clear"))
-        self.dp.message.register(self.status_handler, Command("status"))
+        # Ответы на команды отправляются раньше остальных исходящих сообщений
+        self.dp.message.middleware(SendPriorityMiddleware())
+        command = {SEND_PRIORITY_FLAG: True}
+        self.dp.message.register(self.start_handler, CommandStart(), flags=command)
+        self.dp.message.register(self.help_handler, Command("help"), flags=command)
+        self.dp.message.register(self.clear_handler, Command("clear"), flags=command)
+        self.dp.message.register(self.status_handler, Command("status"), flags=command)
 
-        self.dp.message.register(self.photo_handler, F.photo)
-        self.dp.message.register(self.sticker_handler, F.sticker)
-        self.dp.message.register(self.document_handler, F.document)
-        self.dp.message.register(self.message_handler)
+        # Сообщения и медиа идут через ограниченную очередь, команды - сразу
+        self.dp.message.middleware(AdmissionMiddleware(admission_queue))
+        heavy = {ADMISSION_FLAG: True}
+        self.dp.message.register(self.photo_handler, F.photo, flags=heavy)
+        self.dp.message.register(self.sticker_handler, F.sticker, flags=heavy)
+        self.dp.message.register(self.document_handler, F.document, flags=heavy)
+        self.dp.message.register(self.message_handler, flags=heavy)
     
     async def start_handler(self, message: Message) -> None:
         """Обработчик команды /start."""
@@ -95,7 +129,10 @@ class BotHandlers:
         user_id = str(message.from_user.id)
         logger.info(f"User {user_id} requested history clear")
         
-        # Очищаем историю пользователя
+        # Подгружаем сессию из хранилища, чтобы ответ учитывал историю до перезапуска
+        await history_manager.ensure_loaded(user_id)
+        
+        # Очищаем историю пользователя (и в хранилище)
         cleared = history_manager.clear_user_history(user_id)
         
         if cleared:
@@ -152,45 +189,69 @@ class BotHandlers:
         # Проверка бота
         bot_status = "✅ **Бот:** Работает идеально (как всегда)"
         
-        # Проверка LLM API
-        try:
-            test_response = await asyncio.wait_for(
-                llm_client.send_message("test", [], "system_check"), timeout=5
-            )
+        # Остальное - из снимка фонового сборщика, без запросов и ожиданий
+        snapshot = status_collector.snapshot
+        
+        # Здоровье LLM по circuit breaker'ам моделей
+        if snapshot.llm_state == LLM_OK:
             llm_status = "✅ **LLM API:** Готов к саркастическим ответам"
-        except asyncio.TimeoutError:
+        elif snapshot.llm_state == LLM_DEGRADED:
             llm_status = "⚠️ **LLM API:** Медленно думает (как обычно)"
-        except Exception:
+        else:
             llm_status = "❌ **LLM API:** Временно недоступен"
         
-        # Проверка памяти и истории
-        session_count = len(history_manager.user_sessions)
-        total_messages = sum(
-            len(session.get('messages', [])) 
-            for session in history_manager.user_sessions.values()
-        )
-        memory_status = f"💾 **Память:** {session_count} активных диалогов, {total_messages} сообщений"
+        memory_status = f"💾 **Память:** {snapshot.sessions} активных диалогов, {snapshot.messages} сообщений"
         
         # Системная информация
-        try:
-            cpu_percent = psutil.cpu_percent(interval=0.1)
-            memory_info = psutil.virtual_memory()
-            memory_percent = memory_info.percent
-            uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
-            
+        if snapshot.cpu_percent is not None and snapshot.uptime is not None:
             system_status = (
-                f"🖥️ **Система:** CPU {cpu_percent:.1f}%, "
-                f"RAM {memory_percent:.1f}%, "
-                f"Uptime {uptime.days}д {uptime.seconds//3600}ч"
+                f"🖥️ **Система:** CPU {snapshot.cpu_percent:.1f}%, "
+                f"RAM {snapshot.memory_percent:.1f}%, "
+                f"Uptime {snapshot.uptime.days}д {snapshot.uptime.seconds//3600}ч"
             )
-        except Exception:
+        else:
             system_status = "🖥️ **Система:** Информация недоступна"
         
         # Статистика
         response_time = (time.time() - start_time) * 1000
+        pool_stats = http_transport.get_stats()
+        cache_stats = llm_client.response_cache.get_stats()
+        limiter_stats = llm_client.limiter.get_stats()
+        summary_stats = history_summarizer.get_stats()
+        history_stats = history_manager.get_stats()
+        media_stats = self.media.get_stats()
+        analysis_stats = analysis_cache.get_stats()
+        outbound_stats = outbound_scheduler.get_stats()
+        dialog_stats = self.dialogs.get_stats()
+        admission_stats = admission_queue.get_stats()
+        llm_total = latency_recorder.get_phase(settings.OPENROUTER_MODEL, "ok", "total")
+        llm_ttfb = latency_recorder.get_phase(settings.OPENROUTER_MODEL, "ok", "ttfb")
         stats = (
             f"⚡ Время ответа: {response_time:.0f}мс\n"
-            f"🕐 Проверено: {datetime.now().strftime('%H:%M:%S')}"
+            f"🔌 HTTP пул: {pool_stats['connections_in_use']} активных соединений, "
+            f"ожидание {pool_stats['acquire_wait_avg_ms']:.0f}мс\n"
+            f"🗃️ Кэш ответов: {cache_stats['hit_rate']:.0%} попаданий, "
+            f"{cache_stats['coalesced']} объединенных запросов\n"
+            f"🚥 LLM запросы: {limiter_stats['in_flight']} в работе "
+            f"(лимит {limiter_stats['limit']}), очередь {limiter_stats['queue_depth']}\n"
+            f"⏱️ LLM p50/p95: {llm_total['p50_ms']:.0f}/{llm_total['p95_ms']:.0f}мс "
+            f"(первый байт p95 {llm_ttfb['p95_ms']:.0f}мс)\n"
+            f"🚦 Входящая очередь: {admission_stats['in_flight']} в работе, "
+            f"{admission_stats['queue_depth']} ждут ({admission_stats['wait_avg_ms']:.0f}мс), "
+            f"отказов {admission_stats['shed']}\n"
+            f"📤 Отправка: {outbound_stats['queue_depth']} ждут, "
+            f"ожидание p95 {outbound_stats['wait_p95_ms']:.0f}мс, "
+            f"флуд-контроль {outbound_stats['retry_after']}\n"
+            f"📨 Очереди диалогов: {dialog_stats['active']} активных, "
+            f"объединено сообщений {dialog_stats['coalesced']}\n"
+            f"🖼️ Медиа: скачано {media_stats['downloaded_bytes'] / 1024 / 1024:.1f} МБ, "
+            f"отклонено {media_stats['rejected']}, "
+            f"кэш анализов {analysis_stats['hit_rate']:.0%} попаданий\n"
+            f"🗜️ Сжато диалогов: {summary_stats['compactions']} "
+            f"({summary_stats['compacted_messages']} сообщений)\n"
+            f"🧠 История в памяти: {history_stats['resident_bytes'] / 1024 / 1024:.1f} МБ, "
+            f"вытеснено по бюджету {history_stats['evictions']}\n"
+            f"🕐 Проверено: {snapshot.taken_at.strftime('%H:%M:%S')}"
         )
         
         return {
@@ -227,31 +288,46 @@ class BotHandlers:
         
         logger.log_user_message(user_id, user_text)
         
+        # Серия сообщений подряд попадет в одну пачку и один запрос к LLM
+        await self.dialogs.submit(user_id, message)
+    
+    async def _answer_dialog(self, user_id: str, messages: List[Message]) -> None:
+        """Ответить на пачку сообщений пользователя одним запросом к LLM."""
+        message = messages[-1]  # Отвечаем на последнее сообщение серии
+        user_text = "\n".join(item.text for item in messages)
+        if len(messages) > 1:
+            logger.info(f"Coalesced {len(messages)} messages from user {user_id}")
+        
         try:
             # Отправляем сообщение "печатает..." для лучшего UX
             await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
             
-            # Получаем контекст из истории диалога
+            # Получаем контекст из истории диалога (после перезапуска - из хранилища)
+            await history_manager.ensure_loaded(user_id)
             context_messages = history_manager.get_context_messages(user_id)
             
             # Добавляем новое сообщение пользователя в историю
             history_manager.add_message(user_id, "user", user_text)
             
-            # Получаем ответ от LLM с учетом контекста
-            llm_response = await llm_client.send_message(user_text, context_messages, user_id)
+            # Получаем ответ от LLM с учетом контекста и отправляем пользователю
+            if settings.LLM_STREAMING:
+                reply = StreamingReply(message)
+                llm_response = await reply.consume(
+                    llm_client.stream_message(user_text, context_messages, user_id)
+                )
+                if not reply.complete:
+                    # В историю попадает то, что видел пользователь, вместе с пометкой об ошибке
+                    logger.warning(f"Incomplete LLM response for user {user_id}")
+            else:
+                llm_response = await llm_client.send_message(user_text, context_messages, user_id)
+                await message.answer(llm_response)
             
             # Добавляем ответ бота в историю
             history_manager.add_message(user_id, "assistant", llm_response)
-            
-            # Отправляем ответ пользователю
-            await message.answer(llm_response)
             logger.info(f"Sent LLM response to user {user_id} (history: {history_manager.get_user_message_count(user_id)} messages)")
             
-            # Периодически очищаем старые сессии
-            if len(history_manager.user_sessions) % 10 == 0:  # Каждые 10 новых пользователей
-                cleaned = history_manager.clear_old_sessions()
-                if cleaned > 0:
-                    logger.info(f"Cleaned {cleaned} old sessions during maintenance")
+            # Длинный диалог сжимается в сводку в фоне, ответ этого не ждет
+            history_summarizer.schedule(user_id)
             
         except Exception as e:
             logger.error(f"Error processing message for user {user_id}: {e}")
@@ -266,32 +342,70 @@ class BotHandlers:
     
 
     
+    async def _answer_image_analysis(self, message: Message, image_data: bytes,
+                                     caption: str) -> Tuple[str, bool]:
+        """
+        Проанализировать изображение и отправить ответ (потоково, если включено).
+        
+        Returns:
+            (текст ответа, True если это полный анализ без ошибок и обрывов)
+        """
+        if settings.LLM_STREAMING:
+            reply = StreamingReply(message)
+            analysis = await reply.consume(
+                self.image_processor.analyze_image_stream(image_data, caption)
+            )
+            return analysis, reply.complete
+        analysis = await self.image_processor.analyze_image(image_data, caption)
+        await message.answer(analysis)
+        return analysis, not isinstance(analysis, FallbackText)
+    
+    async def _analyze_media(self, message: Message, caption: str) -> bool:
+        """
+        Скачать изображение из сообщения и ответить его анализом.
+        
+        Returns:
+            False если файл отклонен (пользователю уже отправлена причина)
+        """
+        ref = self.media.select(message)
+        if ref is None:
+            await message.answer("❌ Ошибка валидации: Неподдерживаемый формат")
+            return False
+        
+        # Тот же файл с той же подписью уже анализировали - отвечаем без скачивания
+        cache_key = analysis_cache.make_key(ref.file_unique_id, caption)
+        if settings.MEDIA_CACHE_ENABLED:
+            cached = await analysis_cache.lookup(cache_key)
+            if cached is not None:
+                await message.answer(cached)
+                return True
+        
+        try:
+            image_data = await self.media.download(ref)
+        except MediaRejected as e:
+            await message.answer(f"❌ Ошибка валидации: {e}")
+            return False
+        
+        # Отправляем сообщение "печатает..."
+        await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
+        
+        # Анализируем изображение и отправляем анализ
+        analysis, complete = await self._answer_image_analysis(message, image_data, caption)
+        # Ошибки и оборванные ответы не кэшируются: их повторяли бы сутками
+        if settings.MEDIA_CACHE_ENABLED and complete and analysis.strip():
+            ttl = settings.MEDIA_CACHE_STICKER_TTL if ref.kind == "sticker" else settings.MEDIA_CACHE_TTL
+            await analysis_cache.put(cache_key, analysis.strip(), ttl=ttl)
+        return True
+    
     async def photo_handler(self, message: Message) -> None:
         """Обработчик фотографий."""
         user_id = str(message.from_user.id)
         logger.info(f"User {user_id} sent a photo")
         
         try:
-            # Получаем фото с максимальным размером
-            photo = message.photo[-1]  # Берем самое большое фото
-            file_info = await self.bot.get_file(photo.file_id)
-            
-            # Скачиваем фото
-            photo_data = await self.bot.download_file(file_info.file_path)
-            image_data = photo_data.read()
-            
-            # Получаем подпись к фото (если есть)
-            caption = message.caption or ""
-            
-            # Отправляем сообщение "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-            
-            # Анализируем изображение
-            analysis = await self.image_processor.analyze_image(image_data, caption)
-            
-            # Отправляем анализ
-            await message.answer(analysis)
-            logger.info(f"Photo analyzed successfully for user {user_id}")
+            # Размер фото выбирает прием медиа; подпись к фото (если есть) - в промпт
+            if await self._analyze_media(message, message.caption or ""):
+                logger.info(f"Photo analyzed successfully for user {user_id}")
             
         except Exception as e:
             logger.error(f"Error analyzing photo for user {user_id}: {e}")
@@ -306,13 +420,7 @@ class BotHandlers:
         logger.info(f"User {user_id} sent a sticker")
         
         try:
-            # Получаем стикер
             sticker = message.sticker
-            file_info = await self.bot.get_file(sticker.file_id)
-            
-            # Скачиваем стикер
-            sticker_data = await self.bot.download_file(file_info.file_path)
-            image_data = sticker_data.read()
             
             # Получаем подпись к стикеру (если есть)
             caption = message.caption or ""
@@ -321,15 +429,9 @@ class BotHandlers:
             sticker_info = f"Стикер: {sticker.emoji or 'без эмодзи'} - {sticker.set_name or 'из неизвестного набора'}"
             full_caption = f"{caption} {sticker_info}".strip()
             
-            # Отправляем сообщение "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-            
-            # Анализируем изображение стикера
-            analysis = await self.image_processor.analyze_image(image_data, full_caption)
-            
-            # Отправляем анализ
-            await message.answer(analysis)
-            logger.info(f"Sticker analyzed successfully for user {user_id}")
+            # Анализируем изображение стикера и отправляем анализ
+            if await self._analyze_media(message, full_caption):
+                logger.info(f"Sticker analyzed successfully for user {user_id}")
             
         except Exception as e:
             logger.error(f"Error analyzing sticker for user {user_id}: {e}")
@@ -354,23 +456,9 @@ class BotHandlers:
         logger.info(f"User {user_id} sent an image document: {document.file_name}")
         
         try:
-            # Скачиваем документ
-            file_info = await self.bot.get_file(document.file_id)
-            doc_data = await self.bot.download_file(file_info.file_path)
-            image_data = doc_data.read()
-            
-            # Получаем подпись к документу (если есть)
-            caption = message.caption or ""
-            
-            # Отправляем сообщение "печатает..."
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-            
-            # Анализируем изображение
-            analysis = await self.image_processor.analyze_image(image_data, caption)
-            
-            # Отправляем анализ
-            await message.answer(analysis)
-            logger.info(f"Document image analyzed successfully for user {user_id}")
+            # Подпись к документу (если есть) - в промпт
+            if await self._analyze_media(message, message.caption or ""):
+                logger.info(f"Document image analyzed successfully for user {user_id}")
             
         except Exception as e:
             logger.error(f"Error analyzing document image for user {user_id}: {e}")
@@ -380,26 +468,76 @@ class BotHandlers:
             )
 
 
+async def start_services() -> None:
+    """Запустить компоненты, нужные обработчикам."""
+    # Открываем общий пул HTTP соединений к LLM
+    await http_transport.start()
+    
+    # Хранилище истории и фоновая очистка истекших сессий
+    await history_manager.start()
+    
+    # Фоновое сжатие длинных диалогов
+    if settings.LLM_SUMMARY_ENABLED:
+        await history_summarizer.start()
+    
+    # Кэш анализов картинок (с диска, если задан MEDIA_CACHE_PATH)
+    await analysis_cache.start()
+    
+    # Очередь исходящих сообщений под лимиты Telegram
+    await outbound_scheduler.start()
+    
+    # Снимок состояния для /status
+    await status_collector.start()
+
+
+async def close_services(handlers: Optional[BotHandlers] = None) -> None:
+    """Остановить компоненты обработчиков."""
+    if handlers is not None:
+        await handlers.dialogs.close()
+    await status_collector.close()
+    await analysis_cache.close()
+    await outbound_scheduler.close()
+    await history_summarizer.close()
+    await history_manager.close()
+    await http_transport.close()
+
+
 async def main() -> None:
     """Основная функция для запуска бота."""
     logger.info("Starting sarcastic bot...")
+    handlers = None
+    supervisor = None
     
     try:
         # Создание бота и диспетчера
         bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
-        dp = Dispatcher()
-        
-        # Инициализация обработчиков
-        BotHandlers(bot, dp)
         
-        logger.info("Bot handlers registered successfully")
+        if settings.BOT_WORKERS > 1:
+            # Этот процесс только принимает обновления, обрабатывают их воркеры:
+            # ни обработчиков, ни хранилищ, ни сессий к LLM здесь не нужно
+            supervisor = Supervisor()
+            await supervisor.start()
+            dp = create_routing_dispatcher(supervisor)
+        else:
+            await start_services()
+            dp = Dispatcher()
+            handlers = BotHandlers(bot, dp)
+            logger.info("Bot handlers registered successfully")
         
-        # Запуск polling
-        logger.info("Starting polling...")
-        await dp.start_polling(bot)
+        # Прием обновлений: webhook за балансировщиком или long polling
+        if settings.BOT_MODE == "webhook":
+            logger.info("Starting webhook server...")
+            await run_webhook(dp, bot, allowed_updates=BotHandlers.UPDATE_TYPES)
+        else:
+            logger.info("Starting polling...")
+            await dp.start_polling(bot, allowed_updates=BotHandlers.UPDATE_TYPES)
         
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
         raise
     finally:
+        if supervisor is not None:
+            await supervisor.close()
+        else:
+            await close_services(handlers)
         logger.info("Bot stopped")
@@ -0,0 +1,152 @@
+"""Прием медиафайлов: проверка по метаданным Telegram и скачивание с лимитом."""
+import io
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence
+
+from aiogram import Bot
+from aiogram.types import Message, PhotoSize
+
+from src.utils.logger import logger
+
+
+class MediaRejected(Exception):
+    """Файл не подходит для анализа; текст ошибки можно показать пользователю."""
+
+
+@dataclass(frozen=True, slots=True)
+class MediaRef:
+    """Файл из сообщения, выбранный для анализа (еще не скачан)."""
+    kind: str  # photo, sticker или document
+    file_id: str
+    file_unique_id: str
+    file_size: Optional[int]  # Telegram присылает размер не всегда
+    width: Optional[int] = None
+    height: Optional[int] = None
+
+
+class _BoundedBuffer(io.BytesIO):
+    """Буфер скачивания, который обрывает загрузку сверх limit байт."""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__()
+        self.limit = limit
+
+    def write(self, chunk: bytes) -> int:
+        if self.tell() + len(chunk) > self.limit:
+            raise MediaRejected(f"Файл слишком большой: больше {self.limit // 1024 // 1024}MB")
+        return super().write(chunk)
+
+
+class MediaIngestor:
+    """
+    Единая точка приема фото, стикеров и документов-изображений.
+
+    Размер и разрешение проверяются по метаданным сообщения и File до
+    скачивания, поэтому файлы, которые все равно будут отклонены, не
+    занимают канал и память. Из размеров фото берется наименьший, которого
+    хватает для анализа (больше target_side процессор все равно уменьшит).
+    Скачивание идет частями в буфер с жестким лимитом max_bytes.
+    """
+
+    def __init__(self, bot: Bot, max_bytes: int, max_side: int, target_side: int,
+                 chunk_size: int = 64 * 1024) -> None:
+        """
+        Инициализация приема медиа.
+
+        Args:
+            bot: Бот, через который скачиваются файлы
+            max_bytes: Максимальный размер файла
+            max_side: Максимальная сторона изображения в пикселях
+            target_side: Сторона, до которой изображение уменьшается перед анализом
+            chunk_size: Размер части при скачивании
+        """
+        self.bot = bot
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.target_side = target_side
+        self.chunk_size = chunk_size
+
+        # Статистика
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.rejected = 0
+
+    def select(self, message: Message) -> Optional[MediaRef]:
+        """
+        Выбрать файл для анализа из сообщения.
+
+        Returns:
+            None если в сообщении нет подходящего изображения
+        """
+        if message.photo:
+            return self._photo_ref("photo", message.photo)
+
+        sticker = message.sticker
+        if sticker is not None:
+            if sticker.is_animated or sticker.is_video:
+                # TGS и WEBM не читаются PIL - анализируем превью стикера
+                if sticker.thumbnail is None:
+                    return None
+                return self._photo_ref("sticker", [sticker.thumbnail])
+            return MediaRef("sticker", sticker.file_id, sticker.file_unique_id,
+                            sticker.file_size, sticker.width, sticker.height)
+
+        document = message.document
+        if document is not None and document.mime_type and document.mime_type.startswith("image/"):
+            return MediaRef("document", document.file_id, document.file_unique_id, document.file_size)
+        return None
+
+    def check(self, ref: MediaRef) -> None:
+        """Отклонить файл по метаданным, не скачивая его."""
+        if ref.file_size is not None and ref.file_size > self.max_bytes:
+            self.rejected += 1
+            raise MediaRejected(f"Файл слишком большой: {ref.file_size // 1024 // 1024}MB")
+        if (ref.width or 0) > self.max_side or (ref.height or 0) > self.max_side:
+            self.rejected += 1
+            raise MediaRejected(f"Изображение слишком большое: {ref.width}x{ref.height}")
+
+    async def download(self, ref: MediaRef) -> bytes:
+        """
+        Проверить и скачать файл.
+
+        Raises:
+            MediaRejected: файл больше лимитов (до или во время скачивания)
+        """
+        self.check(ref)
+        file_info = await self.bot.get_file(ref.file_id)
+        # У документа размер часто известен только из File
+        if ref.file_size is None and file_info.file_size is not None:
+            self.check(MediaRef(ref.kind, ref.file_id, ref.file_unique_id, file_info.file_size))
+
+        buffer = _BoundedBuffer(self.max_bytes)
+        try:
+            data = await self.bot.download_file(file_info.file_path, destination=buffer,
+                                                chunk_size=self.chunk_size)
+        except MediaRejected:
+            self.rejected += 1
+            logger.warning(f"Download of {ref.kind} {ref.file_unique_id} aborted: over {self.max_bytes} bytes")
+            raise
+        image_data = data.read()
+        self.downloads += 1
+        self.downloaded_bytes += len(image_data)
+        return image_data
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику приема медиа."""
+        return {
+            "downloads": self.downloads,
+            "downloaded_bytes": self.downloaded_bytes,
+            "rejected": self.rejected,
+        }
+
+    def _photo_ref(self, kind: str, sizes: Sequence[PhotoSize]) -> MediaRef:
+        """Наименьший из размеров, которого хватает для анализа, иначе наибольший."""
+        by_side = sorted(sizes, key=lambda size: max(size.width, size.height))
+        # Размеры сверх max_side пропускаем, если есть поменьше
+        by_side = [size for size in by_side if max(size.width, size.height) <= self.max_side] or by_side
+        chosen = next(
+            (size for size in by_side if max(size.width, size.height) >= self.target_side),
+            by_side[-1],
+        )
+        return MediaRef(kind, chosen.file_id, chosen.file_unique_id,
+                        chosen.file_size, chosen.width, chosen.height)
@@ -0,0 +1,345 @@
+"""Планировщик исходящих запросов к Bot API с учетом лимитов Telegram."""
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Union
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.flags import get_flag
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from src.config.settings import settings
+from src.llm.timings import Histogram
+from src.utils.logger import logger
+
+
+# Флаг обработчика, ответы которого идут вне общей очереди (команды)
+SEND_PRIORITY_FLAG = "send_priority"
+
+# Методы, на которые действуют лимиты Telegram на сообщения в чат
+THROTTLED_METHODS = ("Send", "Edit", "Copy", "Forward")
+
+ChatId = Union[int, str]
+
+# Запросы, сделанные внутри обработчика с флагом send_priority
+send_priority: ContextVar[bool] = ContextVar("send_priority", default=False)
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, в запасе не больше burst."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated_at", "paused_until")
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд появится токен (0 - уже есть)."""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """Потратить токен."""
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float) -> None:
+        """Не выдавать токены seconds секунд (Telegram ответил RetryAfter)."""
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def idle(self, now: float) -> bool:
+        """Запас полон: корзину можно забыть без потери ограничения."""
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.paused_until
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class OutboundScheduler:
+    """
+    Очередь отправки сообщений под лимиты Telegram.
+
+    Каждая отправка берет токен из общей корзины (около 30 сообщений в
+    секунду на бота) и из корзины своего чата (около 1 в секунду в личный
+    чат, 20 в минуту в группу). Кто не может отправить сразу, ждет в одной
+    из двух очередей: ответы на команды обслуживаются раньше остальных,
+    внутри очереди - по порядку, но чат, исчерпавший лимит, не задерживает
+    другие чаты. До start() запросы идут без ограничений.
+    """
+
+    def __init__(self, global_rate: float = settings.TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = settings.TELEGRAM_CHAT_RATE,
+                 group_rate: float = settings.TELEGRAM_GROUP_RATE,
+                 chat_burst: int = settings.TELEGRAM_CHAT_BURST,
+                 global_burst: Optional[float] = None,
+                 max_chats: int = 10000) -> None:
+        """
+        Инициализация планировщика.
+
+        Args:
+            global_rate: Сообщений в секунду на весь бот
+            chat_rate: Сообщений в секунду в личный чат
+            group_rate: Сообщений в секунду в группу
+            chat_burst: Сколько сообщений подряд можно отправить в чат без паузы
+            global_burst: Запас общей корзины (по умолчанию - на 0.2 секунды отправки)
+            max_chats: Сколько корзин чатов держать до очистки неактивных
+        """
+        now = time.monotonic()
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_burst or global_rate * 0.2), now)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = max(1, chat_burst)
+        self.max_chats = max_chats
+        self._chats: Dict[ChatId, TokenBucket] = {}
+        # Очереди ожидающих: (чат, future), сначала приоритетная
+        self._lanes: Tuple[Deque[Tuple[ChatId, "asyncio.Future[None]"]], ...] = (deque(), deque())
+        self._wakeup = asyncio.Event()
+        self._pump: Optional["asyncio.Task[None]"] = None
+
+        # Статистика
+        self.sent = 0
+        self.priority_sent = 0
+        self.retry_after = 0
+        self.dropped_actions = 0
+        self.wait = Histogram()
+
+    async def start(self) -> None:
+        """Запустить выдачу токенов ожидающим."""
+        if self._pump is None:
+            self._pump = asyncio.create_task(self._run())
+            logger.info(f"Outbound scheduler started: global_rate={self.global_bucket.rate}/s, "
+                        f"chat_rate={self.chat_rate}/s")
+
+    async def close(self) -> None:
+        """Остановить планировщик; ожидающие отправляются без ограничений."""
+        if self._pump is not None:
+            self._pump.cancel()
+            try:
+                await self._pump
+            except asyncio.CancelledError:
+                pass
+            self._pump = None
+        for lane in self._lanes:
+            while lane:
+                _, future = lane.popleft()
+                if not future.done():
+                    future.set_result(None)
+
+    async def acquire(self, chat_id: ChatId, priority: bool = False) -> None:
+        """Дождаться разрешения на отправку в чат."""
+        if self._pump is None:
+            return
+        started = time.monotonic()
+        if not self.queue_depth and self._try_take(chat_id, started):
+            self._record(started, priority)
+            return
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._lanes[0 if priority else 1].append((chat_id, future))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Выданный в момент отмены токен пропадает: это безопаснее для лимита
+            future.cancel()
+            raise
+        self._record(started, priority)
+
+    def try_acquire(self, chat_id: ChatId) -> bool:
+        """
+        Получить разрешение, только если не нужно ждать (для необязательных запросов).
+
+        Берет лишь токен общей корзины: статус "печатает..." не тратит лимит
+        чата и не задерживает ответ, но пропускается, пока чат на паузе
+        после RetryAfter или отправки ждут в очереди.
+        """
+        if self._pump is None:
+            return True
+        now = time.monotonic()
+        bucket = self._chats.get(chat_id)
+        paused = bucket is not None and now < bucket.paused_until
+        if not self.queue_depth and not paused and self.global_bucket.wait_time(now) <= 0:
+            self.global_bucket.take(now)
+            return True
+        self.dropped_actions += 1
+        return False
+
+    def penalize(self, chat_id: ChatId, retry_after: float) -> None:
+        """Telegram ответил RetryAfter: приостановить отправку в чат."""
+        self.retry_after += 1
+        now = time.monotonic()
+        self._bucket(chat_id, now).pause(now, retry_after)
+
+    @property
+    def queue_depth(self) -> int:
+        """Сколько отправок ждут разрешения."""
+        return sum(len(lane) for lane in self._lanes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику отправки."""
+        wait = self.wait.snapshot()
+        return {
+            "queue_depth": self.queue_depth,
+            "priority_depth": len(self._lanes[0]),
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "priority_sent": self.priority_sent,
+            "retry_after": self.retry_after,
+            "dropped_actions": self.dropped_actions,
+            "wait_avg_ms": wait["avg_ms"],
+            "wait_p95_ms": wait["p95_ms"],
+            "wait_max_ms": wait["max_ms"],
+        }
+
+    def _bucket(self, chat_id: ChatId, now: float) -> TokenBucket:
+        """Корзина чата (группы и каналы имеют отрицательный id)."""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                self._prune(now)
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.group_rate if is_group else self.chat_rate, self.chat_burst, now
+            )
+        return bucket
+
+    def _try_take(self, chat_id: ChatId, now: float) -> bool:
+        """Взять токены общей корзины и корзины чата, если они есть сейчас."""
+        bucket = self._bucket(chat_id, now)
+        if self.global_bucket.wait_time(now) > 0 or bucket.wait_time(now) > 0:
+            return False
+        self.global_bucket.take(now)
+        bucket.take(now)
+        return True
+
+    def _prune(self, now: float) -> None:
+        """Забыть корзины чатов с полным запасом."""
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[chat_id]
+        # Если все чаты активны, следующая очистка - когда их станет вдвое больше
+        self.max_chats = max(self.max_chats, len(self._chats) * 2)
+
+    def _record(self, started: float, priority: bool) -> None:
+        """Учесть выданное разрешение."""
+        self.sent += 1
+        if priority:
+            self.priority_sent += 1
+        self.wait.observe(time.monotonic() - started)
+
+    def _grant_next(self, now: float) -> Optional[float]:
+        """
+        Выдать разрешения всем, кому можно.
+
+        Returns:
+            Через сколько секунд проверить снова (None - ждать новых запросов)
+        """
+        while True:
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                return global_wait if self.queue_depth else None
+
+            delay: Optional[float] = None
+            granted = False
+            for lane in self._lanes:
+                while lane and lane[0][1].done():
+                    lane.popleft()  # Отмененные ожидающие
+                for index, (chat_id, future) in enumerate(lane):
+                    if future.done():
+                        continue
+                    wait = self._bucket(chat_id, now).wait_time(now)
+                    if wait <= 0:
+                        del lane[index]
+                        self._try_take(chat_id, now)
+                        future.set_result(None)
+                        granted = True
+                        break
+                    delay = wait if delay is None else min(delay, wait)
+                if granted:
+                    break
+            if not granted:
+                return delay
+
+    async def _run(self) -> None:
+        """Цикл выдачи разрешений."""
+        while True:
+            delay = self._grant_next(time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+
+class OutboundMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: отправки в чаты идут через планировщик.
+
+    На RetryAfter чат приостанавливается на указанное Telegram время, и
+    запрос повторяется (не больше max_retries раз и если ждать не дольше
+    max_retry_after). Статус "печатает..." не ждет очереди и не тратит
+    лимит чата: если отправить его сразу нельзя, он пропускается.
+    """
+
+    def __init__(self, scheduler: OutboundScheduler,
+                 max_retries: int = settings.TELEGRAM_SEND_MAX_RETRIES,
+                 max_retry_after: float = settings.TELEGRAM_RETRY_AFTER_MAX) -> None:
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(THROTTLED_METHODS):
+            return await make_request(bot, method)
+
+        if isinstance(method, SendChatAction):
+            if not self.scheduler.try_acquire(chat_id):
+                return True
+            return await make_request(bot, method)
+
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.scheduler.penalize(chat_id, e.retry_after)
+                if attempt == self.max_retries or e.retry_after > self.max_retry_after:
+                    raise
+                logger.warning(f"Flood control for chat {chat_id}: retry in {e.retry_after}s "
+                               f"(attempt {attempt + 1}/{self.max_retries})")
+
+
+class SendPriorityMiddleware(BaseMiddleware):
+    """Middleware aiogram: отправки обработчиков с флагом send_priority идут вне очереди."""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not get_flag(data, SEND_PRIORITY_FLAG):
+            return await handler(event, data)
+        token = send_priority.set(True)
+        try:
+            return await handler(event, data)
+        finally:
+            send_priority.reset(token)
+
+
+# Глобальный планировщик отправки; общий лимит делится между воркерами
+outbound_scheduler = OutboundScheduler(
+    global_rate=settings.TELEGRAM_GLOBAL_RATE / max(1, settings.BOT_WORKERS)
+)
@@ -0,0 +1,75 @@
+"""Привязка пользователей к процессам-воркерам."""
+import bisect
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def _hash(key: str) -> int:
+    """Стабильный между процессами и запусками хеш строки."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Консистентное хеширование ключей по узлам.
+
+    Каждый узел занимает replicas точек на кольце, ключ принадлежит
+    ближайшей точке по часовой стрелке. При добавлении или удалении узла
+    переезжают только ключи его точек, остальные пользователи остаются
+    на своих воркерах вместе с историей в памяти.
+    """
+
+    def __init__(self, nodes: Iterable[int] = (), replicas: int = 64) -> None:
+        """
+        Инициализация кольца.
+
+        Args:
+            nodes: Идентификаторы узлов (номера воркеров)
+            replicas: Точек на кольце на один узел
+        """
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[int] = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node: int) -> None:
+        """Добавить узел."""
+        for replica in range(self.replicas):
+            point = _hash(f"{node}:{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: int) -> None:
+        """Убрать узел."""
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key: Any) -> int:
+        """Узел, которому принадлежит ключ."""
+        if not self._points:
+            raise ValueError("Hash ring is empty")
+        index = bisect.bisect(self._points, _hash(str(key)))
+        return self._owners[index % len(self._owners)]
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """
+    ID пользователя из сырого обновления Telegram.
+
+    Обновление содержит update_id и один объект события (message,
+    callback_query, ...); автор события - в поле from или user.
+    """
+    for field, event in update.items():
+        if field == "update_id" or not isinstance(event, dict):
+            continue
+        for author_field in ("from", "user"):
+            author = event.get(author_field)
+            if isinstance(author, dict) and "id" in author:
+                return author["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
@@ -0,0 +1,169 @@
+"""Фоновый сбор снимка состояния бота для /status."""
+import asyncio
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+import psutil
+
+from src.config.settings import settings
+from src.llm.client import LLMClient, llm_client
+from src.llm.resilience import CircuitBreaker
+from src.utils.history import HistoryManager, history_manager
+from src.utils.logger import logger
+
+
+# Состояние LLM по circuit breaker моделей
+LLM_OK = "ok"
+LLM_DEGRADED = "degraded"
+LLM_DOWN = "down"
+
+
+@dataclass(frozen=True, slots=True)
+class StatusSnapshot:
+    """Состояние бота на момент сбора."""
+    taken_at: datetime
+    llm_state: str
+    llm_error: Optional[str]
+    sessions: int
+    messages: int
+    cpu_percent: Optional[float]  # None - psutil недоступен
+    memory_percent: Optional[float]
+    uptime: Optional[timedelta]
+    collect_ms: float
+
+
+class StatusCollector:
+    """
+    Периодический сбор метрик системы, LLM и истории в снимок.
+
+    /status читает готовый снимок и ничего не ждет: здоровье LLM берется из
+    circuit breaker'ов (без пробных запросов upstream), загрузка CPU - из
+    неблокирующего psutil.cpu_percent(interval=None), который меряет
+    загрузку с предыдущего сбора.
+    """
+
+    def __init__(self, interval: float = settings.STATUS_INTERVAL,
+                 history: HistoryManager = history_manager,
+                 client: LLMClient = llm_client) -> None:
+        """
+        Инициализация сборщика.
+
+        Args:
+            interval: Период сбора в секундах
+            history: Менеджер истории
+            client: LLM клиент, чьи breaker'ы определяют здоровье LLM
+        """
+        self.interval = interval
+        self.history = history
+        self.client = client
+        self._snapshot: Optional[StatusSnapshot] = None
+        self._task: Optional["asyncio.Task[None]"] = None
+
+        # Статистика
+        self.samples = 0
+        self.failures = 0
+
+    @property
+    def snapshot(self) -> StatusSnapshot:
+        """Последний снимок (до первого сбора собирается на месте)."""
+        if self._snapshot is None:
+            self._snapshot = self.collect()
+        return self._snapshot
+
+    async def start(self) -> None:
+        """Запустить периодический сбор."""
+        if self._task is None:
+            # Первый вызов cpu_percent(None) только запоминает точку отсчета
+            self._cpu_percent()
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Status collector started: interval={self.interval}s")
+
+    async def close(self) -> None:
+        """Остановить периодический сбор."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def collect(self) -> StatusSnapshot:
+        """Собрать снимок сейчас (синхронно, без ожиданий)."""
+        started = time.perf_counter()
+        llm_state, llm_error = self._llm_health()
+        sessions = self.history.user_sessions
+        messages = sum(len(ring) for ring in sessions.values())
+
+        try:
+            memory_percent = psutil.virtual_memory().percent
+            uptime = datetime.now() - datetime.fromtimestamp(psutil.boot_time())
+        except Exception as e:
+            logger.warning(f"System metrics unavailable: {e}")
+            memory_percent = uptime = None
+
+        snapshot = StatusSnapshot(
+            taken_at=datetime.now(),
+            llm_state=llm_state,
+            llm_error=llm_error,
+            sessions=len(sessions),
+            messages=messages,
+            cpu_percent=self._cpu_percent(),
+            memory_percent=memory_percent,
+            uptime=uptime,
+            collect_ms=(time.perf_counter() - started) * 1000,
+        )
+        self._snapshot = snapshot
+        self.samples += 1
+        return snapshot
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику сбора."""
+        snapshot = self._snapshot
+        return {
+            "samples": self.samples,
+            "failures": self.failures,
+            "age_s": (datetime.now() - snapshot.taken_at).total_seconds() if snapshot else None,
+            "collect_ms": snapshot.collect_ms if snapshot else None,
+        }
+
+    def _llm_health(self) -> Tuple[str, Optional[str]]:
+        """Здоровье LLM по breaker'ам моделей и тип последней ошибки."""
+        unhealthy = [
+            breaker for breaker in list(self.client.breakers.values())
+            if breaker.state != CircuitBreaker.CLOSED
+        ]
+        if not unhealthy:
+            return LLM_OK, None
+        error = unhealthy[0].last_error_type
+        if len(unhealthy) == len(self.client.breakers) and all(
+            breaker.state == CircuitBreaker.OPEN for breaker in unhealthy
+        ):
+            return LLM_DOWN, error
+        return LLM_DEGRADED, error
+
+    @staticmethod
+    def _cpu_percent() -> Optional[float]:
+        """Загрузка CPU с прошлого вызова, без блокирующего ожидания."""
+        try:
+            return psutil.cpu_percent(interval=None)
+        except Exception:
+            return None
+
+    async def _run(self) -> None:
+        """Цикл периодического сбора."""
+        # Короткая пауза перед первым сбором, чтобы загрузка CPU была осмысленной
+        await asyncio.sleep(min(self.interval, 1.0))
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Status collection failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+# Глобальный экземпляр сборщика состояния
+status_collector = StatusCollector()
@@ -0,0 +1,102 @@
+"""Постепенная отправка потоковых ответов в Telegram."""
+import time
+from typing import AsyncIterator, List, Optional
+
+from aiogram.types import Message
+
+from src.config.settings import settings
+from src.llm.streaming import FallbackText
+from src.utils.logger import logger
+
+
+# Лимит длины одного сообщения Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class StreamingReply:
+    """
+    Показывает ответ LLM по мере генерации.
+
+    Первый фрагмент отправляется сразу через message.answer, дальше сообщение
+    обновляется через edit_message_text не чаще, чем раз в edit_interval секунд.
+    Если в потоке был FallbackText (ошибка или обрыв), complete станет False.
+    """
+
+    def __init__(self, message: Message, edit_interval: float = settings.STREAM_EDIT_INTERVAL) -> None:
+        """
+        Инициализация потокового ответа.
+
+        Args:
+            message: Входящее сообщение пользователя, на которое отвечаем
+            edit_interval: Минимальная пауза между редактированиями в секундах
+        """
+        self.message = message
+        self.edit_interval = edit_interval
+        self._parts: List[str] = []
+        self._sent: Optional[Message] = None
+        self._offset = 0  # Начало текста текущего сообщения в общем ответе
+        self._shown = ""
+        self._last_edit = 0.0
+        self.complete = True
+
+    async def consume(self, chunks: AsyncIterator[str]) -> str:
+        """
+        Показать поток фрагментов пользователю.
+
+        Args:
+            chunks: Асинхронный итератор текстовых фрагментов
+
+        Returns:
+            Полный текст ответа
+        """
+        async for delta in chunks:
+            if isinstance(delta, FallbackText):
+                self.complete = False
+            self._parts.append(delta)
+            text = "".join(self._parts)
+            if not text[self._offset:].strip():
+                continue
+
+            if self._sent is None:
+                await self._send_new(text)
+            elif len(text) - self._offset > TELEGRAM_MESSAGE_LIMIT:
+                await self._roll_over(text)
+            elif time.monotonic() - self._last_edit >= self.edit_interval:
+                await self._edit(text[self._offset:])
+
+        text = "".join(self._parts)
+        if self._sent is None:
+            if text.strip():
+                await self._send_new(text)
+        elif text[self._offset:] != self._shown:
+            await self._edit(text[self._offset:])
+        return text
+
+    async def _send_new(self, text: str) -> None:
+        """Отправить новое сообщение с текущим хвостом ответа."""
+        chunk = text[self._offset:self._offset + TELEGRAM_MESSAGE_LIMIT]
+        self._sent = await self.message.answer(chunk)
+        self._shown = chunk
+        self._last_edit = time.monotonic()
+
+    async def _roll_over(self, text: str) -> None:
+        """Дописать текущее сообщение до лимита и продолжить в новом."""
+        await self._edit(text[self._offset:self._offset + TELEGRAM_MESSAGE_LIMIT])
+        self._offset += TELEGRAM_MESSAGE_LIMIT
+        await self._send_new(text)
+
+    async def _edit(self, text: str) -> None:
+        """Обновить отправленное сообщение."""
+        self._last_edit = time.monotonic()
+        if text == self._shown:
+            return
+        try:
+            await self.message.bot.edit_message_text(
+                text=text,
+                chat_id=self._sent.chat.id,
+                message_id=self._sent.message_id,
+            )
+            self._shown = text
+        except Exception as e:
+            # Неудачное промежуточное редактирование не должно ронять ответ
+            logger.warning(f"Failed to edit streaming message: {e}")
@@ -0,0 +1,326 @@
+"""Супервизор: прием обновлений в одном процессе и обработка в N воркерах."""
+import asyncio
+import json
+import os
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Update
+
+from src.bot.sharding import HashRing, update_user_id
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Корень проекта: воркеры запускаются как python -m src.bot.worker
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKER_COMMAND = (sys.executable, "-m", "src.bot.worker")
+
+# Обновление в одну строку: JSON без пробелов и с кириллицей как есть
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+class WorkerProcess:
+    """
+    Один процесс-воркер и его обслуживание.
+
+    Обновления копятся в ограниченной очереди и пишутся в stdin воркера
+    пачками по строке на обновление. Воркер раз в heartbeat_interval пишет
+    в stdout пульс со счетчиками. Если процесс завершился или пульса нет
+    дольше heartbeat_timeout (например, event loop занят тяжелой работой),
+    процесс убивается и запускается заново с растущей паузой (на запуск
+    до первого пульса дается startup_timeout). Обновления,
+    уже отданные упавшему воркеру, теряются; ждущие в очереди достаются
+    новому процессу.
+    """
+
+    def __init__(self, index: int, command: Sequence[str] = WORKER_COMMAND,
+                 heartbeat_timeout: float = settings.WORKER_HEARTBEAT_TIMEOUT,
+                 startup_timeout: float = 60.0,
+                 queue_max: int = settings.WORKER_QUEUE_MAX,
+                 restart_delay: float = 1.0, max_restart_delay: float = 30.0) -> None:
+        """
+        Инициализация воркера.
+
+        Args:
+            index: Номер воркера (передается процессу как --index)
+            command: Команда запуска процесса
+            heartbeat_timeout: Сколько секунд без пульса считать воркер зависшим
+            startup_timeout: Сколько секунд ждать первого пульса после запуска
+            queue_max: Максимум обновлений в очереди к воркеру
+            restart_delay: Начальная пауза перед перезапуском
+            max_restart_delay: Максимальная пауза перед перезапуском
+        """
+        self.index = index
+        self.command = list(command)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.startup_timeout = startup_timeout
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._queue: "asyncio.Queue[bytes]" = asyncio.Queue(maxsize=queue_max)
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._last_heartbeat = 0.0
+        self._ready = asyncio.Event()  # Текущий процесс прислал пульс
+        self._handled_before = 0  # Обработано прежними процессами этого воркера
+
+        # Статистика (handled и in_flight - из пульса процесса)
+        self.sent = 0
+        self.dropped = 0
+        self.restarts = 0
+        self.handled = 0
+        self.in_flight = 0
+
+    @property
+    def alive(self) -> bool:
+        """Процесс запущен и еще не завершился."""
+        return self.process is not None and self.process.returncode is None
+
+    async def start(self) -> None:
+        """Запустить процесс и его обслуживание."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._supervise())
+
+    async def wait_ready(self) -> None:
+        """Дождаться первого пульса текущего процесса."""
+        await self._ready.wait()
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Закрыть stdin воркера, дать ему доделать начатое и остановить."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.alive:
+            # Отдать воркеру то, что успело накопиться, и закрыть его stdin
+            stdin = self.process.stdin
+            while not self._queue.empty():
+                stdin.write(self._queue.get_nowait())
+                self.sent += 1
+            try:
+                await stdin.drain()
+            except ConnectionError:
+                pass
+            stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+
+    def send(self, line: bytes) -> bool:
+        """
+        Поставить закодированное обновление в очередь воркера.
+
+        Returns:
+            False если очередь переполнена и обновление отброшено
+        """
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику воркера."""
+        return {
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.alive,
+            "queue_depth": self._queue.qsize(),
+            "sent": self.sent,
+            "handled": self.handled,
+            "in_flight": self.in_flight,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+        }
+
+    async def _supervise(self) -> None:
+        """Запускать процесс заново, пока обслуживание не отменят."""
+        delay = self.restart_delay
+        while True:
+            started = time.monotonic()
+            await self._run_once()
+            if time.monotonic() - started > self.max_restart_delay:
+                delay = self.restart_delay  # Воркер успел поработать - сбой не серийный
+            self.restarts += 1
+            logger.warning(f"Worker {self.index} stopped, restarting in {delay:.1f}s",
+                           **self.get_stats())
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    async def _run_once(self) -> None:
+        """Запустить процесс и обслуживать его до завершения или зависания."""
+        self.process = await asyncio.create_subprocess_exec(
+            *self.command, "--index", str(self.index),
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, cwd=PROJECT_ROOT,
+        )
+        self._ready.clear()
+        self._last_heartbeat = time.monotonic()
+        self._handled_before = self.handled
+        self.in_flight = 0
+        logger.info(f"Worker {self.index} started: pid={self.process.pid}")
+
+        tasks = [
+            asyncio.create_task(self._write_updates()),
+            asyncio.create_task(self._read_heartbeats()),
+            asyncio.create_task(self._watch_heartbeats()),
+        ]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # Сюда не попадаем при отмене: остановкой занимается close()
+        if self.alive:
+            self.process.kill()
+            await self.process.wait()
+
+    async def _write_updates(self) -> None:
+        """Писать обновления из очереди в stdin воркера."""
+        stdin = self.process.stdin
+        while True:
+            lines = [await self._queue.get()]
+            while not self._queue.empty() and len(lines) < 256:
+                lines.append(self._queue.get_nowait())
+            stdin.write(b"".join(lines))
+            self.sent += len(lines)
+            try:
+                await stdin.drain()
+            except ConnectionError:
+                return
+
+    async def _read_heartbeats(self) -> None:
+        """Читать пульс воркера до закрытия его stdout."""
+        while True:
+            line = await self.process.stdout.readline()
+            if not line:
+                return
+            try:
+                heartbeat = json.loads(line)
+            except ValueError:
+                continue
+            self._last_heartbeat = time.monotonic()
+            self._ready.set()
+            self.handled = self._handled_before + heartbeat.get("handled", 0)
+            self.in_flight = heartbeat.get("in_flight", self.in_flight)
+
+    async def _watch_heartbeats(self) -> None:
+        """Вернуть управление, когда пульса нет дольше heartbeat_timeout."""
+        while True:
+            timeout = self.heartbeat_timeout if self._ready.is_set() else self.startup_timeout
+            silence = time.monotonic() - self._last_heartbeat
+            if silence > timeout:
+                logger.error(f"Worker {self.index} missed heartbeats for {silence:.1f}s")
+                return
+            await asyncio.sleep(min(timeout - silence, self.heartbeat_timeout) + 0.01)
+
+
+class Supervisor:
+    """
+    Раздача обновлений воркерам по пользователю.
+
+    Пользователь всегда попадает на один и тот же воркер (консистентное
+    хеширование user_id), поэтому его история, очередь сообщений и кэши
+    живут в одном процессе, а тяжелая работа (изображения, JSON, регулярные
+    выражения) распределяется по ядрам.
+    """
+
+    def __init__(self, workers: int = settings.BOT_WORKERS,
+                 command: Sequence[str] = WORKER_COMMAND, **worker_options: Any) -> None:
+        """
+        Инициализация супервизора.
+
+        Args:
+            workers: Число процессов-воркеров
+            command: Команда запуска воркера
+            **worker_options: Параметры WorkerProcess
+        """
+        self.workers: List[WorkerProcess] = [
+            WorkerProcess(index, command, **worker_options) for index in range(workers)
+        ]
+        self.ring = HashRing(range(workers))
+        self.dispatched = 0
+
+    async def start(self) -> None:
+        """Запустить всех воркеров."""
+        for worker in self.workers:
+            await worker.start()
+        logger.info(f"Supervisor started {len(self.workers)} workers")
+
+    async def wait_ready(self) -> None:
+        """Дождаться, пока все воркеры запустятся."""
+        await asyncio.gather(*(worker.wait_ready() for worker in self.workers))
+
+    async def close(self) -> None:
+        """Остановить всех воркеров."""
+        await asyncio.gather(*(worker.close() for worker in self.workers))
+        logger.info("Supervisor stopped", **self.get_stats())
+
+    def worker_for(self, update: Dict[str, Any]) -> WorkerProcess:
+        """Воркер, который обрабатывает обновление."""
+        user_id = update_user_id(update)
+        key = user_id if user_id is not None else update.get("update_id")
+        return self.workers[self.ring.node_for(key)]
+
+    def dispatch(self, update: Dict[str, Any]) -> bool:
+        """
+        Передать сырое обновление воркеру его пользователя.
+
+        Returns:
+            False если очередь воркера переполнена
+        """
+        self.dispatched += 1
+        line = _encoder.encode(update).encode() + b"\n"
+        return self.worker_for(update).send(line)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику супервизора."""
+        stats = [worker.get_stats() for worker in self.workers]
+        return {
+            "workers": len(stats),
+            "alive": sum(1 for worker in stats if worker["alive"]),
+            "dispatched": self.dispatched,
+            "handled": sum(worker["handled"] for worker in stats),
+            "dropped": sum(worker["dropped"] for worker in stats),
+            "restarts": sum(worker["restarts"] for worker in stats),
+        }
+
+
+class ShardingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware диспетчера супервизора.
+
+    Обновление, принятое polling или webhook, не обрабатывается на месте,
+    а уходит воркеру; обработчики диспетчера супервизора не вызываются.
+    """
+
+    def __init__(self, supervisor: Supervisor) -> None:
+        self.supervisor = supervisor
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if isinstance(event, Update):
+            raw = event.model_dump(mode="json", by_alias=True, exclude_none=True)
+            if not self.supervisor.dispatch(raw):
+                logger.warning(f"Update {event.update_id} dropped: worker queue is full")
+        return None
+
+
+def create_routing_dispatcher(supervisor: Supervisor) -> Dispatcher:
+    """
+    Диспетчер процесса-супервизора: только раздача обновлений воркерам.
+
+    Обработчиков у него нет, поэтому типы обновлений для polling и webhook
+    передаются явно (BotHandlers.UPDATE_TYPES).
+    """
+    dp = Dispatcher()
+    dp.update.outer_middleware(ShardingMiddleware(supervisor))
+    return dp
@@ -0,0 +1,82 @@
+"""Прием обновлений Telegram через webhook на aiohttp."""
+import asyncio
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Заголовок, в котором Telegram присылает секрет webhook
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+HEALTH_PATH = "/healthz"
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str,
+                       path: str = settings.WEBHOOK_PATH) -> web.Application:
+    """
+    Создать aiohttp приложение, принимающее обновления.
+
+    Запрос без верного секрета получает 401. Telegram получает 200 сразу,
+    а обновление обрабатывается диспетчером в фоне.
+
+    Args:
+        dp: Диспетчер с зарегистрированными обработчиками
+        bot: Бот, от имени которого обрабатываются обновления
+        secret_token: Секрет, который Telegram передает в SECRET_HEADER
+        path: Путь webhook
+
+    Returns:
+        Приложение aiohttp
+    """
+    if not secret_token:
+        raise ValueError("Webhook secret token is required")
+
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, secret_token=secret_token).register(app, path=path)
+    # Проверка живости для балансировщика перед несколькими экземплярами
+    app.router.add_get(HEALTH_PATH, _health)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot,
+                      base_url: str = settings.WEBHOOK_URL,
+                      path: str = settings.WEBHOOK_PATH,
+                      host: str = settings.WEBHOOK_HOST,
+                      port: int = settings.WEBHOOK_PORT,
+                      secret_token: str = settings.WEBHOOK_SECRET,
+                      max_connections: int = settings.WEBHOOK_MAX_CONNECTIONS,
+                      allowed_updates: Optional[List[str]] = None) -> None:
+    """
+    Зарегистрировать webhook в Telegram и принимать обновления до отмены.
+
+    Секрет должен быть общим для всех экземпляров за балансировщиком:
+    set_webhook каждого экземпляра перезаписывает секрет в Telegram.
+    allowed_updates по умолчанию - типы обновлений обработчиков dp.
+    """
+    app = create_webhook_app(dp, bot, secret_token, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+        await bot.set_webhook(
+            url=base_url.rstrip("/") + path,
+            secret_token=secret_token,
+            allowed_updates=allowed_updates or dp.resolve_used_update_types(),
+            max_connections=max_connections,
+        )
+        logger.info(f"Webhook listening on {host}:{port}{path}, registered at {base_url}")
+        await asyncio.Event().wait()
+    finally:
+        # Webhook не снимаем: остальные экземпляры за балансировщиком продолжают работу
+        await runner.cleanup()
+
+
+async def _health(request: web.Request) -> web.Response:
+    """Ответ для проверки живости."""
+    return web.Response(text="ok")
@@ -0,0 +1,127 @@
+"""Процесс-воркер: обработка обновлений, которые раздает супервизор.
+
+Обновления приходят в stdin по одному JSON в строке, в stdout воркер пишет
+пульс со счетчиками. Логи идут в stderr, как в обычном режиме.
+
+Запускается супервизором (BOT_WORKERS > 1): python -m src.bot.worker --index N
+"""
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict, Optional, Set
+
+from aiogram import Bot, Dispatcher
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Предел длины одного обновления в stdin
+MAX_UPDATE_BYTES = 4 * 1024 * 1024
+
+
+class UpdateWorker:
+    """Чтение обновлений из stdin и их обработка диспетчером."""
+
+    def __init__(self, dp: Dispatcher, bot: Bot,
+                 heartbeat_interval: float = settings.WORKER_HEARTBEAT_INTERVAL) -> None:
+        """
+        Инициализация воркера.
+
+        Args:
+            dp: Диспетчер с зарегистрированными обработчиками
+            bot: Бот, от имени которого обрабатываются обновления
+            heartbeat_interval: Период пульса в секундах
+        """
+        self.dp = dp
+        self.bot = bot
+        self.heartbeat_interval = heartbeat_interval
+        self._tasks: Set["asyncio.Task[Any]"] = set()
+
+        # Статистика
+        self.received = 0
+        self.handled = 0
+        self.failures = 0
+
+    async def serve(self, reader: Optional[asyncio.StreamReader] = None) -> None:
+        """Обрабатывать обновления, пока супервизор не закроет stdin."""
+        if reader is None:
+            reader = asyncio.StreamReader(limit=MAX_UPDATE_BYTES)
+            loop = asyncio.get_running_loop()
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.received += 1
+                task = asyncio.create_task(self.dp.feed_raw_update(self.bot, json.loads(line)))
+                self._tasks.add(task)
+                task.add_done_callback(self._on_done)
+
+            # Супервизор закрыл stdin: доделываем начатое и выходим
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            heartbeat.cancel()
+            self._write_heartbeat()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику воркера (она же - содержимое пульса)."""
+        return {
+            "received": self.received,
+            "handled": self.handled,
+            "in_flight": len(self._tasks),
+            "failures": self.failures,
+        }
+
+    def _on_done(self, task: "asyncio.Task[Any]") -> None:
+        """Учесть завершенную обработку обновления."""
+        self._tasks.discard(task)
+        self.handled += 1
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+            logger.error(f"Failed to process update: {task.exception()}")
+
+    async def _heartbeat(self) -> None:
+        """Периодически сообщать супервизору, что event loop жив."""
+        while True:
+            self._write_heartbeat()
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def _write_heartbeat(self) -> None:
+        """Записать пульс в stdout (строка маленькая, запись не блокирует надолго)."""
+        sys.stdout.buffer.write(json.dumps(self.get_stats()).encode() + b"\n")
+        sys.stdout.buffer.flush()
+
+
+async def main(index: int) -> None:
+    """Поднять компоненты бота и обрабатывать обновления супервизора."""
+    # Импорт здесь: обработчики тянут за собой LLM клиент, историю и т.д.
+    from src.bot.handlers import BotHandlers, close_services, start_services
+
+    logger.info(f"Worker {index} starting...")
+    handlers = None
+    bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
+    try:
+        await start_services()
+        dp = Dispatcher()
+        handlers = BotHandlers(bot, dp)
+        await UpdateWorker(dp, bot).serve()
+    finally:
+        await close_services(handlers)
+        await bot.session.close()
+        logger.info(f"Worker {index} stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bot worker process")
+    parser.add_argument("--index", type=int, default=0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.index))
+    except KeyboardInterrupt:
+        pass
@@ -12,10 +12,27 @@ class Settings:
     
     # Telegram Bot
     TELEGRAM_BOT_TOKEN: str
+    BOT_MODE: str = "polling"  # polling или webhook
+    
+    # Webhook (BOT_MODE=webhook)
+    WEBHOOK_URL: str = ""  # Публичный адрес бота, например https://bot.example.com
+    WEBHOOK_PATH: str = "/telegram/webhook"
+    WEBHOOK_SECRET: str = ""  # Обязателен в режиме webhook, общий для всех экземпляров
+    WEBHOOK_HOST: str = "0.0.0.0"
+    WEBHOOK_PORT: int = 8080
+    WEBHOOK_MAX_CONNECTIONS: int = 40
+    
+    # Процессы-воркеры: 1 - все в одном процессе, больше - супервизор
+    # принимает обновления и раздает их воркерам по user_id
+    BOT_WORKERS: int = 1
+    WORKER_HEARTBEAT_INTERVAL: float = 2.0
+    WORKER_HEARTBEAT_TIMEOUT: float = 15.0
+    WORKER_QUEUE_MAX: int = 1000
     
     # OpenRouter LLM
     OPENROUTER_API_KEY: str
     OPENROUTER_MODEL: str = "openai/gpt-oss-20b:free"
+    LLM_BASE_URL: str = "https://openrouter.ai/api/v1"
     
 
     
@@ -23,6 +40,80 @@ class Settings:
     LLM_TIMEOUT: int = 10
     LLM_TEMPERATURE: float = 0.8
     LLM_RETRY_ATTEMPTS: int = 3
+    LLM_MAX_TOKENS: int = 500
+    LLM_CONTEXT_TOKENS: int = 6000
+    LLM_RETRY_BASE_DELAY: float = 1.0
+    LLM_RETRY_MAX_DELAY: float = 10.0
+    LLM_RETRY_BUDGET_RATIO: float = 0.2
+    LLM_RETRY_BUDGET_MIN_PER_SEC: float = 1.0
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5
+    LLM_BREAKER_RECOVERY_TIMEOUT: float = 30.0
+    LLM_CONCURRENCY_INITIAL: int = 10
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 64
+    LLM_QUEUE_MAX: int = 200
+    LLM_QUEUE_MAX_WAIT: float = 10.0
+    LLM_PROMPT_CACHING: bool = False
+    LLM_STREAMING: bool = False
+    STREAM_EDIT_INTERVAL: float = 1.0
+    
+    # Очередь сообщений пользователя: серия коротких сообщений - один запрос к LLM
+    DIALOG_DEBOUNCE: float = 0.0  # 0 - отвечать сразу, объединять пришедшие во время ответа
+    DIALOG_MAX_WAIT: float = 3.0
+    DIALOG_MAX_BATCH: int = 5
+    
+    # Очередь входящих обновлений: сверх нее - мгновенный ответ о перегрузке
+    ADMISSION_CONCURRENCY: int = 50
+    ADMISSION_QUEUE_MAX: int = 100
+    ADMISSION_QUEUE_MAX_WAIT: float = 5.0
+    
+    # Лимиты отправки в Telegram: сообщений в секунду на бота, в личный чат и в группу
+    TELEGRAM_GLOBAL_RATE: float = 30.0
+    TELEGRAM_CHAT_RATE: float = 1.0
+    TELEGRAM_GROUP_RATE: float = 20 / 60
+    TELEGRAM_CHAT_BURST: int = 3
+    TELEGRAM_SEND_MAX_RETRIES: int = 3
+    TELEGRAM_RETRY_AFTER_MAX: float = 60.0
+    
+    # Период фонового сбора снимка состояния для /status
+    STATUS_INTERVAL: float = 15.0
+    
+    # Фоновое сжатие длинных диалогов в сводку
+    LLM_SUMMARY_ENABLED: bool = True
+    LLM_SUMMARY_MODEL: str = ""  # Пусто - OPENROUTER_MODEL; с платной основной моделью задайте дешевую
+    LLM_SUMMARY_TRIGGER: int = 14
+    LLM_SUMMARY_KEEP: int = 6
+    LLM_SUMMARY_MAX_TOKENS: int = 300
+    
+    # История диалогов
+    SESSION_TTL: int = 3600
+    SESSION_EXPIRY_INTERVAL: float = 30.0
+    HISTORY_MAX_BYTES: int = 128 * 1024 * 1024  # 0 - без ограничения
+    HISTORY_COMPRESS_AFTER: float = 300.0  # 0 - не сжимать
+    HISTORY_BACKEND: str = "memory"  # memory, sqlite (один процесс) или redis
+    HISTORY_SQLITE_PATH: str = "data/history.db"
+    HISTORY_FLUSH_INTERVAL: float = 1.0
+    HISTORY_FLUSH_BATCH: int = 500
+    REDIS_URL: str = "redis://localhost:6379/0"
+    REDIS_KEY_PREFIX: str = "sarcastic_bot:history"
+    
+    # Кэш ответов LLM
+    LLM_CACHE_ENABLED: bool = True
+    LLM_CACHE_MAX_BYTES: int = 10 * 1024 * 1024
+    CACHE_TTL: int = 1800
+    
+    # Кэш анализов стикеров и картинок по file_unique_id
+    MEDIA_CACHE_ENABLED: bool = True
+    MEDIA_CACHE_MAX_BYTES: int = 4 * 1024 * 1024
+    MEDIA_CACHE_TTL: int = 24 * 3600
+    MEDIA_CACHE_STICKER_TTL: int = 7 * 24 * 3600
+    MEDIA_CACHE_PATH: str = ""  # Пусто - только в памяти
+    
+    # HTTP транспорт (пул соединений)
+    HTTP_POOL_LIMIT: int = 100
+    HTTP_POOL_LIMIT_PER_HOST: int = 30
+    HTTP_DNS_CACHE_TTL: int = 300
+    HTTP_KEEPALIVE_TIMEOUT: float = 60.0
     
     # Логирование
     LOG_LEVEL: str = "INFO"
@@ -33,12 +124,91 @@ class Settings:
         """Инициализация настроек с валидацией."""
         self.TELEGRAM_BOT_TOKEN = self._get_required_env("TELEGRAM_BOT_TOKEN")
         self.OPENROUTER_API_KEY = self._get_required_env("OPENROUTER_API_KEY")
-
+        
+        self.BOT_MODE = getenv("BOT_MODE", self.BOT_MODE).lower()
+        if self.BOT_MODE not in ("polling", "webhook"):
+            raise ValueError(f"Unknown BOT_MODE: {self.BOT_MODE}")
+        self.WEBHOOK_URL = getenv("WEBHOOK_URL", self.WEBHOOK_URL)
+        if self.BOT_MODE == "webhook" and not self.WEBHOOK_URL:
+            raise ValueError("Environment variable WEBHOOK_URL is required for BOT_MODE=webhook")
+        self.WEBHOOK_PATH = getenv("WEBHOOK_PATH", self.WEBHOOK_PATH)
+        self.WEBHOOK_SECRET = getenv("WEBHOOK_SECRET", self.WEBHOOK_SECRET)
+        if self.BOT_MODE == "webhook" and not self.WEBHOOK_SECRET:
+            raise ValueError("Environment variable WEBHOOK_SECRET is required for BOT_MODE=webhook")
+        self.WEBHOOK_HOST = getenv("WEBHOOK_HOST", self.WEBHOOK_HOST)
+        self.WEBHOOK_PORT = int(getenv("WEBHOOK_PORT", str(self.WEBHOOK_PORT)))
+        self.WEBHOOK_MAX_CONNECTIONS = int(getenv("WEBHOOK_MAX_CONNECTIONS", str(self.WEBHOOK_MAX_CONNECTIONS)))
+        self.BOT_WORKERS = int(getenv("BOT_WORKERS", str(self.BOT_WORKERS)))
+        self.WORKER_HEARTBEAT_INTERVAL = float(getenv("WORKER_HEARTBEAT_INTERVAL", str(self.WORKER_HEARTBEAT_INTERVAL)))
+        self.WORKER_HEARTBEAT_TIMEOUT = float(getenv("WORKER_HEARTBEAT_TIMEOUT", str(self.WORKER_HEARTBEAT_TIMEOUT)))
+        self.WORKER_QUEUE_MAX = int(getenv("WORKER_QUEUE_MAX", str(self.WORKER_QUEUE_MAX)))
         
         self.OPENROUTER_MODEL = getenv("OPENROUTER_MODEL", self.OPENROUTER_MODEL)
+        self.LLM_BASE_URL = getenv("LLM_BASE_URL", self.LLM_BASE_URL)
         self.LLM_TIMEOUT = int(getenv("LLM_TIMEOUT", str(self.LLM_TIMEOUT)))
         self.LLM_TEMPERATURE = float(getenv("LLM_TEMPERATURE", str(self.LLM_TEMPERATURE)))
         self.LLM_RETRY_ATTEMPTS = int(getenv("LLM_RETRY_ATTEMPTS", str(self.LLM_RETRY_ATTEMPTS)))
+        self.LLM_MAX_TOKENS = int(getenv("LLM_MAX_TOKENS", str(self.LLM_MAX_TOKENS)))
+        self.LLM_CONTEXT_TOKENS = int(getenv("LLM_CONTEXT_TOKENS", str(self.LLM_CONTEXT_TOKENS)))
+        self.LLM_RETRY_BASE_DELAY = float(getenv("LLM_RETRY_BASE_DELAY", str(self.LLM_RETRY_BASE_DELAY)))
+        self.LLM_RETRY_MAX_DELAY = float(getenv("LLM_RETRY_MAX_DELAY", str(self.LLM_RETRY_MAX_DELAY)))
+        self.LLM_RETRY_BUDGET_RATIO = float(getenv("LLM_RETRY_BUDGET_RATIO", str(self.LLM_RETRY_BUDGET_RATIO)))
+        self.LLM_RETRY_BUDGET_MIN_PER_SEC = float(getenv("LLM_RETRY_BUDGET_MIN_PER_SEC", str(self.LLM_RETRY_BUDGET_MIN_PER_SEC)))
+        self.LLM_BREAKER_FAILURE_THRESHOLD = int(getenv("LLM_BREAKER_FAILURE_THRESHOLD", str(self.LLM_BREAKER_FAILURE_THRESHOLD)))
+        self.LLM_BREAKER_RECOVERY_TIMEOUT = float(getenv("LLM_BREAKER_RECOVERY_TIMEOUT", str(self.LLM_BREAKER_RECOVERY_TIMEOUT)))
+        self.LLM_CONCURRENCY_INITIAL = int(getenv("LLM_CONCURRENCY_INITIAL", str(self.LLM_CONCURRENCY_INITIAL)))
+        self.LLM_CONCURRENCY_MIN = int(getenv("LLM_CONCURRENCY_MIN", str(self.LLM_CONCURRENCY_MIN)))
+        self.LLM_CONCURRENCY_MAX = int(getenv("LLM_CONCURRENCY_MAX", str(self.LLM_CONCURRENCY_MAX)))
+        self.LLM_QUEUE_MAX = int(getenv("LLM_QUEUE_MAX", str(self.LLM_QUEUE_MAX)))
+        self.LLM_QUEUE_MAX_WAIT = float(getenv("LLM_QUEUE_MAX_WAIT", str(self.LLM_QUEUE_MAX_WAIT)))
+        self.LLM_PROMPT_CACHING = getenv("LLM_PROMPT_CACHING", "false").lower() == "true"
+        self.LLM_STREAMING = getenv("LLM_STREAMING", "false").lower() == "true"
+        self.STREAM_EDIT_INTERVAL = float(getenv("STREAM_EDIT_INTERVAL", str(self.STREAM_EDIT_INTERVAL)))
+        
+        self.DIALOG_DEBOUNCE = float(getenv("DIALOG_DEBOUNCE", str(self.DIALOG_DEBOUNCE)))
+        self.DIALOG_MAX_WAIT = float(getenv("DIALOG_MAX_WAIT", str(self.DIALOG_MAX_WAIT)))
+        self.DIALOG_MAX_BATCH = int(getenv("DIALOG_MAX_BATCH", str(self.DIALOG_MAX_BATCH)))
+        self.ADMISSION_CONCURRENCY = int(getenv("ADMISSION_CONCURRENCY", str(self.ADMISSION_CONCURRENCY)))
+        self.ADMISSION_QUEUE_MAX = int(getenv("ADMISSION_QUEUE_MAX", str(self.ADMISSION_QUEUE_MAX)))
+        self.ADMISSION_QUEUE_MAX_WAIT = float(getenv("ADMISSION_QUEUE_MAX_WAIT", str(self.ADMISSION_QUEUE_MAX_WAIT)))
+        self.TELEGRAM_GLOBAL_RATE = float(getenv("TELEGRAM_GLOBAL_RATE", str(self.TELEGRAM_GLOBAL_RATE)))
+        self.TELEGRAM_CHAT_RATE = float(getenv("TELEGRAM_CHAT_RATE", str(self.TELEGRAM_CHAT_RATE)))
+        self.TELEGRAM_GROUP_RATE = float(getenv("TELEGRAM_GROUP_RATE", str(self.TELEGRAM_GROUP_RATE)))
+        self.TELEGRAM_CHAT_BURST = int(getenv("TELEGRAM_CHAT_BURST", str(self.TELEGRAM_CHAT_BURST)))
+        self.TELEGRAM_SEND_MAX_RETRIES = int(getenv("TELEGRAM_SEND_MAX_RETRIES", str(self.TELEGRAM_SEND_MAX_RETRIES)))
+        self.TELEGRAM_RETRY_AFTER_MAX = float(getenv("TELEGRAM_RETRY_AFTER_MAX", str(self.TELEGRAM_RETRY_AFTER_MAX)))
+        self.STATUS_INTERVAL = float(getenv("STATUS_INTERVAL", str(self.STATUS_INTERVAL)))
+        
+        self.LLM_SUMMARY_ENABLED = getenv("LLM_SUMMARY_ENABLED", "true").lower() == "true"
+        self.LLM_SUMMARY_MODEL = getenv("LLM_SUMMARY_MODEL", self.LLM_SUMMARY_MODEL) or self.OPENROUTER_MODEL
+        self.LLM_SUMMARY_TRIGGER = int(getenv("LLM_SUMMARY_TRIGGER", str(self.LLM_SUMMARY_TRIGGER)))
+        self.LLM_SUMMARY_KEEP = int(getenv("LLM_SUMMARY_KEEP", str(self.LLM_SUMMARY_KEEP)))
+        self.LLM_SUMMARY_MAX_TOKENS = int(getenv("LLM_SUMMARY_MAX_TOKENS", str(self.LLM_SUMMARY_MAX_TOKENS)))
+        
+        self.SESSION_TTL = int(getenv("SESSION_TTL", str(self.SESSION_TTL)))
+        self.SESSION_EXPIRY_INTERVAL = float(getenv("SESSION_EXPIRY_INTERVAL", str(self.SESSION_EXPIRY_INTERVAL)))
+        self.HISTORY_MAX_BYTES = int(getenv("HISTORY_MAX_BYTES", str(self.HISTORY_MAX_BYTES)))
+        self.HISTORY_COMPRESS_AFTER = float(getenv("HISTORY_COMPRESS_AFTER", str(self.HISTORY_COMPRESS_AFTER)))
+        self.HISTORY_BACKEND = getenv("HISTORY_BACKEND", self.HISTORY_BACKEND).lower()
+        self.HISTORY_SQLITE_PATH = getenv("HISTORY_SQLITE_PATH", self.HISTORY_SQLITE_PATH)
+        self.HISTORY_FLUSH_INTERVAL = float(getenv("HISTORY_FLUSH_INTERVAL", str(self.HISTORY_FLUSH_INTERVAL)))
+        self.HISTORY_FLUSH_BATCH = int(getenv("HISTORY_FLUSH_BATCH", str(self.HISTORY_FLUSH_BATCH)))
+        self.REDIS_URL = getenv("REDIS_URL", self.REDIS_URL)
+        self.REDIS_KEY_PREFIX = getenv("REDIS_KEY_PREFIX", self.REDIS_KEY_PREFIX)
+        
+        self.LLM_CACHE_ENABLED = getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.LLM_CACHE_MAX_BYTES = int(getenv("LLM_CACHE_MAX_BYTES", str(self.LLM_CACHE_MAX_BYTES)))
+        self.CACHE_TTL = int(getenv("CACHE_TTL", str(self.CACHE_TTL)))
+        self.MEDIA_CACHE_ENABLED = getenv("MEDIA_CACHE_ENABLED", "true").lower() == "true"
+        self.MEDIA_CACHE_MAX_BYTES = int(getenv("MEDIA_CACHE_MAX_BYTES", str(self.MEDIA_CACHE_MAX_BYTES)))
+        self.MEDIA_CACHE_TTL = int(getenv("MEDIA_CACHE_TTL", str(self.MEDIA_CACHE_TTL)))
+        self.MEDIA_CACHE_STICKER_TTL = int(getenv("MEDIA_CACHE_STICKER_TTL", str(self.MEDIA_CACHE_STICKER_TTL)))
+        self.MEDIA_CACHE_PATH = getenv("MEDIA_CACHE_PATH", self.MEDIA_CACHE_PATH)
+        
+        self.HTTP_POOL_LIMIT = int(getenv("HTTP_POOL_LIMIT", str(self.HTTP_POOL_LIMIT)))
+        self.HTTP_POOL_LIMIT_PER_HOST = int(getenv("HTTP_POOL_LIMIT_PER_HOST", str(self.HTTP_POOL_LIMIT_PER_HOST)))
+        self.HTTP_DNS_CACHE_TTL = int(getenv("HTTP_DNS_CACHE_TTL", str(self.HTTP_DNS_CACHE_TTL)))
+        self.HTTP_KEEPALIVE_TIMEOUT = float(getenv("HTTP_KEEPALIVE_TIMEOUT", str(self.HTTP_KEEPALIVE_TIMEOUT)))
         
         self.LOG_LEVEL = getenv("LOG_LEVEL", self.LOG_LEVEL)
         self.LOG_FILE = getenv("LOG_FILE", self.LOG_FILE)
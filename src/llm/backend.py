@@ -0,0 +1,55 @@
+"""Бэкенд LLM: OpenAI-совместимый chat/completions endpoint."""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from src.config.settings import settings
+from src.llm.transport import HttpTransport, http_transport
+
+
+class LLMBackend:
+    """
+    Адрес, заголовки и транспорт chat/completions API.
+
+    Общий для LLMClient и ImageProcessor. По умолчанию это OpenRouter,
+    но LLM_BASE_URL можно направить на любой совместимый сервер, например
+    на локальный FakeOpenRouter для нагрузочных тестов без расхода квоты.
+    """
+
+    def __init__(self, base_url: str = settings.LLM_BASE_URL,
+                 api_key: str = settings.OPENROUTER_API_KEY,
+                 transport: Optional[HttpTransport] = None) -> None:
+        """
+        Инициализация бэкенда.
+
+        Args:
+            base_url: Базовый адрес API (без /chat/completions)
+            api_key: Ключ API
+            transport: HTTP транспорт (по умолчанию общий http_transport)
+        """
+        self.base_url = base_url.rstrip("/")
+        self.chat_url = f"{self.base_url}/chat/completions"
+        self.headers: Dict[str, str] = {
+            "Authorization": f"Bearer {api_key}",
+            "HTTP-Referer": "https://github.com/your-repo",  # Required by OpenRouter
+            "X-Title": "Sarcastic Bot",  # Optional
+            "Content-Type": "application/json"
+        }
+        self._transport = transport
+
+    @asynccontextmanager
+    async def post(self, **kwargs: Any) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Отправить запрос chat/completions.
+
+        Args:
+            **kwargs: Аргументы запроса (data/json, timeout)
+        """
+        transport = self._transport or http_transport
+        async with transport.post(self.chat_url, headers=self.headers, **kwargs) as response:
+            yield response
+
+
+# Глобальный экземпляр бэкенда
+llm_backend = LLMBackend()
@@ -0,0 +1,73 @@
+"""Отбор контекста диалога по бюджету токенов."""
+from typing import Dict, List, Optional, Sequence
+
+from src.config.settings import settings
+from src.utils.tokens import estimate_tokens
+
+
+class ContextBudgeter:
+    """
+    Упаковка истории диалога в бюджет токенов.
+    
+    Берет самые свежие сообщения, пока они помещаются в лимит контекста
+    за вычетом системного промпта, текущего сообщения и места под ответ.
+    """
+    
+    def __init__(self, max_context_tokens: int = settings.LLM_CONTEXT_TOKENS,
+                 reserved_tokens: int = settings.LLM_MAX_TOKENS,
+                 max_messages: Optional[int] = None) -> None:
+        """
+        Инициализация бюджетировщика.
+        
+        Args:
+            max_context_tokens: Лимит токенов на весь запрос
+            reserved_tokens: Токены, зарезервированные под ответ модели
+            max_messages: Дополнительный лимит на количество сообщений
+        """
+        self.max_context_tokens = max_context_tokens
+        self.reserved_tokens = reserved_tokens
+        self.max_messages = max_messages
+    
+    def select(self, context_messages: Sequence[Dict[str, str]], fixed_tokens: int) -> List[Dict[str, str]]:
+        """
+        Выбрать последние сообщения, помещающиеся в бюджет.
+        
+        Args:
+            context_messages: История диалога в формате API, от старых к новым
+            fixed_tokens: Токены, которые уйдут в запрос в любом случае
+            
+        Returns:
+            Суффикс истории, помещающийся в бюджет
+        """
+        return list(context_messages[self.select_start(context_messages, fixed_tokens):])
+    
+    def select_start(self, context_messages: Sequence[Dict[str, str]], fixed_tokens: int) -> int:
+        """
+        Индекс начала суффикса истории, помещающегося в бюджет (без копирования).
+        
+        Если у списка есть атрибут token_counts (см. HistoryManager), используются
+        заранее посчитанные оценки, иначе токены оцениваются на месте.
+        """
+        budget = self.max_context_tokens - self.reserved_tokens - fixed_tokens
+        token_counts = getattr(context_messages, "token_counts", None)
+        if token_counts is not None and len(token_counts) != len(context_messages):
+            token_counts = None
+        
+        limit = len(context_messages)
+        if self.max_messages is not None:
+            limit = min(limit, self.max_messages)
+        
+        start = len(context_messages)
+        used = 0
+        while len(context_messages) - start < limit:
+            index = start - 1
+            if token_counts is not None:
+                tokens = token_counts[index]
+            else:
+                tokens = estimate_tokens(context_messages[index]["content"])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start = index
+        
+        return start
@@ -0,0 +1,180 @@
+"""Кэш ответов LLM с объединением одинаковых запросов."""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Примерные накладные расходы на одну запись (ключ, кортеж, узел OrderedDict)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class ResponseCache:
+    """
+    LRU кэш ответов с TTL и бюджетом памяти.
+
+    Одинаковые запросы, пришедшие одновременно, разделяют один вызов
+    upstream (single-flight), а не отправляют несколько копий в OpenRouter.
+    """
+
+    def __init__(self, max_bytes: int = settings.LLM_CACHE_MAX_BYTES,
+                 ttl: int = settings.CACHE_TTL) -> None:
+        """
+        Инициализация кэша.
+
+        Args:
+            max_bytes: Бюджет памяти кэша в байтах
+            ttl: Время жизни записи в секундах
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (ответ, время истечения, размер записи)
+        self._entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Future[str]"] = {}
+        self.total_bytes = 0
+
+        # Счетчики
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model: str, temperature: float, system_prompt: str,
+                 context_messages: Optional[List[Dict[str, str]]], message: str) -> str:
+        """
+        Построить ключ кэша из параметров запроса.
+
+        Пробелы в тексте нормализуются, чтобы "привет " и "привет" совпадали.
+        Вместо полного системного промпта можно передать его хэш.
+        """
+        context = [
+            [msg.get("role", ""), _normalize(msg.get("content", ""))]
+            for msg in context_messages or []
+        ]
+        raw = json.dumps(
+            [model, temperature, system_prompt, context, _normalize(message)],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Получить ответ из кэша или None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Получить ответ из кэша с учетом в статистике попаданий."""
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """
+        Сохранить ответ в кэше, вытесняя старые записи при превышении бюджета.
+
+        Args:
+            key: Ключ кэша
+            value: Ответ
+            ttl: Время жизни этой записи (по умолчанию - ttl кэша)
+        """
+        size = len(value.encode("utf-8")) + len(key) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), size)
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    async def get_or_compute(self, key: str,
+                             compute: Callable[[], Awaitable[Tuple[str, bool]]]) -> str:
+        """
+        Вернуть ответ из кэша или вычислить его один раз для всех ожидающих.
+
+        Args:
+            key: Ключ кэша
+            compute: Корутина, возвращающая (ответ, можно ли его кэшировать)
+
+        Returns:
+            Ответ LLM
+        """
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        cached = self.lookup(key)
+        if cached is not None:
+            return cached
+
+        future: "asyncio.Future[str]" = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value, cacheable = await compute()
+            if cacheable:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Помечаем исключение прочитанным: ожидающих может и не быть
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша."""
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        """Очистить кэш."""
+        self._entries.clear()
+        self.total_bytes = 0
+        logger.debug("Response cache cleared")
+
+    def _remove(self, key: str) -> None:
+        """Удалить запись и уменьшить учет памяти."""
+        _, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+
+def _normalize(text: str) -> str:
+    """Нормализовать текст: обрезать края и схлопнуть пробелы."""
+    return " ".join(text.split())
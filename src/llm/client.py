@@ -1,31 +1,63 @@
 """HTTP клиент для работы с OpenRouter API."""
 import asyncio
+import hashlib
 import json
 import time
-from typing import Optional, Dict, Any
+from itertools import islice
+from typing import Optional, Dict, Any, AsyncIterator, Callable, List, Tuple
 import aiohttp
 from aiohttp import ClientTimeout, ClientError
 
 from src.config.settings import settings
+from src.llm.backend import LLMBackend, llm_backend
+from src.llm.budget import ContextBudgeter
+from src.llm.cache import ResponseCache
+from src.llm.limiter import AdaptiveLimiter, ConcurrencyLimitExceeded
+from src.llm.payload import PayloadEncoder, PayloadMessages, build_system_message
+from src.llm.resilience import (
+    CircuitBreaker, LLMRequestError, compute_backoff, parse_retry_after, retry_budget
+)
+from src.llm.streaming import FallbackText, iter_sse_deltas
+from src.llm.timings import RequestTimings, latency_recorder
 from src.utils.logger import logger
+from src.utils.tokens import estimate_tokens
 
 
 class LLMClient:
     """Клиент для работы с OpenRouter API."""
     
-    def __init__(self) -> None:
-        """Инициализация клиента."""
-        self.api_url = "https://openrouter.ai/api/v1/chat/completions"
-        self.headers = {
-            "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-            "HTTP-Referer": "https://github.com/your-repo",  # Required by OpenRouter
-            "X-Title": "Sarcastic Bot",  # Optional
-            "Content-Type": "application/json"
-        }
+    def __init__(self, backend: Optional[LLMBackend] = None) -> None:
+        """
+        Инициализация клиента.
+        
+        Args:
+            backend: Бэкенд API (по умолчанию общий llm_backend)
+        """
+        self.backend = backend or llm_backend
         self.timeout = ClientTimeout(total=settings.LLM_TIMEOUT)
+        # Для стриминга ограничиваем паузу между фрагментами, а не всю генерацию
+        self.stream_timeout = ClientTimeout(total=None, sock_read=settings.LLM_TIMEOUT)
         
         # Загружаем системный промпт
         self.system_prompt = self._load_system_prompt()
+        self.system_prompt_hash = hashlib.sha256(self.system_prompt.encode("utf-8")).hexdigest()
+        self.system_prompt_tokens = estimate_tokens(self.system_prompt)
+        
+        # Системное сообщение одно на все запросы, его JSON кодируется один раз
+        self.system_message = build_system_message(self.system_prompt, settings.LLM_PROMPT_CACHING)
+        self.payload_encoder = PayloadEncoder(self.system_message)
+        
+        # Отбор истории по бюджету токенов (не более 19 сообщений: 20-1 для нового)
+        self.budgeter = ContextBudgeter(max_messages=self._get_max_context_messages() - 1)
+        
+        # Кэш одинаковых запросов (например, первых сообщений без истории)
+        self.response_cache = ResponseCache()
+        
+        # Circuit breaker на каждую модель
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        
+        # Адаптивный лимит одновременных запросов к OpenRouter
+        self.limiter = AdaptiveLimiter()
         
     def _load_system_prompt(self) -> str:
         """Загрузка системного промпта из файла."""
@@ -67,38 +99,250 @@ class LLMClient:
                    user_id=user_id, context_size=context_size)
         
         payload = self._prepare_payload(user_message, context_messages)
-        start_time = time.time()
+        
+        if not settings.LLM_CACHE_ENABLED:
+            response, _ = await self._request_with_retries(payload, user_id, context_size)
+            return response
+        
+        cache_key = self._make_cache_key(user_message, context_messages)
+        return await self.response_cache.get_or_compute(
+            cache_key, lambda: self._request_with_retries(payload, user_id, context_size)
+        )
+    
+    async def _request_with_retries(self, payload: Dict[str, Any], user_id: str,
+                                    context_size: int) -> Tuple[str, bool]:
+        """
+        Выполнить запрос с retry логикой.
+        
+        Returns:
+            (ответ, True) при успехе или (fallback сообщение, False) после всех попыток
+        """
+        async def attempt(timings: RequestTimings, slot: Any) -> AsyncIterator[str]:
+            yield await self._make_request(payload, timings)
+        
+        parts = [part async for part in self._run_attempts(payload, user_id, context_size, attempt)]
+        return "".join(parts), not any(isinstance(part, FallbackText) for part in parts)
+    
+    async def _run_attempts(self, payload: Dict[str, Any], user_id: str, context_size: int,
+                            attempt: Callable[[RequestTimings, Any], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Общий цикл запроса: circuit breaker, слот лимитера, повторы и фазы.
+        
+        Args:
+            payload: Тело запроса
+            user_id: ID пользователя для логирования
+            context_size: Размер контекста для логирования
+            attempt: Одна попытка attempt(timings, slot), отдающая фрагменты ответа
+            
+        Yields:
+            Фрагменты ответа модели; fallback сообщение - как FallbackText
+        """
+        model = payload["model"]
+        request_timings = RequestTimings()  # backoff и total за весь запрос
+        start_time = time.monotonic()
+        breaker = self._get_breaker(model)
+        retry_budget.record_request()
         
         # Попытки отправки с retry логикой
-        for attempt in range(settings.LLM_RETRY_ATTEMPTS):
+        for attempt_number in range(settings.LLM_RETRY_ATTEMPTS):
+            if not breaker.allow_request():
+                self._record_request_timings(model, "circuit_open", request_timings, start_time)
+                yield FallbackText(self._get_open_circuit_response(breaker, user_id))
+                return
+            
+            started = False
+            timings = RequestTimings()
+            queued_at = time.monotonic()
             try:
-                response = await self._make_request(payload)
-                response_time = (time.time() - start_time) * 1000
-                logger.log_llm_request(user_id, settings.OPENROUTER_MODEL, context_size, response_time)
-                return response
+                async with self.limiter.slot() as slot:
+                    timings.add("queue", time.monotonic() - queued_at)
+                    async for part in attempt(timings, slot):
+                        started = True
+                        yield part
+                breaker.record_success()
+                latency_recorder.record(model, "ok", timings)
+                response_time = self._record_request_timings(model, "ok", request_timings, start_time)
+                logger.log_llm_request(user_id, model, context_size, response_time)
+                return
                 
+            except ConcurrencyLimitExceeded as e:
+                latency_recorder.observe(model, "overload", "queue", time.monotonic() - queued_at)
+                self._record_request_timings(model, "overload", request_timings, start_time)
+                yield FallbackText(self._get_overload_response(e, user_id))
+                return
             except Exception as e:
                 error_type = self._classify_error(e)
+                latency_recorder.record(model, error_type, timings)
+                breaker.record_failure(error_type, getattr(e, "retry_after", None))
                 logger.log_llm_error(user_id, error_type, str(e))
                 
-                if attempt < settings.LLM_RETRY_ATTEMPTS - 1:
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
-                else:
-                    logger.error(f"All LLM attempts failed with {error_type}, using fallback",
-                               user_id=user_id, error_type=error_type)
-                    return self._get_fallback_response(error_type)
+                # Часть ответа уже у пользователя - повтор продублирует текст,
+                # поэтому дописываем пометку, что ответ оборвался
+                if started:
+                    self._record_request_timings(model, error_type, request_timings, start_time)
+                    logger.error(f"LLM stream interrupted with {error_type}",
+                               user_id=user_id, error_type=error_type, attempts=attempt_number + 1)
+                    yield FallbackText(self._get_interrupted_response())
+                    return
+                delay = self._get_retry_delay(attempt_number, e, error_type)
+                if delay is None:
+                    self._record_request_timings(model, error_type, request_timings, start_time)
+                    logger.error(f"LLM request failed with {error_type}, using fallback",
+                               user_id=user_id, error_type=error_type, attempts=attempt_number + 1)
+                    yield FallbackText(self._get_fallback_response(error_type))
+                    return
+                with request_timings.measure("backoff"):
+                    await asyncio.sleep(delay)
+    
+    def _get_retry_delay(self, attempt: int, error: Exception, error_type: str) -> Optional[float]:
+        """
+        Задержка перед следующей попыткой или None, если повторять не нужно.
+        
+        Не повторяем: последнюю попытку, ошибки авторизации, слишком долгий
+        Retry-After и запросы сверх общего бюджета повторов.
+        """
+        if attempt >= settings.LLM_RETRY_ATTEMPTS - 1 or error_type == "auth_error":
+            return None
+        
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None and retry_after > settings.LLM_RETRY_MAX_DELAY:
+            return None
+        
+        if not retry_budget.try_acquire():
+            logger.warning("Retry budget exhausted, skipping retry", error_type=error_type)
+            return None
+        
+        if retry_after is not None:
+            return retry_after
+        return compute_backoff(attempt)
+    
+    def _record_request_timings(self, model: str, outcome: str,
+                                request_timings: RequestTimings, start_time: float) -> float:
+        """Учесть паузы между повторами и общее время запроса; вернуть общее время в мс."""
+        total = time.monotonic() - start_time
+        request_timings.add("total", total)
+        latency_recorder.record(model, outcome, request_timings)
+        return total * 1000
+    
+    def _get_overload_response(self, error: ConcurrencyLimitExceeded, user_id: str) -> str:
+        """Fallback, когда запрос не дождался слота в очереди к LLM."""
+        logger.warning(f"LLM request shed by concurrency limiter: {error}",
+                      user_id=user_id, **self.limiter.get_stats())
+        return self._get_fallback_response("rate_limit")
+    
+    def _get_interrupted_response(self) -> str:
+        """Пометка в конце ответа, оборвавшегося на середине."""
+        return (
+            "\n\n✂️ Ответ оборвался на полуслове: связь с моим гениальным разумом прервалась. "
+            "Спроси еще раз, если тебе так нужна вторая половина."
+        )
+    
+    def _get_breaker(self, model: str) -> CircuitBreaker:
+        """Получить circuit breaker для модели."""
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker()
+        return self.breakers[model]
+    
+    def _get_open_circuit_response(self, breaker: CircuitBreaker, user_id: str) -> str:
+        """Мгновенный fallback, пока цепь разомкнута."""
+        error_type = breaker.last_error_type or "server_error"
+        logger.warning(f"Circuit open, skipping LLM request ({error_type})",
+                      user_id=user_id, error_type=error_type)
+        return self._get_fallback_response(error_type)
+    
+    def _make_cache_key(self, user_message: str, context_messages: Optional[list]) -> str:
+        """Ключ кэша для запроса с текущими настройками модели."""
+        return self.response_cache.make_key(
+            settings.OPENROUTER_MODEL, settings.LLM_TEMPERATURE,
+            self.system_prompt_hash, context_messages, user_message
+        )
+    
+    async def stream_message(self, user_message: str, context_messages: Optional[list] = None,
+                             user_id: str = "unknown") -> AsyncIterator[str]:
+        """
+        Отправить сообщение в LLM в потоковом режиме.
+        
+        Args:
+            user_message: Сообщение пользователя
+            context_messages: Предыдущие сообщения для контекста
+            user_id: ID пользователя для логирования
+            
+        Yields:
+            Фрагменты ответа по мере генерации или fallback сообщение (FallbackText) при ошибке
+        """
+        context_size = len(context_messages) if context_messages else 0
+        logger.info(f"Streaming message to LLM: {user_message[:100]}...",
+                   user_id=user_id, context_size=context_size)
+        
+        cache_key = self._make_cache_key(user_message, context_messages)
+        if settings.LLM_CACHE_ENABLED:
+            cached = self.response_cache.lookup(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        
+        payload = self._prepare_payload(user_message, context_messages)
+        payload["stream"] = True
+        
+        async def attempt(timings: RequestTimings, slot: Any) -> AsyncIterator[str]:
+            async for delta in self._stream_request(payload, timings):
+                # Для лимитера важна задержка до первого фрагмента, а не длина ответа
+                slot.set_latency(slot.elapsed())
+                yield delta
+        
+        parts = []
+        async for part in self._run_attempts(payload, user_id, context_size, attempt):
+            parts.append(part)
+            yield part
+        if settings.LLM_CACHE_ENABLED and not any(isinstance(part, FallbackText) for part in parts):
+            self.response_cache.put(cache_key, "".join(parts).strip())
+    
+    async def complete(self, messages: List[Dict[str, Any]], model: str, max_tokens: int,
+                       temperature: float = 0.3) -> str:
+        """
+        Одиночный запрос без повторов и fallback ответов (для фоновых задач).
+        
+        Занимает слот общего лимитера с низким приоритетом: фоновая задача
+        не обгоняет ответы пользователям и не превышает лимит параллелизма.
+        
+        Raises:
+            LLMRequestError: цепь для модели разомкнута
+            ConcurrencyLimitExceeded: не дождались слота лимитера
+            Exception: ошибка запроса
+        """
+        breaker = self._get_breaker(model)
+        if not breaker.allow_request():
+            raise LLMRequestError(f"Circuit open for model {model}")
+        
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        async with self.limiter.slot(background=True):
+            try:
+                response = await self._make_request(payload)
+            except Exception as e:
+                breaker.record_failure(self._classify_error(e), getattr(e, "retry_after", None))
+                raise
+        breaker.record_success()
+        return response
     
     def _prepare_payload(self, user_message: str, context_messages: Optional[list] = None) -> Dict[str, Any]:
         """Подготовить payload для запроса к OpenRouter."""
-        # Начинаем с системного промпта
-        messages = [{"role": "system", "content": self.system_prompt}]
+        # Начинаем с системного промпта (общий объект - см. PayloadEncoder)
+        messages = PayloadMessages([self.system_message])
         
         # Добавляем контекст из истории (исключая последнее user сообщение)
         if context_messages:
-            # Фильтруем контекст: берем не более 19 сообщений (20-1 для нового)
-            context_to_add = context_messages[-(self._get_max_context_messages() - 1):]
-            messages.extend(context_to_add)
-            logger.debug(f"Added {len(context_to_add)} context messages to payload")
+            # Берем свежие сообщения, пока они помещаются в бюджет токенов
+            fixed_tokens = self.system_prompt_tokens + estimate_tokens(user_message)
+            start = self.budgeter.select_start(context_messages, fixed_tokens)
+            messages.extend(islice(context_messages, start, None))
+            messages.context = context_messages
+            messages.context_start = start
+            logger.debug(f"Added {len(context_messages) - start}/{len(context_messages)} context messages to payload")
         
         # Добавляем текущее сообщение пользователя
         messages.append({"role": "user", "content": user_message})
@@ -107,40 +351,70 @@ class LLMClient:
             "model": settings.OPENROUTER_MODEL,
             "messages": messages,
             "temperature": settings.LLM_TEMPERATURE,
-            "max_tokens": 500
+            "max_tokens": settings.LLM_MAX_TOKENS
         }
     
     def _get_max_context_messages(self) -> int:
         """Получить максимальное количество сообщений в контексте."""
         return 20  # Согласно vision.md
     
-    async def _make_request(self, payload: Dict[str, Any]) -> str:
-        """Выполнить HTTP запрос к OpenRouter API."""
-        async with aiohttp.ClientSession(timeout=self.timeout) as session:
-            async with session.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload
-            ) as response:
-                
-                if response.status == 429:
-                    raise Exception("Rate limit exceeded")
-                elif response.status == 401:
-                    raise Exception("Invalid API key")
-                elif response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"API error {response.status}: {error_text}")
-                
-                data = await response.json()
-                
-                # Извлекаем ответ из JSON
-                try:
-                    message_content = data["choices"][0]["message"]["content"]
-                    logger.info(f"LLM response: {message_content[:100]}...")
-                    return message_content.strip()
-                except (KeyError, IndexError) as e:
-                    logger.error(f"Unexpected API response format: {data}")
-                    raise Exception(f"Invalid response format: {e}")
+    async def _make_request(self, payload: Dict[str, Any], timings: Optional[RequestTimings] = None) -> str:
+        """
+        Выполнить HTTP запрос к OpenRouter API.
+        
+        Args:
+            payload: Тело запроса
+            timings: Куда записать фазы connect/ttfb/body/parse
+        """
+        timings = timings or RequestTimings()
+        async with self.backend.post(
+            data=self.payload_encoder.encode(payload),
+            timeout=self.timeout,
+            trace_request_ctx=timings
+        ) as response:
+            await self._check_response_status(response)
+            with timings.measure("body"):
+                body = await response.read()
+            with timings.measure("parse"):
+                data = json.loads(body)
+            
+            # Извлекаем ответ из JSON
+            try:
+                message_content = data["choices"][0]["message"]["content"]
+                logger.info(f"LLM response: {message_content[:100]}...")
+                return message_content.strip()
+            except (KeyError, IndexError) as e:
+                logger.error(f"Unexpected API response format: {data}")
+                raise Exception(f"Invalid response format: {e}")
+    
+    async def _stream_request(self, payload: Dict[str, Any],
+                              timings: Optional[RequestTimings] = None) -> AsyncIterator[str]:
+        """Выполнить потоковый HTTP запрос к OpenRouter API (body - весь поток)."""
+        timings = timings or RequestTimings()
+        async with self.backend.post(
+            data=self.payload_encoder.encode(payload),
+            timeout=self.stream_timeout,
+            trace_request_ctx=timings
+        ) as response:
+            await self._check_response_status(response)
+            body_started = time.monotonic()
+            async for delta in iter_sse_deltas(response):
+                yield delta
+            timings.add("body", time.monotonic() - body_started)
+    
+    async def _check_response_status(self, response: aiohttp.ClientResponse) -> None:
+        """Проверить HTTP статус ответа OpenRouter."""
+        if response.status == 200:
+            return
+        
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status == 429:
+            raise LLMRequestError("Rate limit exceeded", response.status, retry_after)
+        elif response.status == 401:
+            raise LLMRequestError("Invalid API key", response.status)
+        else:
+            error_text = await response.text()
+            raise LLMRequestError(f"API error {response.status}: {error_text}", response.status, retry_after)
     
     def _classify_error(self, error: Exception) -> str:
         """Классификация типов ошибок для специфичных ответов."""
@@ -0,0 +1,236 @@
+"""Локальный имитатор OpenRouter для нагрузочных тестов без расхода квоты.
+
+Запуск: python -m src.llm.fake_openrouter --port 8081 --latency 0.5 --rate-limit-rate 0.05
+и LLM_BASE_URL=http://127.0.0.1:8081/api/v1 в .env бота.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+
+from src.utils.logger import logger
+
+
+CHAT_PATH = "/api/v1/chat/completions"
+
+
+@dataclass
+class FakeOpenRouterConfig:
+    """Поведение имитатора."""
+    latency: float = 0.2  # Средняя задержка до первого байта ответа, с
+    latency_sigma: float = 0.5  # Разброс логнормального распределения (0 - постоянная)
+    error_rate: float = 0.0  # Доля ответов 500
+    rate_limit_rate: float = 0.0  # Доля ответов 429
+    retry_after: float = 1.0  # Значение Retry-After для 429
+    max_concurrency: Optional[int] = None  # Сверх лимита одновременных запросов - 429
+    chunk_delay: float = 0.02  # Пауза между SSE фрагментами, с
+    reply: str = "Ну конечно, именно этого вопроса мне и не хватало для полного счастья."
+
+
+class FakeOpenRouter:
+    """
+    aiohttp сервер с API chat/completions в формате OpenRouter.
+
+    Задержка ответа берется из логнормального распределения с заданным
+    средним, часть запросов получает 500 или 429 с Retry-After. Запросы
+    со stream=true получают SSE поток по словам ответа.
+    """
+
+    def __init__(self, config: Optional[FakeOpenRouterConfig] = None, seed: Optional[int] = None) -> None:
+        """
+        Инициализация имитатора.
+
+        Args:
+            config: Параметры поведения
+            seed: Зерно генератора случайных чисел для воспроизводимости
+        """
+        self.config = config or FakeOpenRouterConfig()
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+        # Статистика
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.streamed = 0
+
+    def make_app(self) -> web.Application:
+        """Создать aiohttp приложение (например, для aiohttp TestServer)."""
+        app = web.Application()
+        app.router.add_post(CHAT_PATH, self._handle_chat)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Запустить сервер.
+
+        Args:
+            host: Адрес прослушивания
+            port: Порт (0 - выбрать свободный)
+
+        Returns:
+            Базовый адрес API для LLM_BASE_URL
+        """
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_host, bound_port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{bound_host}:{bound_port}/api/v1"
+        logger.info(f"Fake OpenRouter listening on {self.base_url}")
+        return self.base_url
+
+    async def close(self) -> None:
+        """Остановить сервер."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику имитатора."""
+        return {
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "streamed": self.streamed,
+        }
+
+    def sample_latency(self) -> float:
+        """Случайная задержка с заданным средним."""
+        mean = self.config.latency
+        sigma = self.config.latency_sigma
+        if mean <= 0:
+            return 0.0
+        if sigma <= 0:
+            return mean
+        # Для логнормального распределения среднее = exp(mu + sigma^2 / 2)
+        mu = math.log(mean) - sigma ** 2 / 2
+        return self._random.lognormvariate(mu, sigma)
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        """Обработчик POST chat/completions."""
+        self.requests += 1
+        if not request.headers.get("Authorization", "").startswith("Bearer "):
+            return web.json_response({"error": {"message": "No auth credentials found", "code": 401}}, status=401)
+
+        payload = await request.json()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            over_limit = (
+                self.config.max_concurrency is not None
+                and self.in_flight > self.config.max_concurrency
+            )
+            if over_limit or self._random.random() < self.config.rate_limit_rate:
+                self.rate_limited += 1
+                return web.json_response(
+                    {"error": {"message": "Rate limit exceeded", "code": 429}},
+                    status=429,
+                    headers={"Retry-After": f"{self.config.retry_after:g}"},
+                )
+
+            await asyncio.sleep(self.sample_latency())
+
+            if self._random.random() < self.config.error_rate:
+                self.errors += 1
+                return web.json_response({"error": {"message": "Internal server error", "code": 500}}, status=500)
+
+            if payload.get("stream"):
+                return await self._stream_reply(request, payload)
+            return web.json_response(self._completion(payload))
+        finally:
+            self.in_flight -= 1
+
+    async def _stream_reply(self, request: web.Request, payload: Dict[str, Any]) -> web.StreamResponse:
+        """Отдать ответ SSE потоком по словам."""
+        self.streamed += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+
+        words = self.config.reply.split(" ")
+        for index, word in enumerate(words):
+            delta = word if index == 0 else f" {word}"
+            chunk = {
+                "id": "fake",
+                "model": payload.get("model"),
+                "choices": [{"index": 0, "delta": {"content": delta}}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            if self.config.chunk_delay > 0:
+                await asyncio.sleep(self.config.chunk_delay)
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    def _completion(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Тело обычного (не потокового) ответа."""
+        return {
+            "id": "fake",
+            "model": payload.get("model"),
+            "created": int(time.time()),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.config.reply},
+                    "finish_reason": "stop",
+                }
+            ],
+        }
+
+
+async def _serve(host: str, port: int, config: FakeOpenRouterConfig, seed: Optional[int]) -> None:
+    """Запустить имитатор до прерывания."""
+    server = FakeOpenRouter(config, seed)
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    """Точка входа командной строки."""
+    defaults = FakeOpenRouterConfig()
+    parser = argparse.ArgumentParser(description="Fake OpenRouter server for offline load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=defaults.latency)
+    parser.add_argument("--latency-sigma", type=float, default=defaults.latency_sigma)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after)
+    parser.add_argument("--max-concurrency", type=int, default=None)
+    parser.add_argument("--chunk-delay", type=float, default=defaults.chunk_delay)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeOpenRouterConfig(
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        max_concurrency=args.max_concurrency,
+        chunk_delay=args.chunk_delay,
+    )
+    try:
+        asyncio.run(_serve(args.host, args.port, config, args.seed))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Адаптивный лимит одновременных запросов к LLM."""
+import asyncio
+import time
+from collections import deque
+from types import TracebackType
+from typing import Any, Deque, Dict, Optional, Type
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+class ConcurrencyLimitExceeded(Exception):
+    """Запрос не дождался свободного слота (очередь переполнена или ожидание истекло)."""
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Признак перегрузки upstream: 429 или таймаут."""
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    if getattr(error, "status", None) == 429:
+        return True
+    error_str = str(error).lower()
+    return "rate limit" in error_str or "timeout" in error_str
+
+
+class LimiterSlot:
+    """Слот лимитера: при входе ждет очереди, при выходе сообщает задержку и исход."""
+
+    def __init__(self, limiter: "AdaptiveLimiter", background: bool = False) -> None:
+        self._limiter = limiter
+        self._background = background
+        self._started = 0.0
+        self._latency: Optional[float] = None
+
+    def set_latency(self, latency: float) -> None:
+        """Задать задержку явно (например, время до первого фрагмента потока)."""
+        if self._latency is None:
+            self._latency = latency
+
+    def elapsed(self) -> float:
+        """Время с момента получения слота."""
+        return time.monotonic() - self._started
+
+    async def __aenter__(self) -> "LimiterSlot":
+        await self._limiter.acquire(self._background)
+        self._started = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]],
+                        exc: Optional[BaseException], tb: Optional[TracebackType]) -> None:
+        latency = self._latency if self._latency is not None else self.elapsed()
+        self._limiter.release(latency, exc)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD контроллер параллелизма для исходящих запросов к LLM.
+
+    Пока задержка остается около базовой, лимит растет примерно на единицу
+    за "окно" из limit успешных запросов. На 429 и таймаутах лимит
+    уменьшается вдвое. Избыточные запросы ждут в ограниченной очереди.
+    Фоновые запросы (сводки истории) ждут в отдельной очереди и получают
+    слот, только когда в основной никого нет.
+    """
+
+    def __init__(self, initial_limit: int = settings.LLM_CONCURRENCY_INITIAL,
+                 min_limit: int = settings.LLM_CONCURRENCY_MIN,
+                 max_limit: int = settings.LLM_CONCURRENCY_MAX,
+                 max_queue: int = settings.LLM_QUEUE_MAX,
+                 max_wait: float = settings.LLM_QUEUE_MAX_WAIT,
+                 latency_tolerance: float = 2.0,
+                 backoff_ratio: float = 0.5) -> None:
+        """
+        Инициализация лимитера.
+
+        Args:
+            initial_limit: Начальный лимит одновременных запросов
+            min_limit: Нижняя граница лимита
+            max_limit: Верхняя граница лимита
+            max_queue: Максимальная длина очереди ожидания
+            max_wait: Максимальное ожидание слота в секундах
+            latency_tolerance: Во сколько раз задержка может превышать базовую
+            backoff_ratio: Множитель лимита при перегрузке
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.latency_tolerance = latency_tolerance
+        self.backoff_ratio = backoff_ratio
+
+        self.in_flight = 0
+        self.base_latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+        self._background: Deque["asyncio.Future[None]"] = deque()
+
+        # Статистика
+        self.rejected = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def slot(self, background: bool = False) -> LimiterSlot:
+        """Слот для использования в async with (background - низкий приоритет)."""
+        return LimiterSlot(self, background)
+
+    async def acquire(self, background: bool = False) -> None:
+        """
+        Дождаться свободного слота.
+
+        Args:
+            background: Фоновый запрос - пропускает вперед все запросы пользователей
+
+        Raises:
+            ConcurrencyLimitExceeded: очередь переполнена или ожидание истекло
+        """
+        queue = self._background if background else self._waiters
+        if self.in_flight < int(self.limit) and not self._waiters and not queue:
+            self.in_flight += 1
+            return
+
+        if len(queue) >= self.max_queue:
+            self.rejected += 1
+            raise ConcurrencyLimitExceeded("LLM queue is full (rate limit)")
+
+        future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        queue.append(future)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан в момент отмены - возвращаем его
+                self.release(None, None)
+            else:
+                future.cancel()
+                self._remove_waiter(queue, future)
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+                raise ConcurrencyLimitExceeded("LLM queue wait timeout (rate limit)") from e
+            raise
+        finally:
+            self._record_wait(time.monotonic() - started)
+
+    def release(self, latency: Optional[float], error: Optional[BaseException]) -> None:
+        """
+        Освободить слот и скорректировать лимит.
+
+        Args:
+            latency: Задержка запроса в секундах (None - не учитывать)
+            error: Исключение запроса, если он завершился ошибкой
+        """
+        self.in_flight -= 1
+        if error is not None:
+            if is_overload_error(error):
+                self._decrease()
+        elif latency is not None:
+            self._on_success(latency)
+        self._wake_waiters()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику лимитера."""
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "background_depth": len(self._background),
+            "base_latency_ms": (self.base_latency or 0.0) * 1000,
+            "wait_avg_ms": (self.wait_total / self.waits * 1000) if self.waits else 0.0,
+            "wait_max_ms": self.wait_max * 1000,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+    def _on_success(self, latency: float) -> None:
+        """Аддитивное увеличение, пока задержка не растет."""
+        if self.base_latency is None or latency < self.base_latency:
+            self.base_latency = latency
+        else:
+            # Базовая задержка медленно подтягивается вверх, чтобы пережить смену модели
+            self.base_latency = self.base_latency * 0.99 + latency * 0.01
+
+        if latency <= self.base_latency * self.latency_tolerance:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+
+    def _decrease(self) -> None:
+        """Мультипликативное уменьшение при перегрузке."""
+        # Пачка одновременных 429 - это один сигнал, а не десять
+        now = time.monotonic()
+        if now - self._last_decrease < (self.base_latency or 1.0):
+            return
+        self._last_decrease = now
+        
+        old_limit = int(self.limit)
+        self.limit = max(float(self.min_limit), self.limit * self.backoff_ratio)
+        if int(self.limit) != old_limit:
+            logger.warning(f"LLM concurrency limit decreased: {old_limit} -> {int(self.limit)}")
+
+    def _wake_waiters(self) -> None:
+        """Выдать освободившиеся слоты ожидающим: сначала основной очереди, затем фоновой."""
+        for queue in (self._waiters, self._background):
+            while queue and self.in_flight < int(self.limit):
+                future = queue.popleft()
+                if future.done():
+                    continue
+                self.in_flight += 1
+                future.set_result(None)
+
+    @staticmethod
+    def _remove_waiter(queue: Deque["asyncio.Future[None]"], future: "asyncio.Future[None]") -> None:
+        """Убрать ожидающего из очереди."""
+        try:
+            queue.remove(future)
+        except ValueError:
+            pass
+
+    def _record_wait(self, wait: float) -> None:
+        """Учесть время ожидания в очереди."""
+        self.waits += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
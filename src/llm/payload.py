@@ -0,0 +1,134 @@
+"""Сериализация запросов к LLM с заранее закодированным префиксом."""
+import json
+from typing import Any, Dict, Hashable, Optional, Sequence, Tuple
+
+
+def build_system_message(system_prompt: str, prompt_caching: bool = False) -> Dict[str, Any]:
+    """
+    Построить системное сообщение.
+
+    Args:
+        system_prompt: Текст системного промпта
+        prompt_caching: Добавить маркер cache_control для кэширования промпта
+            на стороне провайдера (Anthropic/Gemini через OpenRouter)
+
+    Returns:
+        Системное сообщение в формате OpenAI API
+    """
+    if not prompt_caching:
+        return {"role": "system", "content": system_prompt}
+    return {
+        "role": "system",
+        "content": [
+            {
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ]
+    }
+
+
+# Общий кодировщик: json.dumps с параметрами создает новый на каждый вызов
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _dumps(value: Any) -> bytes:
+    """Компактный JSON в UTF-8 (без \\uXXXX для кириллицы)."""
+    return _encoder.encode(value).encode("utf-8")
+
+
+class PayloadMessages(list):
+    """
+    Сообщения запроса со ссылкой на снимок истории, из которого они взяты.
+
+    Если снимок умеет отдавать готовый JSON (ContextMessages.encoded),
+    PayloadEncoder не сериализует историю заново.
+    """
+
+    __slots__ = ("context", "context_start")
+
+    def __init__(self, messages: Sequence[Dict[str, Any]] = (), context: Optional[Sequence[Dict[str, Any]]] = None,
+                 context_start: int = 0) -> None:
+        super().__init__(messages)
+        self.context = context
+        self.context_start = context_start
+
+
+class PayloadEncoder:
+    """
+    Кодирует payload chat/completions в байты.
+
+    Начало тела запроса - параметры модели и системный промпт - одинаково
+    для всех запросов, поэтому кодируется один раз и кэшируется. На каждый
+    запрос сериализуется только хвост: история и новое сообщение, а если
+    история взята из снимка с готовым JSON (PayloadMessages), - только
+    новое сообщение.
+    """
+
+    def __init__(self, system_message: Dict[str, Any]) -> None:
+        """
+        Инициализация кодировщика.
+
+        Args:
+            system_message: Системное сообщение, которое всегда идет первым
+        """
+        self.system_message = system_message
+        self._prefixes: Dict[Tuple[Tuple[str, Hashable], ...], bytes] = {}
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        """
+        Закодировать payload в JSON.
+
+        Если первое сообщение не тот же объект system_message, payload
+        кодируется целиком без кэша.
+        """
+        messages = payload.get("messages")
+        if not messages or messages[0] is not self.system_message:
+            return _dumps(payload)
+
+        params = tuple((key, value) for key, value in payload.items() if key != "messages")
+        try:
+            prefix = self._prefixes.get(params)
+        except TypeError:
+            # Нехэшируемые параметры (списки, словари) - без кэша
+            return _dumps(payload)
+
+        if prefix is None:
+            prefix = self._build_prefix(params)
+
+        if len(messages) == 1:
+            return prefix + b"]}"
+
+        history = self._encoded_history(messages)
+        if history is not None:
+            # История уже закодирована в снимке - сериализуем только новое сообщение
+            last = _dumps(messages[-1])
+            if not history:
+                return b"".join((prefix, b",", last, b"]}"))
+            return b"".join((prefix, b",", history, b",", last, b"]}"))
+
+        # Хвост сериализуем одним вызовом и срезаем его квадратные скобки
+        tail = _dumps(messages[1:])
+        return b"".join((prefix, b",", tail[1:-1], b"]}"))
+
+    @staticmethod
+    def _encoded_history(messages: Sequence[Dict[str, Any]]) -> Optional[bytes]:
+        """Готовый JSON истории между системным и последним сообщением или None."""
+        context = getattr(messages, "context", None)
+        encoded = getattr(context, "encoded", None)
+        if encoded is None:
+            return None
+        start = messages.context_start
+        if len(messages) != len(context) - start + 2:
+            return None
+        return encoded(start)
+
+    def _build_prefix(self, params: Tuple[Tuple[str, Hashable], ...]) -> bytes:
+        """Закодировать и запомнить префикс до конца системного сообщения."""
+        head = dict(params)
+        head["messages"] = [self.system_message]
+        # Отрезаем закрывающие "]}", чтобы дописывать сообщения после системного
+        prefix = _dumps(head)[:-2]
+        self._prefixes[params] = prefix
+        return prefix
@@ -0,0 +1,185 @@
+"""Circuit breaker и бюджет повторов для запросов к LLM."""
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from src.config.settings import settings
+
+
+class LLMRequestError(Exception):
+    """Ошибка HTTP запроса к LLM с кодом ответа и подсказкой Retry-After."""
+
+    def __init__(self, message: str, status: Optional[int] = None,
+                 retry_after: Optional[float] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Разобрать заголовок Retry-After.
+
+    Args:
+        value: Число секунд или HTTP-дата
+
+    Returns:
+        Задержка в секундах или None, если заголовок отсутствует/некорректен
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def compute_backoff(attempt: int, base_delay: float = settings.LLM_RETRY_BASE_DELAY,
+                    max_delay: float = settings.LLM_RETRY_MAX_DELAY) -> float:
+    """Экспоненциальная задержка с полным джиттером (0..base * 2^attempt)."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker для одной модели.
+
+    После failure_threshold ошибок подряд цепь размыкается, и запросы сразу
+    получают fallback. По истечении recovery_timeout (или Retry-After от
+    upstream) пропускается один пробный запрос: успех замыкает цепь,
+    ошибка размыкает её снова.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = settings.LLM_BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout: float = settings.LLM_BREAKER_RECOVERY_TIMEOUT) -> None:
+        """
+        Инициализация breaker.
+
+        Args:
+            failure_threshold: Количество ошибок подряд до размыкания
+            recovery_timeout: Пауза перед пробным запросом в секундах
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.last_error_type: Optional[str] = None
+        self.rejected = 0
+        self._open_until = 0.0
+        self._probe_started: Optional[float] = None
+
+    def allow_request(self) -> bool:
+        """Можно ли отправить запрос upstream прямо сейчас."""
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and now >= self._open_until:
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+
+        if self.state == self.HALF_OPEN:
+            # Один пробный запрос; зависший пробник не блокирует цепь навсегда
+            probe_stale = (
+                self._probe_started is not None
+                and now - self._probe_started >= self.recovery_timeout
+            )
+            if self._probe_started is None or probe_stale:
+                self._probe_started = now
+                return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        """Учесть успешный запрос."""
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self, error_type: str, retry_after: Optional[float] = None) -> None:
+        """
+        Учесть неудачный запрос.
+
+        Args:
+            error_type: Тип ошибки из LLMClient._classify_error
+            retry_after: Подсказка upstream, когда можно повторить
+        """
+        self.failures += 1
+        self.last_error_type = error_type
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._probe_started = None
+            self._open_until = time.monotonic() + max(self.recovery_timeout, retry_after or 0.0)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить состояние breaker."""
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "last_error_type": self.last_error_type,
+        }
+
+
+class RetryBudget:
+    """
+    Общий на процесс бюджет повторов (token bucket).
+
+    Каждый запрос пополняет бюджет на ratio токена, каждый повтор тратит
+    один токен. Так во время сбоя повторы составляют не больше ratio
+    от основного трафика и не усиливают нагрузку на upstream.
+    """
+
+    def __init__(self, ratio: float = settings.LLM_RETRY_BUDGET_RATIO,
+                 min_per_second: float = settings.LLM_RETRY_BUDGET_MIN_PER_SEC,
+                 max_tokens: float = 10.0) -> None:
+        """
+        Инициализация бюджета.
+
+        Args:
+            ratio: Доля повторов относительно запросов
+            min_per_second: Минимальное пополнение при малом трафике
+            max_tokens: Максимальный запас повторов
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0
+        self._updated_at = time.monotonic()
+
+    def record_request(self) -> None:
+        """Учесть новый (не повторный) запрос."""
+        self._refill()
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """Попробовать потратить токен на повтор."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def _refill(self) -> None:
+        """Пополнить бюджет по времени."""
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        self.tokens = min(self.max_tokens, self.tokens + elapsed * self.min_per_second)
+
+
+# Бюджет повторов общий для всех клиентов процесса
+retry_budget = RetryBudget()
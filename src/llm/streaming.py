@@ -0,0 +1,48 @@
+"""Разбор потоковых (SSE) ответов OpenRouter."""
+import json
+from typing import AsyncIterator
+
+import aiohttp
+
+
+class FallbackText(str):
+    """
+    Текст не от модели: fallback сообщение или пометка об ошибке.
+
+    Показывается пользователю как обычный фрагмент, но ответ, в котором он
+    есть, не считается полным: такой ответ не кэшируется.
+    """
+
+
+async def iter_sse_deltas(response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+    """
+    Разобрать SSE поток chat/completions и вернуть текстовые дельты.
+
+    Args:
+        response: Ответ aiohttp с Content-Type text/event-stream
+
+    Yields:
+        Очередной фрагмент текста ответа
+    """
+    async for raw_line in response.content:
+        line = raw_line.decode("utf-8").strip()
+
+        # Пустые строки разделяют события, строки с ":" - комментарии (keep-alive)
+        if not line or line.startswith(":") or not line.startswith("data:"):
+            continue
+
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise Exception(f"Stream error: {chunk['error']}")
+
+        choices = chunk.get("choices") or []
+        if not choices:
+            continue
+
+        delta = choices[0].get("delta", {}).get("content")
+        if delta:
+            yield delta
@@ -0,0 +1,158 @@
+"""Фоновое сжатие длинных диалогов в сводку."""
+import asyncio
+from typing import Any, Dict, List, Optional, Set
+
+from src.config.settings import settings
+from src.llm.client import LLMClient, llm_client
+from src.utils.history import DialogMessage, HistoryManager, history_manager
+from src.utils.logger import logger
+
+
+SUMMARY_INSTRUCTION = (
+    "Ты сжимаешь историю диалога пользователя с саркастическим ботом. "
+    "Кратко перескажи по-русски факты о пользователе, его вопросы, договоренности "
+    "и темы, к которым он может вернуться. Без оценок и шуток, не больше 8 предложений."
+)
+
+ROLE_LABELS = {"user": "Пользователь", "assistant": "Бот"}
+
+
+class HistorySummarizer:
+    """
+    Фоновое сжатие ранней части диалога дешевой моделью.
+
+    Когда история пользователя дорастает до trigger сообщений, пользователь
+    ставится в очередь. Единственный фоновый обработчик заменяет все сообщения,
+    кроме keep последних, сводкой. Ответы пользователю сжатия не ждут, а
+    один обработчик ограничивает фоновую нагрузку на upstream одним запросом.
+    """
+
+    def __init__(self, history: HistoryManager = history_manager,
+                 client: LLMClient = llm_client,
+                 model: str = settings.LLM_SUMMARY_MODEL,
+                 trigger: int = settings.LLM_SUMMARY_TRIGGER,
+                 keep: int = settings.LLM_SUMMARY_KEEP,
+                 max_tokens: int = settings.LLM_SUMMARY_MAX_TOKENS) -> None:
+        """
+        Инициализация компактора.
+
+        Args:
+            history: Менеджер истории
+            client: LLM клиент для запросов сводки
+            model: Модель для сводок
+            trigger: Длина истории, с которой начинается сжатие
+            keep: Сколько последних сообщений оставлять дословно
+            max_tokens: Лимит токенов сводки
+        """
+        self.history = history
+        self.client = client
+        self.model = model
+        self.trigger = trigger
+        self.keep = keep
+        self.max_tokens = max_tokens
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._pending: Set[str] = set()
+        self._worker: Optional["asyncio.Task[None]"] = None
+
+        # Статистика
+        self.compactions = 0
+        self.compacted_messages = 0
+        self.failures = 0
+
+    async def start(self) -> None:
+        """Запустить фоновый обработчик."""
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+            logger.info(f"History summarizer started: model={self.model}, trigger={self.trigger}, keep={self.keep}")
+
+    async def close(self) -> None:
+        """Остановить фоновый обработчик."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    def schedule(self, user_id: str) -> bool:
+        """
+        Поставить диалог в очередь на сжатие, если он достаточно длинный.
+
+        Returns:
+            True если пользователь добавлен в очередь
+        """
+        if self._worker is None or user_id in self._pending:
+            return False
+        if self.history.get_user_message_count(user_id) < self.trigger:
+            return False
+
+        self._pending.add(user_id)
+        self._queue.put_nowait(user_id)
+        return True
+
+    async def compact(self, user_id: str) -> bool:
+        """
+        Сжать раннюю часть диалога пользователя.
+
+        Returns:
+            True если сводка применена
+        """
+        batch, previous = self.history.get_compaction_batch(user_id, self.keep)
+        if not batch:
+            return False
+
+        summary = await self.client.complete(
+            self._build_messages(batch, previous), self.model, self.max_tokens
+        )
+        if not summary:
+            return False
+
+        if not self.history.apply_summary(user_id, batch, summary):
+            return False
+
+        self.compactions += 1
+        self.compacted_messages += len(batch)
+        logger.info(f"Compacted {len(batch)} messages into summary for user {user_id}")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику сжатия."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "compactions": self.compactions,
+            "compacted_messages": self.compacted_messages,
+            "failures": self.failures,
+        }
+
+    async def _run(self) -> None:
+        """Цикл фонового обработчика."""
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self.compact(user_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Не получилось - попробуем при следующем сообщении
+                self.failures += 1
+                logger.warning(f"Failed to compact history for user {user_id}: {e}")
+            finally:
+                self._pending.discard(user_id)
+                self._queue.task_done()
+
+    def _build_messages(self, batch: List[DialogMessage], previous: Optional[str]) -> List[Dict[str, str]]:
+        """Построить запрос сводки: инструкция и стенограмма."""
+        lines = []
+        if previous:
+            lines.append(f"Прежняя сводка: {previous}")
+        for msg in batch:
+            lines.append(f"{ROLE_LABELS.get(msg.role, msg.role)}: {msg.content}")
+        return [
+            {"role": "system", "content": SUMMARY_INSTRUCTION},
+            {"role": "user", "content": "\n".join(lines)}
+        ]
+
+
+# Глобальный экземпляр компактора
+history_summarizer = HistorySummarizer()
@@ -0,0 +1,146 @@
+"""Пофазные задержки запросов к LLM и гистограммы по моделям."""
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Tuple
+
+
+# Фазы запроса:
+# queue - ожидание слота лимитера, connect - от начала запроса до отправки
+# заголовков (пул, DNS, TCP+TLS), ttfb - до заголовков ответа, body - чтение
+# тела (или всего SSE потока), parse - разбор JSON, backoff - паузы между
+# повторами, total - весь запрос с повторами
+PHASES = ("queue", "connect", "ttfb", "body", "parse", "backoff", "total")
+
+# Верхние границы корзин гистограммы в миллисекундах
+BUCKET_BOUNDS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+
+
+class RequestTimings:
+    """
+    Фазы одного запроса в секундах (по time.monotonic).
+
+    Передается в aiohttp как trace_request_ctx: trace хуки HttpTransport
+    отмечают начало запроса, отправку заголовков и получение ответа.
+    """
+
+    def __init__(self) -> None:
+        self.phases: Dict[str, float] = {}
+        self.started_at = 0.0
+        self.headers_sent_at = 0.0
+
+    def add(self, phase: str, seconds: float) -> None:
+        """Добавить время к фазе (повторы суммируются)."""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        """Измерить блок кода как фазу."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, time.monotonic() - started)
+
+    def on_request_start(self) -> None:
+        """Начало запроса (trace хук)."""
+        self.started_at = time.monotonic()
+
+    def on_headers_sent(self) -> None:
+        """Заголовки запроса отправлены (trace хук)."""
+        self.headers_sent_at = time.monotonic()
+        if self.started_at:
+            self.add("connect", self.headers_sent_at - self.started_at)
+
+    def on_response_start(self) -> None:
+        """Получены заголовки ответа (trace хук)."""
+        if self.headers_sent_at:
+            self.add("ttfb", time.monotonic() - self.headers_sent_at)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными логарифмическими корзинами."""
+
+    def __init__(self) -> None:
+        self.counts: List[int] = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """Учесть значение в секундах."""
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q: float) -> float:
+        """Оценка перцентиля в мс (верхняя граница корзины, не больше максимума)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                bound = BUCKET_BOUNDS_MS[index] if index < len(BUCKET_BOUNDS_MS) else self.max
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        """Сводка гистограммы."""
+        return {
+            "count": self.count,
+            "avg_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max,
+        }
+
+
+class LatencyRecorder:
+    """Гистограммы задержек по (модель, исход, фаза)."""
+
+    def __init__(self) -> None:
+        # Исход: "ok" или класс ошибки из LLMClient._classify_error
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+
+    def observe(self, model: str, outcome: str, phase: str, seconds: float) -> None:
+        """Учесть одну фазу."""
+        key = (model, outcome, phase)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = Histogram()
+        histogram.observe(seconds)
+
+    def record(self, model: str, outcome: str, timings: RequestTimings) -> None:
+        """Учесть все измеренные фазы запроса."""
+        for phase, seconds in timings.phases.items():
+            self.observe(model, outcome, phase, seconds)
+
+    def get_stats(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        Сводка по всем гистограммам.
+
+        Returns:
+            {"модель|исход": {фаза: snapshot}}
+        """
+        stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for (model, outcome, phase), histogram in sorted(self._histograms.items()):
+            stats.setdefault(f"{model}|{outcome}", {})[phase] = histogram.snapshot()
+        return stats
+
+    def get_phase(self, model: str, outcome: str, phase: str) -> Dict[str, float]:
+        """Сводка одной фазы (пустая, если данных нет)."""
+        histogram = self._histograms.get((model, outcome, phase)) or Histogram()
+        return histogram.snapshot()
+
+    def clear(self) -> None:
+        """Сбросить все гистограммы."""
+        self._histograms.clear()
+
+
+# Глобальный накопитель задержек LLM и vision запросов
+latency_recorder = LatencyRecorder()
@@ -0,0 +1,162 @@
+"""Общий HTTP транспорт с пулом keep-alive соединений."""
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from src.config.settings import settings
+from src.llm.timings import RequestTimings
+from src.utils.logger import logger
+
+
+class HttpTransport:
+    """
+    Долгоживущая aiohttp сессия, общая для LLMClient и ImageProcessor.
+
+    Держит пул keep-alive соединений с DNS кэшем и лимитом на хост,
+    поэтому повторные запросы к OpenRouter не платят за TCP+TLS рукопожатие.
+    """
+
+    def __init__(
+        self,
+        limit: int = settings.HTTP_POOL_LIMIT,
+        limit_per_host: int = settings.HTTP_POOL_LIMIT_PER_HOST,
+        dns_cache_ttl: int = settings.HTTP_DNS_CACHE_TTL,
+        keepalive_timeout: float = settings.HTTP_KEEPALIVE_TIMEOUT,
+    ) -> None:
+        """
+        Инициализация транспорта.
+
+        Args:
+            limit: Максимум соединений в пуле
+            limit_per_host: Максимум соединений на один хост
+            dns_cache_ttl: Время жизни DNS кэша в секундах
+            keepalive_timeout: Сколько держать простаивающее соединение открытым
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Статистика пула
+        self._in_use = 0
+        self._requests = 0
+        self._connections_created = 0
+        self._connections_reused = 0
+        self._acquire_waits = 0
+        self._acquire_wait_total = 0.0
+        self._acquire_wait_max = 0.0
+
+    async def start(self) -> None:
+        """Открыть сессию и пул соединений."""
+        self._get_session()
+        logger.info(
+            f"HTTP transport started: limit={self.limit}, "
+            f"limit_per_host={self.limit_per_host}, dns_ttl={self.dns_cache_ttl}"
+        )
+
+    async def close(self) -> None:
+        """Закрыть сессию и все соединения пула."""
+        if self._session and not self._session.closed:
+            await self._session.close()
+            logger.info("HTTP transport closed", **self.get_stats())
+        self._session = None
+
+    @asynccontextmanager
+    async def post(self, url: str, **kwargs: Any) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        Выполнить POST запрос через общий пул.
+
+        Соединение считается занятым, пока открыт контекст ответа.
+        Если передан trace_request_ctx=RequestTimings, в него пишутся фазы
+        connect и ttfb.
+        """
+        session = self._get_session()
+        self._in_use += 1
+        self._requests += 1
+        try:
+            async with session.post(url, **kwargs) as response:
+                yield response
+        finally:
+            self._in_use -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику пула соединений."""
+        avg_wait = self._acquire_wait_total / self._acquire_waits if self._acquire_waits else 0.0
+        return {
+            "connections_in_use": self._in_use,
+            "requests_total": self._requests,
+            "connections_created": self._connections_created,
+            "connections_reused": self._connections_reused,
+            "acquire_waits": self._acquire_waits,
+            "acquire_wait_avg_ms": avg_wait * 1000,
+            "acquire_wait_max_ms": self._acquire_wait_max * 1000,
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Получить сессию, создав её при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self._create_trace_config()],
+            )
+        return self._session
+
+    def _create_trace_config(self) -> aiohttp.TraceConfig:
+        """Trace хуки для учета ожидания соединения, переиспользования и фаз запроса."""
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_headers_sent.append(self._on_request_headers_sent)
+        trace_config.on_request_end.append(self._on_request_end)
+        trace_config.on_connection_queued_start.append(self._on_queued_start)
+        trace_config.on_connection_queued_end.append(self._on_queued_end)
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reused)
+        return trace_config
+
+    async def _on_request_start(self, session: aiohttp.ClientSession,
+                                ctx: SimpleNamespace, params: Any) -> None:
+        if isinstance(ctx.trace_request_ctx, RequestTimings):
+            ctx.trace_request_ctx.on_request_start()
+
+    async def _on_request_headers_sent(self, session: aiohttp.ClientSession,
+                                       ctx: SimpleNamespace, params: Any) -> None:
+        if isinstance(ctx.trace_request_ctx, RequestTimings):
+            ctx.trace_request_ctx.on_headers_sent()
+
+    async def _on_request_end(self, session: aiohttp.ClientSession,
+                              ctx: SimpleNamespace, params: Any) -> None:
+        if isinstance(ctx.trace_request_ctx, RequestTimings):
+            ctx.trace_request_ctx.on_response_start()
+
+    async def _on_queued_start(self, session: aiohttp.ClientSession,
+                               ctx: SimpleNamespace, params: Any) -> None:
+        ctx.queued_at = time.monotonic()
+
+    async def _on_queued_end(self, session: aiohttp.ClientSession,
+                             ctx: SimpleNamespace, params: Any) -> None:
+        wait = time.monotonic() - getattr(ctx, "queued_at", time.monotonic())
+        self._acquire_waits += 1
+        self._acquire_wait_total += wait
+        self._acquire_wait_max = max(self._acquire_wait_max, wait)
+
+    async def _on_connection_created(self, session: aiohttp.ClientSession,
+                                     ctx: SimpleNamespace, params: Any) -> None:
+        self._connections_created += 1
+
+    async def _on_connection_reused(self, session: aiohttp.ClientSession,
+                                    ctx: SimpleNamespace, params: Any) -> None:
+        self._connections_reused += 1
+
+
+# Глобальный транспорт приложения
+http_transport = HttpTransport()
@@ -0,0 +1,155 @@
+"""Кэш анализов изображений по file_unique_id Telegram."""
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from src.config.settings import settings
+from src.llm.cache import ResponseCache
+from src.utils.logger import logger
+
+
+class AnalysisCache:
+    """
+    Кэш готовых анализов стикеров и картинок.
+
+    file_unique_id одинаков у одного и того же файла у всех пользователей и
+    при пересылке, поэтому популярный стикер или мем анализируется один раз:
+    повторный запрос отвечается без скачивания файла и без vision запроса.
+    В памяти - LRU с бюджетом байт и своим TTL у каждой записи; если задан
+    path, записи дублируются в SQLite и переживают перезапуск бота.
+    """
+
+    def __init__(self, max_bytes: int = settings.MEDIA_CACHE_MAX_BYTES,
+                 ttl: int = settings.MEDIA_CACHE_TTL,
+                 path: str = settings.MEDIA_CACHE_PATH) -> None:
+        """
+        Инициализация кэша.
+
+        Args:
+            max_bytes: Бюджет памяти в байтах
+            ttl: Время жизни записи по умолчанию в секундах
+            path: Путь к SQLite базе (пусто - только память)
+        """
+        self.ttl = ttl
+        self.path = path
+        self.memory = ResponseCache(max_bytes=max_bytes, ttl=ttl)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+        # Статистика
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.disk_errors = 0
+
+    @staticmethod
+    def make_key(file_unique_id: str, caption: str) -> str:
+        """Ключ: файл плюс подпись без различий в регистре и пробелах."""
+        normalized = " ".join(caption.split()).casefold()
+        return f"{file_unique_id}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:32]}"
+
+    async def start(self) -> None:
+        """Открыть базу, если кэш постоянный."""
+        if self.path and self._conn is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-cache")
+            await self._run(self._open)
+            logger.info(f"Media analysis cache opened: {self.path}")
+
+    async def close(self) -> None:
+        """Закрыть базу."""
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """Найти анализ в памяти, затем на диске; учитывается в статистике."""
+        value = self.memory.get(key)
+        if value is None and self._conn is not None:
+            try:
+                row = await self._run(self._load, key, time.time())
+            except Exception as e:
+                self.disk_errors += 1
+                logger.error(f"Failed to read media analysis cache: {e}")
+                row = None
+            if row is not None:
+                value, expires = row
+                self.disk_hits += 1
+                # В память - с оставшимся, а не полным временем жизни
+                self.memory.put(key, value, ttl=expires - time.time())
+
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        """Сохранить анализ на ttl секунд (по умолчанию - self.ttl)."""
+        ttl = self.ttl if ttl is None else ttl
+        self.memory.put(key, value, ttl=ttl)
+        if self._conn is not None:
+            try:
+                await self._run(self._store, key, value, time.time() + ttl)
+            except Exception as e:
+                self.disk_errors += 1
+                logger.error(f"Failed to write media analysis cache: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша."""
+        memory = self.memory.get_stats()
+        lookups = self.hits + self.misses
+        return {
+            "entries": memory["entries"],
+            "bytes": memory["bytes"],
+            "evictions": memory["evictions"],
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "disk_errors": self.disk_errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    async def _run(self, func: Any, *args: Any) -> Any:
+        """Выполнить функцию в потоке базы."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # Методы ниже выполняются только в потоке базы
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires REAL NOT NULL)"
+        )
+        # Истекшие записи удаляются при открытии, чтобы база не росла бесконечно
+        with conn:
+            conn.execute("DELETE FROM analyses WHERE expires <= ?", (time.time(),))
+        self._conn = conn
+
+    def _load(self, key: str, now: float) -> Optional[Tuple[str, float]]:
+        return self._conn.execute(
+            "SELECT content, expires FROM analyses WHERE key = ? AND expires > ?", (key, now)
+        ).fetchone()
+
+    def _store(self, key: str, value: str, expires: float) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, content, expires) VALUES (?, ?, ?)",
+                (key, value, expires),
+            )
+
+
+# Глобальный экземпляр кэша анализов
+analysis_cache = AnalysisCache()
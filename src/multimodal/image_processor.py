@@ -1,24 +1,29 @@
 """Модуль для обработки изображений."""
 import base64
 import io
-from typing import Optional, Tuple
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 import cv2
 import numpy as np
 from PIL import Image, ImageOps
-import aiohttp
 
-from src.config.settings import settings
+from src.llm.backend import LLMBackend, llm_backend
+from src.llm.streaming import FallbackText, iter_sse_deltas
+from src.llm.timings import RequestTimings, latency_recorder
 from src.utils.logger import logger
 
 
 class ImageProcessor:
     """Класс для обработки изображений."""
     
-    def __init__(self) -> None:
+    def __init__(self, backend: Optional[LLMBackend] = None) -> None:
         """Инициализация процессора изображений."""
         self.max_size = 10 * 1024 * 1024  # 10MB
         self.max_dimensions = (1024, 1024)
+        self.max_side = 4096  # Больше - отклоняется без анализа
         self.supported_formats = {'.jpg', '.jpeg', '.png', '.webp'}
+        self.backend = backend or llm_backend
     
     def validate_image(self, image_data: bytes) -> Tuple[bool, str]:
         """
@@ -44,7 +49,7 @@ class ImageProcessor:
             
             # Проверка размеров
             width, height = image.size
-            if width > 4096 or height > 4096:
+            if width > self.max_side or height > self.max_side:
                 return False, f"Изображение слишком большое: {width}x{height}"
             
             return True, "OK"
@@ -108,80 +113,153 @@ class ImageProcessor:
             user_prompt: Дополнительный промпт пользователя
             
         Returns:
-            str: Описание изображения
+            str: Описание изображения или сообщение об ошибке (FallbackText)
         """
         try:
             # Валидация
             is_valid, error_msg = self.validate_image(image_data)
             if not is_valid:
-                return f"❌ Ошибка валидации: {error_msg}"
-            
-            # Оптимизация
-            optimized_data = self.optimize_image(image_data)
-            base64_image = self.image_to_base64(optimized_data)
-            
-            # Формируем промпт
-            system_prompt = (
-                "Ты - саркастичный аналитик изображений. "
-                "Анализируй изображения с юмором и иронией. "
-                "Давай не только описание, но и забавные комментарии. "
-                "Будь остроумным, но не злым."
-            )
-            
-            user_message = f"Проанализируй это изображение: {user_prompt}".strip()
-            
-            # Подготавливаем сообщения для API
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": user_message
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
-                        }
-                    ]
-                }
-            ]
-            
-            # Отправляем запрос к OpenRouter
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {settings.OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": "https://github.com/your-repo",
-                        "X-Title": "AI-Driven Bot"
-                    },
-                    json={
-                        "model": "anthropic/claude-3.5-sonnet",
-                        "messages": messages,
-                        "max_tokens": 1000,
-                        "temperature": 0.7
-                    }
-                ) as response:
-                    if response.status == 200:
-                        data = await response.json()
-                        content = data['choices'][0]['message']['content']
-                        logger.info(f"Изображение проанализировано успешно")
-                        return content
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка API OpenRouter: {response.status} - {error_text}")
-                        return f"❌ Ошибка анализа изображения: {response.status}"
-                        
+                return FallbackText(f"❌ Ошибка валидации: {error_msg}")
+            
+            payload = self._build_payload(image_data, user_prompt)
+        except Exception as e:
+            logger.error(f"Ошибка анализа изображения: {e}")
+            return FallbackText(f"❌ Неожиданная ошибка при анализе: {str(e)}")
+        
+        timings = RequestTimings()
+        start_time = time.monotonic()
+        outcome = "ok"
+        try:
+            # Отправляем запрос через общий бэкенд и пул соединений
+            async with self.backend.post(json=payload, trace_request_ctx=timings) as response:
+                if response.status == 200:
+                    with timings.measure("body"):
+                        body = await response.read()
+                    with timings.measure("parse"):
+                        data = json.loads(body)
+                    content = data['choices'][0]['message']['content']
+                    logger.info(f"Изображение проанализировано успешно")
+                    return content
+                else:
+                    outcome = f"http_{response.status}"
+                    error_text = await response.text()
+                    logger.error(f"Ошибка API OpenRouter: {response.status} - {error_text}")
+                    return FallbackText(f"❌ Ошибка анализа изображения: {response.status}")
+                    
         except Exception as e:
+            outcome = type(e).__name__
             logger.error(f"Ошибка анализа изображения: {e}")
-            return f"❌ Неожиданная ошибка при анализе: {str(e)}"
+            return FallbackText(f"❌ Неожиданная ошибка при анализе: {str(e)}")
+        finally:
+            timings.add("total", time.monotonic() - start_time)
+            latency_recorder.record(payload["model"], outcome, timings)
     
-
+    async def analyze_image_stream(self, image_data: bytes, user_prompt: str = "") -> AsyncIterator[str]:
+        """
+        Потоковый анализ изображения через OpenRouter API.
+        
+        Args:
+            image_data: Байты изображения
+            user_prompt: Дополнительный промпт пользователя
+            
+        Yields:
+            str: Фрагменты описания изображения или сообщение об ошибке (FallbackText)
+        """
+        try:
+            is_valid, error_msg = self.validate_image(image_data)
+            if not is_valid:
+                yield FallbackText(f"❌ Ошибка валидации: {error_msg}")
+                return
+            
+            payload = self._build_payload(image_data, user_prompt)
+            payload["stream"] = True
+        except Exception as e:
+            logger.error(f"Ошибка потокового анализа изображения: {e}")
+            yield FallbackText(f"❌ Неожиданная ошибка при анализе: {str(e)}")
+            return
+        
+        timings = RequestTimings()
+        start_time = time.monotonic()
+        outcome = "ok"
+        streamed = False
+        try:
+            async with self.backend.post(json=payload, trace_request_ctx=timings) as response:
+                if response.status != 200:
+                    outcome = f"http_{response.status}"
+                    error_text = await response.text()
+                    logger.error(f"Ошибка API OpenRouter: {response.status} - {error_text}")
+                    yield FallbackText(f"❌ Ошибка анализа изображения: {response.status}")
+                    return
+                
+                # body - весь поток, как у потоковых запросов LLMClient
+                body_started = time.monotonic()
+                async for delta in iter_sse_deltas(response):
+                    streamed = True
+                    yield delta
+                timings.add("body", time.monotonic() - body_started)
+                logger.info(f"Изображение проанализировано успешно (stream)")
+                
+        except Exception as e:
+            outcome = type(e).__name__
+            logger.error(f"Ошибка потокового анализа изображения: {e}")
+            # После начала ответа ошибка отделяется от уже показанного текста
+            separator = "\n\n" if streamed else ""
+            yield FallbackText(f"{separator}❌ Неожиданная ошибка при анализе: {str(e)}")
+        finally:
+            timings.add("total", time.monotonic() - start_time)
+            latency_recorder.record(payload["model"], outcome, timings)
+    
+    def _build_payload(self, image_data: bytes, user_prompt: str) -> Dict[str, Any]:
+        """
+        Подготовить payload для vision запроса.
+        
+        Args:
+            image_data: Байты изображения (уже прошедшие валидацию)
+            user_prompt: Дополнительный промпт пользователя
+            
+        Returns:
+            Dict[str, Any]: Тело запроса к OpenRouter
+        """
+        # Оптимизация
+        optimized_data = self.optimize_image(image_data)
+        base64_image = self.image_to_base64(optimized_data)
+        
+        # Формируем промпт
+        system_prompt = (
+            "Ты - саркастичный аналитик изображений. "
+            "Анализируй изображения с юмором и иронией. "
+            "Давай не только описание, но и забавные комментарии. "
+            "Будь остроумным, но не злым."
+        )
+        
+        user_message = f"Проанализируй это изображение: {user_prompt}".strip()
+        
+        # Подготавливаем сообщения для API
+        messages = [
+            {
+                "role": "system",
+                "content": system_prompt
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": user_message
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
+                        }
+                    }
+                ]
+            }
+        ]
+        
+        return {
+            "model": "anthropic/claude-3.5-sonnet",
+            "messages": messages,
+            "max_tokens": 1000,
+            "temperature": 0.7
+        }
@@ -0,0 +1,286 @@
+"""Локальный Redis-совместимый сервер для тестов и запуска без Redis.
+
+Говорит на RESP2 и RESP3 (после HELLO 3) и понимает подмножество команд,
+которое использует RedisHistoryStore: строки, списки, INCR, EXPIRE и MULTI/EXEC.
+
+Запуск: python -m src.utils.fake_redis --port 6380
+и REDIS_URL=redis://127.0.0.1:6380/0 в .env бота.
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from src.utils.logger import logger
+
+
+class RedisError(Exception):
+    """Ошибка команды, отправляется клиенту как -ERR."""
+
+
+class FakeRedis:
+    """
+    Asyncio сервер с хранением данных в памяти процесса.
+
+    Все команды выполняются в event loop без await, поэтому каждая
+    команда и каждый блок MULTI/EXEC атомарны, как в настоящем Redis.
+    """
+
+    def __init__(self) -> None:
+        self._data: Dict[bytes, Union[bytes, List[bytes]]] = {}
+        self._expires: Dict[bytes, float] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self.url = ""
+
+        # Статистика
+        self.commands = 0
+        self.connections = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Запустить сервер.
+
+        Returns:
+            URL для redis.from_url
+        """
+        self._server = await asyncio.start_server(self._handle_client, host, port)
+        bound_host, bound_port = self._server.sockets[0].getsockname()[:2]
+        self.url = f"redis://{bound_host}:{bound_port}/0"
+        logger.info(f"Fake Redis listening on {self.url}")
+        return self.url
+
+    async def close(self) -> None:
+        """Остановить сервер."""
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Обслужить одно соединение."""
+        self.connections += 1
+        self._writers.add(writer)
+        queued: Optional[List[List[bytes]]] = None  # Команды внутри MULTI
+        resp3 = False
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper()
+                if name == b"MULTI":
+                    queued = []
+                    reply: Any = "OK"
+                elif name == b"EXEC":
+                    reply = [self._execute(queued_command) for queued_command in queued or []]
+                    queued = None
+                elif name == b"DISCARD":
+                    queued = None
+                    reply = "OK"
+                elif queued is not None:
+                    queued.append(command)
+                    reply = "QUEUED"
+                else:
+                    reply = self._execute(command)
+                    if name == b"HELLO" and isinstance(reply, dict):
+                        resp3 = reply["proto"] == 3
+                writer.write(_encode(reply, resp3))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        """Прочитать команду: массив bulk строк RESP."""
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline команда (например, из redis-cli)
+            return line.strip().split()
+        count = int(line[1:])
+        args = []
+        for _ in range(count):
+            header = await reader.readline()
+            length = int(header[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, command: List[bytes]) -> Any:
+        """Выполнить одну команду."""
+        self.commands += 1
+        name = command[0].upper().decode()
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return RedisError(f"ERR unknown command '{name}'")
+        try:
+            return handler(*command[1:])
+        except RedisError as e:
+            return e
+        except (TypeError, ValueError):
+            return RedisError(f"ERR wrong number or type of arguments for '{name}' command")
+
+    def _get(self, key: bytes) -> Optional[Union[bytes, List[bytes]]]:
+        """Значение ключа с учетом истечения."""
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._delete(key)
+        return self._data.get(key)
+
+    def _get_list(self, key: bytes, create: bool = False) -> Optional[List[bytes]]:
+        value = self._get(key)
+        if value is None:
+            if not create:
+                return None
+            value = self._data[key] = []
+        if not isinstance(value, list):
+            raise RedisError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _delete(self, key: bytes) -> bool:
+        self._expires.pop(key, None)
+        return self._data.pop(key, None) is not None
+
+    # Команды
+
+    def _cmd_ping(self, *args: bytes) -> Any:
+        return args[0] if args else "PONG"
+
+    def _cmd_hello(self, *args: bytes) -> Dict[str, Any]:
+        protocol = int(args[0]) if args else 2
+        return {"server": "redis", "version": "7.0.0", "proto": protocol, "mode": "standalone", "modules": []}
+
+    def _cmd_client(self, *args: bytes) -> str:
+        return "OK"
+
+    def _cmd_select(self, db: bytes) -> str:
+        return "OK"
+
+    def _cmd_flushall(self, *args: bytes) -> str:
+        self._data.clear()
+        self._expires.clear()
+        return "OK"
+
+    def _cmd_get(self, key: bytes) -> Optional[bytes]:
+        value = self._get(key)
+        if isinstance(value, list):
+            raise RedisError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _cmd_set(self, key: bytes, value: bytes, *options: bytes) -> str:
+        self._delete(key)
+        self._data[key] = value
+        upper = [option.upper() for option in options]
+        if b"EX" in upper:
+            self._expires[key] = time.monotonic() + int(options[upper.index(b"EX") + 1])
+        return "OK"
+
+    def _cmd_del(self, *keys: bytes) -> int:
+        return sum(1 for key in keys if self._get(key) is not None and self._delete(key))
+
+    def _cmd_incr(self, key: bytes) -> int:
+        return self._cmd_incrby(key, b"1")
+
+    def _cmd_incrby(self, key: bytes, amount: bytes) -> int:
+        value = int(self._cmd_get(key) or 0) + int(amount)
+        self._data[key] = str(value).encode()
+        return value
+
+    def _cmd_expire(self, key: bytes, seconds: bytes) -> int:
+        if self._get(key) is None:
+            return 0
+        self._expires[key] = time.monotonic() + int(seconds)
+        return 1
+
+    def _cmd_ttl(self, key: bytes) -> int:
+        if self._get(key) is None:
+            return -2
+        expires_at = self._expires.get(key)
+        if expires_at is None:
+            return -1
+        return int(round(expires_at - time.monotonic()))
+
+    def _cmd_rpush(self, key: bytes, *values: bytes) -> int:
+        items = self._get_list(key, create=True)
+        items.extend(values)
+        return len(items)
+
+    def _cmd_lrange(self, key: bytes, start: bytes, stop: bytes) -> List[bytes]:
+        items = self._get_list(key) or []
+        first, last = _normalize_range(len(items), int(start), int(stop))
+        return items[first:last]
+
+    def _cmd_ltrim(self, key: bytes, start: bytes, stop: bytes) -> str:
+        items = self._get_list(key)
+        if items is not None:
+            first, last = _normalize_range(len(items), int(start), int(stop))
+            items[:] = items[first:last]
+            if not items:
+                self._delete(key)
+        return "OK"
+
+    def _cmd_llen(self, key: bytes) -> int:
+        return len(self._get_list(key) or [])
+
+
+def _normalize_range(length: int, start: int, stop: int) -> Tuple[int, int]:
+    """Индексы Redis (включительно, с отрицательными) в срез Python."""
+    if start < 0:
+        start = max(0, length + start)
+    if stop < 0:
+        stop = length + stop
+    return start, max(start, min(stop, length - 1) + 1)
+
+
+def _encode(value: Any, resp3: bool = False) -> bytes:
+    """Закодировать ответ (словарь - только для HELLO, как RESP3 map)."""
+    if isinstance(value, RedisError):
+        return f"-{value}\r\n".encode()
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode()
+    if isinstance(value, bool):
+        return f":{int(value)}\r\n".encode()
+    if isinstance(value, int):
+        return f":{value}\r\n".encode()
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, dict):
+        return b"%%%d\r\n" % len(value) + b"".join(
+            _encode(key.encode(), resp3) + _encode(item, resp3) for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(item, resp3) for item in value)
+    raise TypeError(f"Cannot encode {type(value)!r}")
+
+
+async def _serve(host: str, port: int) -> None:
+    """Запустить сервер до прерывания."""
+    server = FakeRedis()
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+def main() -> None:
+    """Точка входа командной строки."""
+    parser = argparse.ArgumentParser(description="Fake Redis server for tests and local runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
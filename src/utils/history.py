@@ -1,36 +1,262 @@
 """Управление историей диалогов пользователей."""
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+import asyncio
+import json
+import marshal
+import sys
+import time
+import zlib
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
 from dataclasses import dataclass
 
+from src.config.settings import settings
+from src.utils.history_store import HistoryStore, StoredMessage, create_history_store
 from src.utils.logger import logger
+from src.utils.tokens import estimate_tokens
 
 
-@dataclass
+# Ключ сессии: числовые ID Telegram хранятся как int
+SessionKey = Union[int, str]
+
+
+@dataclass(slots=True)
 class DialogMessage:
     """Структура для хранения сообщения в диалоге."""
     role: str  # "user" или "assistant"
     content: str
-    timestamp: datetime
+    timestamp: float  # time.monotonic() в момент сохранения
+    tokens: int = 0  # Оценка токенов, считается один раз при сохранении
+
+
+# Уровень zlib для простаивающих сессий: на диалогах 1 сжимает лишь на ~7%
+# хуже уровня 6, но на 40% быстрее
+COMPRESS_LEVEL = 1
+# Сколько сессий сжимать за один шаг фоновой задачи, не отдавая event loop
+COMPRESS_BATCH = 200
+
+
+class MessageRing:
+    """
+    Кольцевой буфер сообщений фиксированной емкости поверх списка.
+    
+    Список растет до capacity, затем новые сообщения перезаписывают самые
+    старые без копирования. deque(maxlen) не подходит: пустой deque
+    занимает ~760 байт, а короткие сессии - самые частые.
+    
+    Простаивающий буфер можно сжать (pack): сообщения превращаются в один
+    zlib блок, а любое обращение к сообщениям распаковывает его обратно.
+    """
+    
+    __slots__ = ("capacity", "_items", "_start", "_packed", "_packed_count")
+    
+    def __init__(self, capacity: int, messages: Optional[List[DialogMessage]] = None) -> None:
+        self.capacity = capacity
+        self._items: List[DialogMessage] = []
+        self._start = 0  # Индекс самого старого сообщения
+        self._packed: Optional[bytes] = None
+        self._packed_count = 0
+        for message in messages or ():
+            self.append(message)
+    
+    @property
+    def packed_size(self) -> int:
+        """Размер сжатого блока в байтах (0 - буфер не сжат)."""
+        return len(self._packed) if self._packed is not None else 0
+    
+    def pack(self) -> None:
+        """Сжать сообщения в zlib блок, освободив объекты сообщений."""
+        if self._packed is not None or not self._items:
+            return
+        # marshal - быстрый формат только для данных этого процесса
+        records = [(msg.role, msg.content, msg.timestamp, msg.tokens) for msg in self]
+        self._packed = zlib.compress(marshal.dumps(records), COMPRESS_LEVEL)
+        self._packed_count = len(records)
+        self._items = []
+        self._start = 0
+    
+    def unpack(self) -> None:
+        """Распаковать сжатый блок обратно в сообщения."""
+        if self._packed is None:
+            return
+        records = marshal.loads(zlib.decompress(self._packed))
+        self._items = [DialogMessage(*record) for record in records]
+        self._start = 0
+        self._packed = None
+        self._packed_count = 0
+    
+    def append(self, message: DialogMessage) -> bool:
+        """Добавить сообщение; True, если вытеснено самое старое."""
+        self.unpack()
+        if len(self._items) < self.capacity:
+            self._items.append(message)
+            return False
+        self._items[self._start] = message
+        self._start = (self._start + 1) % self.capacity
+        return True
+    
+    def last(self) -> Optional[DialogMessage]:
+        """Последнее сообщение или None."""
+        self.unpack()
+        if not self._items:
+            return None
+        return self._items[self._start - 1]
+    
+    def __len__(self) -> int:
+        if self._packed is not None:
+            return self._packed_count
+        return len(self._items)
+    
+    def __getitem__(self, index: int) -> DialogMessage:
+        self.unpack()
+        size = len(self._items)
+        if index < 0:
+            index += size
+        if not 0 <= index < size:
+            raise IndexError("message index out of range")
+        return self._items[(self._start + index) % size]
+    
+    def __iter__(self) -> Iterator[DialogMessage]:
+        self.unpack()
+        items = self._items
+        start = self._start
+        for index in range(start, len(items)):
+            yield items[index]
+        for index in range(start):
+            yield items[index]
+
+
+def _session_key(user_id: SessionKey) -> SessionKey:
+    """Числовой ID пользователя как int: меньше памяти, чем строка."""
+    if isinstance(user_id, str) and user_id.isdigit():
+        return int(user_id)
+    return user_id
+
+
+# Примерные накладные расходы в байтах (замер tracemalloc): сессия - кольцо
+# и записи в словарях, колесе истечения и порядке обращений, сообщение - DialogMessage и слот
+# в списке кольца. Текст сообщения считается через sys.getsizeof
+SESSION_OVERHEAD_BYTES = 300
+MESSAGE_OVERHEAD_BYTES = 100
+# Объект bytes сжатого блока
+PACKED_OVERHEAD_BYTES = 40
+
+
+def _message_bytes(message: DialogMessage) -> int:
+    """Примерный размер сообщения в памяти."""
+    return sys.getsizeof(message.content) + MESSAGE_OVERHEAD_BYTES
+
+
+# Заголовок сводки ранней части диалога в контексте LLM
+SUMMARY_PREFIX = "Краткое содержание более ранней части диалога:\n"
+
+
+# Примерные накладные расходы элемента снимка контекста: словарь сообщения,
+# слоты в списках снимка и объект bytes JSON фрагмента (сам JSON - по
+# размеру текста)
+VIEW_ITEM_OVERHEAD_BYTES = 300
+
+
+# Кодировщик в том же виде, что у PayloadEncoder (компактный JSON без \uXXXX)
+_wire_encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+
+def _encode_wire(message: Dict[str, str]) -> bytes:
+    """JSON сообщения в UTF-8."""
+    return _wire_encoder.encode(message).encode("utf-8")
+
+
+def _read_only(self: "ContextMessages", *args: object, **kwargs: object) -> None:
+    raise TypeError("ContextMessages is read-only")
+
+
+class ContextMessages(list):
+    """
+    Сообщения в формате OpenAI API с заранее посчитанными оценками токенов.
+    
+    HistoryManager отдает неизменяемый снимок, один и тот же до изменения
+    сессии. Для каждого сообщения снимок хранит исходный DialogMessage
+    (sources) и JSON фрагмент, поэтому следующий снимок переиспользует
+    словари и фрагменты, а PayloadEncoder не сериализует историю заново.
+    """
+    
+    __slots__ = ("token_counts", "fragments", "sources", "nbytes")
+    
+    def __init__(self, messages: List[Dict[str, str]] = (), token_counts: Optional[List[int]] = None,
+                 fragments: Optional[List[Optional[bytes]]] = None,
+                 sources: Optional[List[DialogMessage]] = None):
+        super().__init__(messages)
+        self.token_counts = token_counts if token_counts is not None else []
+        # JSON каждого сообщения (None - закодируется при первом запросе)
+        self.fragments = fragments if fragments is not None else [None] * len(self)
+        self.sources = sources if sources is not None else []
+        self.nbytes = 0  # Оценка памяти снимка для бюджета HistoryManager
+    
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    
+    def encoded(self, start: int = 0) -> bytes:
+        """JSON сообщений начиная с start через запятую, без скобок массива."""
+        fragments = self.fragments
+        for index in range(start, len(self)):
+            if fragments[index] is None:
+                fragments[index] = _encode_wire(self[index])
+        return b",".join(fragments[start:])
 
 
 class HistoryManager:
     """Менеджер для управления историей диалогов пользователей."""
     
-    def __init__(self, max_messages: int = 20, session_ttl: int = 3600):
+    def __init__(self, max_messages: int = 20, session_ttl: int = 3600,
+                 expiry_resolution: float = settings.SESSION_EXPIRY_INTERVAL,
+                 store: Optional[HistoryStore] = None,
+                 max_bytes: int = settings.HISTORY_MAX_BYTES,
+                 compress_after: float = settings.HISTORY_COMPRESS_AFTER):
         """
         Инициализация менеджера истории.
         
         Args:
             max_messages: Максимальное количество сообщений в контексте
             session_ttl: Время жизни сессии в секундах (по умолчанию 1 час)
+            expiry_resolution: Шаг колеса истечения в секундах
+            store: Постоянное хранилище (None - история только в памяти)
+            max_bytes: Бюджет памяти на все сессии в байтах (0 - без ограничения)
+            compress_after: Через сколько секунд простоя сжимать сессию (0 - не сжимать)
         """
-        self.user_sessions: Dict[str, List[DialogMessage]] = {}
+        # Порядок ключей - порядок активности: сессия переставляется в конец
+        # при каждом сообщении, первой вытесняется самая давняя
+        self.user_sessions: Dict[SessionKey, MessageRing] = {}
+        # Сводки сжатой ранней части диалога (см. HistorySummarizer)
+        self.summaries: Dict[SessionKey, DialogMessage] = {}
         self.max_messages = max_messages
         self.session_ttl = session_ttl
+        self.store = store
+        
+        # Учет памяти: примерный размер каждой сессии и их сумма
+        self.max_bytes = max_bytes
+        self._session_bytes: Dict[SessionKey, int] = {}
+        self.resident_bytes = 0
+        self.evictions = 0
+        
+        # Несжатые сессии -> время последнего обращения, в порядке обращений:
+        # фоновое сжатие снимает простаивающие с начала и не трогает остальные
+        self.compress_after = compress_after
+        self._warm: Dict[SessionKey, float] = {}
+        self.compressions = 0
+        self.decompressions = 0
+        
+        # Снимки контекста в формате API (см. get_context_messages)
+        self._views: Dict[SessionKey, ContextMessages] = {}
+        
+        # Колесо истечения: тик -> сессии, истекающие к началу этого тика.
+        # Сессия переезжает в новый тик при каждом сообщении, поэтому очистка
+        # разбирает только наступившие тики и не сканирует все сессии.
+        self.expiry_resolution = expiry_resolution
+        self._expiry_wheel: Dict[int, Set[SessionKey]] = {}
+        self._expiry_ticks: Dict[SessionKey, int] = {}
+        self._expiry_cursor = self._tick(time.monotonic())  # Первый неразобранный тик
+        self._expiry_task: Optional["asyncio.Task[None]"] = None
         logger.info(f"HistoryManager initialized: max_messages={max_messages}, session_ttl={session_ttl}")
     
-    def add_message(self, user_id: str, role: str, content: str) -> None:
+    def add_message(self, user_id: SessionKey, role: str, content: str) -> None:
         """
         Добавить сообщение в историю пользователя.
         
@@ -39,51 +265,178 @@ class HistoryManager:
             role: Роль отправителя ("user" или "assistant")
             content: Содержимое сообщения
         """
-        if user_id not in self.user_sessions:
-            self.user_sessions[user_id] = []
+        key = _session_key(user_id)
+        # Переставляем сессию в конец порядка активности
+        messages = self._open_session(key)
+        self.user_sessions.pop(key, None)
+        if messages is None:
+            messages = MessageRing(self.max_messages)
+            self._session_bytes[key] = SESSION_OVERHEAD_BYTES
+            self.resident_bytes += SESSION_OVERHEAD_BYTES
+            self._warm[key] = time.monotonic()
             logger.info(f"Created new session for user {user_id}")
+        self.user_sessions[key] = messages
         
         message = DialogMessage(
             role=role,
             content=content,
-            timestamp=datetime.now()
+            timestamp=time.monotonic(),
+            tokens=estimate_tokens(content)
         )
         
-        self.user_sessions[user_id].append(message)
+        # Буфер сам вытесняет самое старое сообщение сверх max_messages
+        size = _message_bytes(message)
+        oldest = messages[0] if len(messages) == messages.capacity else None
+        if messages.append(message):
+            size -= _message_bytes(oldest)
+            logger.debug(f"Trimmed 1 old message for user {user_id}")
+        self._session_bytes[key] += size
+        self.resident_bytes += size
+        self._schedule_expiry(key, message.timestamp)
+        if self.store is not None:
+            self.store.append(str(key), (role, content, time.time(), message.tokens))
+        self._enforce_budget(key)
+        
+        logger.debug(f"Added {role} message to user {user_id} history (total: {len(messages)})")
+    
+    async def ensure_loaded(self, user_id: SessionKey) -> None:
+        """
+        Подгрузить сессию из хранилища при первом сообщении пользователя.
+        
+        С общим хранилищем сессия в памяти сверяется с ним при каждом
+        сообщении и перечитывается, если устарела.
+        
+        Args:
+            user_id: ID пользователя
+        """
+        key = _session_key(user_id)
+        if self.store is None:
+            return
+        if key in self.user_sessions:
+            if not self.store.shared or await self.store.is_current(str(key)):
+                return
+            # Сессию изменила другая реплика бота - перечитываем
+            self._drop_session(key)
+        
+        stored_messages, stored_summary = await self.store.load(str(key))
+        if key in self.user_sessions:
+            # Пока шла загрузка, сессию уже создало новое сообщение
+            return
+        if not stored_messages:
+            return
+        
+        wall_now, monotonic_now = time.time(), time.monotonic()
+        if stored_messages[-1][2] < wall_now - self.session_ttl:
+            # Сессия истекла, пока бот был выключен
+            self.store.delete(str(key))
+            return
         
-        # Ограничиваем количество сообщений в истории
-        if len(self.user_sessions[user_id]) > self.max_messages:
-            removed_count = len(self.user_sessions[user_id]) - self.max_messages
-            self.user_sessions[user_id] = self.user_sessions[user_id][-self.max_messages:]
-            logger.debug(f"Trimmed {removed_count} old messages for user {user_id}")
+        def restore(stored: StoredMessage) -> DialogMessage:
+            role, content, created, tokens = stored
+            return DialogMessage(role, content, monotonic_now - (wall_now - created), tokens)
         
-        logger.debug(f"Added {role} message to user {user_id} history (total: {len(self.user_sessions[user_id])})")
+        messages = MessageRing(self.max_messages, [restore(stored) for stored in stored_messages])
+        self.user_sessions[key] = messages
+        if stored_summary is not None:
+            self.summaries[key] = restore(stored_summary)
+        self._schedule_expiry(key, messages.last().timestamp)
+        self._warm[key] = monotonic_now
+        self._update_session_bytes(key)
+        self._enforce_budget(key)
+        logger.info(f"Loaded {len(messages)} messages from store for user {user_id}")
     
-    def get_context_messages(self, user_id: str) -> List[Dict[str, str]]:
+    def get_context_messages(self, user_id: SessionKey) -> ContextMessages:
         """
         Получить последние сообщения пользователя для LLM контекста.
         
+        Снимок кэшируется до следующего изменения сессии, а новый снимок
+        переиспользует словари и JSON сообщений из предыдущего: повторные
+        чтения и сборка payload не создают словарей и не кодируют историю.
+        
         Args:
             user_id: ID пользователя
             
         Returns:
-            Список сообщений в формате OpenAI API
+            Неизменяемый список сообщений в формате OpenAI API (с оценками
+            токенов в token_counts)
         """
-        if user_id not in self.user_sessions:
+        key = _session_key(user_id)
+        session = self._open_session(key)
+        if session is None:
             logger.debug(f"No history found for user {user_id}")
-            return []
+            return ContextMessages()
         
-        messages = []
-        for msg in self.user_sessions[user_id]:
-            messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+        view = self._views.get(key)
+        last = view.sources[-1] if view is not None and view.sources else None
+        if view is None or last is not session.last():
+            view = self._build_view(key, session, view)
+        logger.debug(f"Retrieved {len(view)} context messages for user {user_id}")
+        return view
+    
+    def get_compaction_batch(self, user_id: SessionKey, keep: int) -> Tuple[List[DialogMessage], Optional[str]]:
+        """
+        Получить старые сообщения для сжатия в сводку.
         
-        logger.debug(f"Retrieved {len(messages)} context messages for user {user_id}")
-        return messages
+        Args:
+            user_id: ID пользователя
+            keep: Сколько последних сообщений оставить без изменений
+            
+        Returns:
+            (сообщения для сжатия, текущая сводка или None)
+        """
+        key = _session_key(user_id)
+        messages = list(self._open_session(key) or ())
+        if len(messages) <= keep:
+            return [], None
+        
+        summary = self.summaries.get(key)
+        return messages[:len(messages) - keep], summary.content if summary else None
     
-    def clear_user_history(self, user_id: str) -> bool:
+    def apply_summary(self, user_id: SessionKey, summarized: List[DialogMessage], summary: str) -> bool:
+        """
+        Заменить сжатые сообщения сводкой.
+        
+        Сообщения удаляются по идентичности объектов: пока шло сжатие, в историю
+        могли добавиться новые сообщения, а сессию - очистить.
+        
+        Args:
+            user_id: ID пользователя
+            summarized: Сообщения из get_compaction_batch
+            summary: Текст сводки (включает предыдущую сводку)
+            
+        Returns:
+            True если сводка применена
+        """
+        key = _session_key(user_id)
+        messages = self._open_session(key)
+        if not messages:
+            return False
+        
+        summarized_ids = {id(msg) for msg in summarized}
+        remaining = [msg for msg in messages if id(msg) not in summarized_ids]
+        if len(remaining) == len(messages):
+            # Сессию очистили или сообщения уже вытеснены - сводка устарела
+            return False
+        
+        self.user_sessions[key] = MessageRing(self.max_messages, remaining)
+        self.summaries[key] = DialogMessage(
+            role="system",
+            content=summary,
+            timestamp=time.monotonic(),
+            tokens=estimate_tokens(SUMMARY_PREFIX + summary)
+        )
+        self._views.pop(key, None)
+        self._update_session_bytes(key)
+        if self.store is not None:
+            self.store.replace(
+                str(key),
+                [self._to_stored(msg) for msg in remaining],
+                self._to_stored(self.summaries[key])
+            )
+        logger.debug(f"Compacted {len(messages) - len(remaining)} messages for user {user_id}")
+        return True
+    
+    def clear_user_history(self, user_id: SessionKey) -> bool:
         """
         Очистить историю конкретного пользователя.
         
@@ -92,55 +445,290 @@ class HistoryManager:
             
         Returns:
             True если история была очищена, False если истории не было
+            (учитывается сессия в памяти - с хранилищем сначала ensure_loaded)
         """
-        if user_id in self.user_sessions:
-            messages_count = len(self.user_sessions[user_id])
-            del self.user_sessions[user_id]
+        key = _session_key(user_id)
+        messages_count = self.get_user_message_count(key)
+        dropped = self._drop_session(key)
+        if self.store is not None:
+            # Сессии может не быть в памяти (перезапуск, вытеснение по бюджету,
+            # другой воркер), а в хранилище она есть - удаляем в любом случае
+            self.store.delete(str(key))
+        if dropped:
             logger.info(f"Cleared history for user {user_id} ({messages_count} messages)")
             return True
         else:
             logger.debug(f"No history to clear for user {user_id}")
             return False
     
-    def clear_old_sessions(self) -> int:
+    def clear_old_sessions(self, now: Optional[float] = None) -> int:
         """
         Очистить старые неактивные сессии.
         
+        Разбирает наступившие тики колеса истечения: работа пропорциональна
+        числу истекших сессий (и пройденных тиков), а не всем сессиям.
+        
+        Args:
+            now: Текущее время time.monotonic() (по умолчанию - сейчас)
+        
         Returns:
             Количество удаленных сессий
         """
-        cutoff_time = datetime.now() - timedelta(seconds=self.session_ttl)
-        users_to_remove = []
+        current_tick = self._tick(time.monotonic() if now is None else now)
+        removed = 0
+        
+        while self._expiry_cursor <= current_tick:
+            for key in self._expiry_wheel.pop(self._expiry_cursor, ()):
+                del self._expiry_ticks[key]
+                if self._drop_session(key):
+                    removed += 1
+                if self.store is not None:
+                    self.store.evict(str(key))
+            self._expiry_cursor += 1
+        
+        if removed:
+            logger.info(f"Cleared {removed} old sessions")
+        
+        return removed
+    
+    async def start(self) -> None:
+        """Открыть хранилище и запустить фоновую очистку истекших сессий."""
+        if self.store is not None:
+            await self.store.start()
+        if self._expiry_task is None:
+            self._expiry_task = asyncio.create_task(self._run_expiry())
+            logger.info(f"Session expiry started: ttl={self.session_ttl}s, interval={self.expiry_resolution}s")
+    
+    async def close(self) -> None:
+        """Остановить фоновую очистку и записать историю в хранилище."""
+        if self._expiry_task is not None:
+            self._expiry_task.cancel()
+            try:
+                await self._expiry_task
+            except asyncio.CancelledError:
+                pass
+            self._expiry_task = None
+        if self.store is not None:
+            await self.store.close()
+    
+    async def _run_expiry(self) -> None:
+        """Периодически удалять истекшие сессии и сжимать простаивающие."""
+        while True:
+            await asyncio.sleep(self.expiry_resolution)
+            try:
+                self.clear_old_sessions()
+                # Сжимаем порциями, чтобы не задерживать обработку апдейтов
+                while self.compress_idle_sessions(limit=COMPRESS_BATCH) == COMPRESS_BATCH:
+                    await asyncio.sleep(0)
+            except Exception as e:
+                logger.error(f"Session expiry failed: {e}")
+    
+    def _open_session(self, key: SessionKey) -> Optional[MessageRing]:
+        """Сессия для чтения или записи: распаковать, если сжата, и отметить обращение."""
+        messages = self.user_sessions.get(key)
+        if messages is None:
+            return None
+        if messages.packed_size:
+            messages.unpack()
+            self.decompressions += 1
+            self._update_session_bytes(key)
+        # Переставляем в конец порядка обращений
+        self._warm.pop(key, None)
+        self._warm[key] = time.monotonic()
+        return messages
+    
+    def compress_idle_sessions(self, now: Optional[float] = None, limit: Optional[int] = None) -> int:
+        """
+        Сжать сессии, к которым не обращались дольше compress_after.
+        
+        Args:
+            now: Текущее время time.monotonic() (по умолчанию - сейчас)
+            limit: Максимум сессий за вызов (None - все простаивающие)
         
-        for user_id, messages in self.user_sessions.items():
-            if not messages:
-                users_to_remove.append(user_id)
+        Returns:
+            Количество сжатых сессий
+        """
+        if not self.compress_after:
+            return 0
+        deadline = (time.monotonic() if now is None else now) - self.compress_after
+        compressed = 0
+        while self._warm and (limit is None or compressed < limit):
+            key, accessed_at = next(iter(self._warm.items()))
+            if accessed_at > deadline:
+                break
+            del self._warm[key]
+            messages = self.user_sessions.get(key)
+            if messages is None:
                 continue
-            
-            # Проверяем время последнего сообщения
-            last_message_time = max(msg.timestamp for msg in messages)
-            if last_message_time < cutoff_time:
-                users_to_remove.append(user_id)
+            messages.pack()
+            self._views.pop(key, None)
+            self._update_session_bytes(key)
+            compressed += 1
         
-        # Удаляем старые сессии
-        for user_id in users_to_remove:
-            del self.user_sessions[user_id]
+        if compressed:
+            self.compressions += compressed
+            logger.debug(f"Compressed {compressed} idle sessions")
+        return compressed
+    
+    def _drop_session(self, key: SessionKey) -> bool:
+        """
+        Убрать сессию из памяти, не трогая хранилище.
         
-        if users_to_remove:
-            logger.info(f"Cleared {len(users_to_remove)} old sessions")
+        Returns:
+            True если сессия была в памяти
+        """
+        messages = self.user_sessions.pop(key, None)
+        self.summaries.pop(key, None)
+        self._views.pop(key, None)
+        self._warm.pop(key, None)
+        self._unschedule_expiry(key)
+        self.resident_bytes -= self._session_bytes.pop(key, 0)
+        return messages is not None
+    
+    def _update_session_bytes(self, key: SessionKey) -> None:
+        """Пересчитать размер сессии целиком (после загрузки, сводки или упаковки)."""
+        messages = self.user_sessions[key]
+        if messages.packed_size:
+            size = SESSION_OVERHEAD_BYTES + PACKED_OVERHEAD_BYTES + messages.packed_size
+        else:
+            size = SESSION_OVERHEAD_BYTES + sum(_message_bytes(msg) for msg in messages)
+        summary = self.summaries.get(key)
+        if summary is not None:
+            size += _message_bytes(summary)
+        view = self._views.get(key)
+        if view is not None:
+            size += view.nbytes
+        self.resident_bytes += size - self._session_bytes.get(key, 0)
+        self._session_bytes[key] = size
+    
+    def _build_view(self, key: SessionKey, session: MessageRing,
+                    previous: Optional[ContextMessages]) -> ContextMessages:
+        """Построить снимок контекста, продолжив предыдущий, если возможно."""
+        summary = self.summaries.get(key)
+        head = [summary] if summary is not None else []
+        ring = list(session)
+        kept = 0  # Сколько последних сообщений предыдущего снимка осталось в сессии
+        if previous is not None and previous.sources and previous.sources[:len(head)] == head:
+            # Между снимками в кольцо только дописывают (и вытесняют из начала):
+            # ищем последнее сообщение предыдущего снимка с конца
+            last = previous.sources[-1]
+            for back in range(1, len(ring) + 1):
+                if ring[-back] is last:
+                    if len(ring) - back + 1 <= len(previous) - len(head):
+                        kept = len(ring) - back + 1
+                    break
         
-        return len(users_to_remove)
+        if kept:
+            messages = previous[:len(head)] + previous[-kept:]
+            token_counts = previous.token_counts[:len(head)] + previous.token_counts[-kept:]
+            fragments = previous.fragments[:len(head)] + previous.fragments[-kept:]
+            sources = head + previous.sources[-kept:]
+            nbytes = previous.nbytes - sum(
+                VIEW_ITEM_OVERHEAD_BYTES + sys.getsizeof(message["content"])
+                for message in previous[len(head):len(previous) - kept]
+            )
+            fresh = ring[kept:]
+        else:
+            messages, token_counts, fragments, sources = [], [], [], []
+            nbytes = 0
+            fresh = head + ring
+        
+        for msg in fresh:
+            content = SUMMARY_PREFIX + msg.content if msg is summary else msg.content
+            messages.append({"role": msg.role, "content": content})
+            token_counts.append(msg.tokens or estimate_tokens(content))
+            fragments.append(None)
+            sources.append(msg)
+            nbytes += VIEW_ITEM_OVERHEAD_BYTES + sys.getsizeof(content)
+        
+        view = ContextMessages(messages, token_counts, fragments, sources)
+        view.nbytes = nbytes
+        delta = nbytes - (previous.nbytes if previous is not None else 0)
+        self._views[key] = view
+        self._session_bytes[key] += delta
+        self.resident_bytes += delta
+        return view
+    
+    def _enforce_budget(self, active_key: SessionKey) -> None:
+        """Вытеснить самые давно активные сессии, пока память выше бюджета."""
+        if not self.max_bytes or self.resident_bytes <= self.max_bytes:
+            return
+        evicted = 0
+        while self.resident_bytes > self.max_bytes:
+            key = next(iter(self.user_sessions))
+            if key == active_key:
+                # Осталась только текущая сессия - ее не трогаем
+                break
+            # С постоянным хранилищем сессия подгрузится снова при следующем сообщении
+            self._drop_session(key)
+            evicted += 1
+        if not evicted:
+            # Над бюджетом только текущая сессия - не пишем в лог на каждое сообщение
+            return
+        self.evictions += evicted
+        logger.info(
+            f"Evicted {evicted} sessions over memory budget "
+            f"(resident {self.resident_bytes} of {self.max_bytes} bytes)"
+        )
+    
+    def _to_stored(self, message: DialogMessage) -> StoredMessage:
+        """Сообщение для хранилища: monotonic время переводится в unix-время."""
+        created = time.time() - (time.monotonic() - message.timestamp)
+        return (message.role, message.content, created, message.tokens)
+    
+    def _tick(self, timestamp: float) -> int:
+        """Номер тика колеса для момента времени."""
+        return int(timestamp // self.expiry_resolution)
+    
+    def _schedule_expiry(self, key: SessionKey, last_activity: float) -> None:
+        """Переставить сессию в тик, к началу которого она истечет."""
+        # +1: тик разбирается, когда наступает его начало, - не раньше истечения
+        tick = max(self._tick(last_activity + self.session_ttl) + 1, self._expiry_cursor)
+        old_tick = self._expiry_ticks.get(key)
+        if old_tick == tick:
+            return
+        if old_tick is not None:
+            self._remove_from_wheel(key, old_tick)
+        self._expiry_wheel.setdefault(tick, set()).add(key)
+        self._expiry_ticks[key] = tick
+    
+    def _unschedule_expiry(self, key: SessionKey) -> None:
+        """Убрать сессию из колеса истечения."""
+        tick = self._expiry_ticks.pop(key, None)
+        if tick is not None:
+            self._remove_from_wheel(key, tick)
+    
+    def _remove_from_wheel(self, key: SessionKey, tick: int) -> None:
+        """Удалить ключ из корзины тика, не оставляя пустых корзин."""
+        bucket = self._expiry_wheel.get(tick)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self._expiry_wheel[tick]
     
     def get_session_count(self) -> int:
         """Получить количество активных сессий."""
         return len(self.user_sessions)
     
-    def get_user_message_count(self, user_id: str) -> int:
+    def get_stats(self) -> Dict[str, int]:
+        """Получить статистику памяти истории."""
+        return {
+            "sessions": len(self.user_sessions),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "compressed": len(self.user_sessions) - len(self._warm),
+            "compressions": self.compressions,
+            "decompressions": self.decompressions,
+        }
+    
+    def get_user_message_count(self, user_id: SessionKey) -> int:
         """Получить количество сообщений в истории пользователя."""
-        if user_id not in self.user_sessions:
+        messages = self.user_sessions.get(_session_key(user_id))
+        if messages is None:
             return 0
-        return len(self.user_sessions[user_id])
+        return len(messages)
 
 
 # Глобальный экземпляр менеджера истории
-history_manager = HistoryManager()
+history_manager = HistoryManager(session_ttl=settings.SESSION_TTL, store=create_history_store())
@@ -0,0 +1,513 @@
+"""Постоянное хранилище истории диалогов."""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.config.settings import settings
+from src.utils.logger import logger
+
+
+# Запись сообщения: (роль, текст, unix-время, оценка токенов)
+StoredMessage = Tuple[str, str, float, int]
+# Загруженная сессия: (сообщения от старых к новым, сводка или None)
+StoredSession = Tuple[List[StoredMessage], Optional[StoredMessage]]
+
+
+class HistoryStore(ABC):
+    """
+    Интерфейс хранилища истории для HistoryManager.
+
+    Изменения (append/replace/delete) не блокируют event loop: реализация
+    копит их и пишет в фоне. load вызывается один раз на сессию - при
+    первом сообщении пользователя после запуска.
+
+    Общее хранилище (shared) могут менять другие процессы бота: тогда
+    сессия в памяти служит кэшем и сверяется с хранилищем через is_current.
+    """
+
+    shared = False
+
+    async def start(self) -> None:
+        """Открыть хранилище."""
+
+    async def close(self) -> None:
+        """Записать накопленные изменения и закрыть хранилище."""
+
+    @abstractmethod
+    async def load(self, key: str) -> StoredSession:
+        """Загрузить сессию пользователя."""
+
+    @abstractmethod
+    def append(self, key: str, message: StoredMessage) -> None:
+        """Добавить сообщение в конец истории."""
+
+    @abstractmethod
+    def replace(self, key: str, messages: List[StoredMessage], summary: Optional[StoredMessage]) -> None:
+        """Заменить историю целиком (после сжатия в сводку)."""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Удалить историю пользователя."""
+
+    def evict(self, key: str) -> None:
+        """Сессия истекла в памяти по TTL (по умолчанию удаляется и из хранилища)."""
+        self.delete(key)
+
+    async def is_current(self, key: str) -> bool:
+        """Совпадает ли сессия в памяти с хранилищем (для shared хранилищ)."""
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику хранилища."""
+        return {}
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """
+    История в локальной SQLite базе в режиме WAL с отложенной записью.
+
+    Все обращения к базе идут через один рабочий поток, поэтому event loop
+    не ждет диск. Изменения копятся в памяти и записываются пачкой в одной
+    транзакции раз в flush_interval секунд или при накоплении batch_size.
+    """
+
+    def __init__(self, path: str = settings.HISTORY_SQLITE_PATH,
+                 max_messages: int = 20,
+                 flush_interval: float = settings.HISTORY_FLUSH_INTERVAL,
+                 batch_size: int = settings.HISTORY_FLUSH_BATCH) -> None:
+        """
+        Инициализация хранилища.
+
+        Args:
+            path: Путь к файлу базы
+            max_messages: Сколько последних сообщений хранить на пользователя
+            flush_interval: Максимальная задержка записи в секундах
+            batch_size: Размер пачки, при котором запись начинается сразу
+        """
+        self.path = path
+        self.max_messages = max_messages
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pending: List[Tuple[Any, ...]] = []
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._flush_lock = asyncio.Lock()
+
+        # Статистика
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.flush_time = 0.0
+        self.loads = 0
+
+    async def start(self) -> None:
+        """Открыть базу и запустить фоновую запись."""
+        if self._flusher is not None:
+            return
+        await self._run(self._open)
+        self._flusher = asyncio.create_task(self._run_flusher())
+        logger.info(f"SQLite history store opened: {self.path}")
+
+    async def close(self) -> None:
+        """Записать накопленное и закрыть базу."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        logger.info("SQLite history store closed", **self.get_stats())
+
+    async def load(self, key: str) -> StoredSession:
+        """Загрузить сессию (сначала записав накопленные изменения)."""
+        await self.flush()
+        self.loads += 1
+        return await self._run(self._load, key)
+
+    def append(self, key: str, message: StoredMessage) -> None:
+        self._enqueue(("append", key) + tuple(message))
+
+    def replace(self, key: str, messages: List[StoredMessage], summary: Optional[StoredMessage]) -> None:
+        self._enqueue(("replace", key, list(messages), summary))
+
+    def delete(self, key: str) -> None:
+        self._enqueue(("delete", key))
+
+    async def flush(self) -> None:
+        """Записать все накопленные изменения."""
+        async with self._flush_lock:
+            if not self._pending or self._conn is None:
+                return
+            ops, self._pending = self._pending, []
+            started = time.monotonic()
+            try:
+                await self._run(self._write_batch, ops)
+            except Exception:
+                # Транзакция откатилась - вернем пачку в начало очереди
+                self._pending[:0] = ops
+                raise
+            self.flushes += 1
+            self.flushed_ops += len(ops)
+            self.flush_time += time.monotonic() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику записи."""
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_ops": self.flushed_ops,
+            "flush_avg_ms": self.flush_time / self.flushes * 1000 if self.flushes else 0.0,
+            "loads": self.loads,
+        }
+
+    def _enqueue(self, op: Tuple[Any, ...]) -> None:
+        """Поставить изменение в очередь записи (до start() изменения не сохраняются)."""
+        if self._flusher is None:
+            return
+        self._pending.append(op)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _run_flusher(self) -> None:
+        """Фоновая запись пачками."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush history to SQLite: {e}")
+
+    async def _run(self, func: Any, *args: Any) -> Any:
+        """Выполнить функцию в потоке базы."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    # Методы ниже выполняются только в потоке базы
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_key TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_user ON messages (user_key, id);
+            CREATE TABLE IF NOT EXISTS summaries (
+                user_key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                tokens INTEGER NOT NULL
+            );
+            """
+        )
+        self._conn = conn
+
+    def _load(self, key: str) -> StoredSession:
+        rows = self._conn.execute(
+            "SELECT role, content, created, tokens FROM messages "
+            "WHERE user_key = ? ORDER BY id DESC LIMIT ?",
+            (key, self.max_messages),
+        ).fetchall()
+        rows.reverse()
+        summary = self._conn.execute(
+            "SELECT 'system', content, created, tokens FROM summaries WHERE user_key = ?",
+            (key,),
+        ).fetchone()
+        return rows, summary
+
+    def _write_batch(self, ops: List[Tuple[Any, ...]]) -> None:
+        """Записать пачку изменений одной транзакцией, сохраняя порядок."""
+        appends: List[Tuple[Any, ...]] = []
+        touched = set()
+        with self._conn:
+            for op in ops:
+                kind, key = op[0], op[1]
+                if kind == "append":
+                    appends.append(op[1:])
+                    touched.add(key)
+                    continue
+                # Подряд идущие добавления пишутся одним executemany
+                self._insert(appends)
+                appends = []
+                self._conn.execute("DELETE FROM messages WHERE user_key = ?", (key,))
+                self._conn.execute("DELETE FROM summaries WHERE user_key = ?", (key,))
+                if kind == "replace":
+                    messages, summary = op[2], op[3]
+                    self._insert([(key,) + tuple(message) for message in messages])
+                    if summary is not None:
+                        self._conn.execute(
+                            "INSERT INTO summaries (user_key, content, created, tokens) VALUES (?, ?, ?, ?)",
+                            (key, summary[1], summary[2], summary[3]),
+                        )
+            self._insert(appends)
+            # Храним не больше max_messages последних сообщений на пользователя
+            for key in touched:
+                self._conn.execute(
+                    "DELETE FROM messages WHERE user_key = ? AND id <= ("
+                    "SELECT id FROM messages WHERE user_key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (key, key, self.max_messages),
+                )
+
+    def _insert(self, rows: List[Tuple[Any, ...]]) -> None:
+        if rows:
+            self._conn.executemany(
+                "INSERT INTO messages (user_key, role, content, created, tokens) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+
+class RedisHistoryStore(HistoryStore):
+    """
+    История в Redis, общая для нескольких реплик бота.
+
+    Сессия хранится списком JSON сообщений, сводкой и счетчиком версии.
+    Изменения уходят в фоне: все накопленные к моменту отправки операции
+    пишутся одним MULTI/EXEC пайплайном (RPUSH + LTRIM + EXPIRE + INCR
+    версии на сообщение) - один сетевой круг на пачку.
+
+    Сессии в памяти HistoryManager работают как read-through кэш: перед
+    обработкой сообщения версия сессии сверяется одним GET, и сессия
+    перечитывается, только если ее изменила другая реплика. Истечение
+    неактивных сессий выполняет сам Redis через EXPIRE.
+    """
+
+    shared = True
+
+    def __init__(self, url: str = settings.REDIS_URL,
+                 max_messages: int = 20,
+                 ttl: int = settings.SESSION_TTL,
+                 prefix: str = settings.REDIS_KEY_PREFIX,
+                 retry_delay: float = 1.0) -> None:
+        """
+        Инициализация хранилища.
+
+        Args:
+            url: Адрес Redis (redis://host:port/db)
+            max_messages: Сколько последних сообщений хранить на пользователя
+            ttl: Время жизни неактивной сессии в секундах
+            prefix: Префикс ключей
+            retry_delay: Пауза перед повтором записи после ошибки, с
+        """
+        self.url = url
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.prefix = prefix
+        self.retry_delay = retry_delay
+        self._client: Any = None
+        self._pending: List[Tuple[Any, ...]] = []
+        # Версия сессии, которой соответствует копия в памяти этого процесса
+        self._versions: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._flusher: Optional["asyncio.Task[None]"] = None
+        self._flush_lock = asyncio.Lock()
+
+        # Статистика
+        self.flushes = 0
+        self.flushed_ops = 0
+        self.flush_time = 0.0
+        self.loads = 0
+        self.validations = 0
+        self.stale = 0
+
+    async def start(self) -> None:
+        """Подключиться к Redis и запустить фоновую запись."""
+        if self._flusher is not None:
+            return
+        import redis.asyncio as redis
+
+        self._client = redis.from_url(self.url)
+        await self._client.ping()
+        self._flusher = asyncio.create_task(self._run_flusher())
+        logger.info(f"Redis history store connected: {self.url}")
+
+    async def close(self) -> None:
+        """Записать накопленное и закрыть соединения."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        if self._client is not None:
+            try:
+                await self.flush()
+            finally:
+                await self._client.aclose()
+                self._client = None
+        logger.info("Redis history store closed", **self.get_stats())
+
+    async def load(self, key: str) -> StoredSession:
+        """Загрузить сессию и запомнить ее версию."""
+        await self.flush()
+        self.loads += 1
+        messages_key, summary_key, version_key = self._keys(key)
+        async with self._client.pipeline(transaction=True) as pipe:
+            pipe.lrange(messages_key, -self.max_messages, -1)
+            pipe.get(summary_key)
+            pipe.get(version_key)
+            raw_messages, raw_summary, version = await pipe.execute()
+        self._versions[key] = int(version or 0)
+        messages = [tuple(json.loads(raw)) for raw in raw_messages]
+        summary = tuple(json.loads(raw_summary)) if raw_summary is not None else None
+        return messages, summary
+
+    def append(self, key: str, message: StoredMessage) -> None:
+        self._enqueue(("append", key, message))
+
+    def replace(self, key: str, messages: List[StoredMessage], summary: Optional[StoredMessage]) -> None:
+        self._enqueue(("replace", key, list(messages), summary))
+
+    def delete(self, key: str) -> None:
+        self._enqueue(("delete", key))
+
+    def evict(self, key: str) -> None:
+        # Данные в Redis истекают сами, а другие реплики могут еще работать с сессией
+        self._versions.pop(key, None)
+
+    async def is_current(self, key: str) -> bool:
+        """Сверить версию сессии в памяти с версией в Redis."""
+        await self.flush()
+        self.validations += 1
+        expected = self._versions.get(key)
+        version = await self._client.get(self._keys(key)[2])
+        if expected is not None and int(version or 0) == expected:
+            return True
+        self.stale += 1
+        return False
+
+    async def flush(self) -> None:
+        """Отправить все накопленные изменения одним пайплайном."""
+        async with self._flush_lock:
+            if not self._pending or self._client is None:
+                return
+            ops, self._pending = self._pending, []
+            started = time.monotonic()
+            try:
+                await self._write_batch(ops)
+            except Exception:
+                # MULTI/EXEC не применился - вернем пачку в начало очереди
+                self._pending[:0] = ops
+                raise
+            self.flushes += 1
+            self.flushed_ops += len(ops)
+            self.flush_time += time.monotonic() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику записи и сверки версий."""
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_ops": self.flushed_ops,
+            "flush_avg_ms": self.flush_time / self.flushes * 1000 if self.flushes else 0.0,
+            "loads": self.loads,
+            "validations": self.validations,
+            "stale": self.stale,
+        }
+
+    def _keys(self, key: str) -> Tuple[str, str, str]:
+        """Ключи сообщений, сводки и версии сессии."""
+        base = f"{self.prefix}:{key}"
+        return f"{base}:messages", f"{base}:summary", f"{base}:version"
+
+    def _enqueue(self, op: Tuple[Any, ...]) -> None:
+        """Поставить изменение в очередь (до start() изменения не сохраняются)."""
+        if self._flusher is None:
+            return
+        self._pending.append(op)
+        self._wakeup.set()
+
+    async def _run_flusher(self) -> None:
+        """Фоновая отправка: все, что накопилось за время предыдущего круга."""
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush history to Redis: {e}")
+                await asyncio.sleep(self.retry_delay)
+                self._wakeup.set()
+
+    async def _write_batch(self, ops: List[Tuple[Any, ...]]) -> None:
+        """Записать пачку одной транзакцией и обновить известные версии."""
+        # Ключ -> (число изменений версии, индекс результата последнего INCR)
+        bumps: Dict[str, List[int]] = {}
+        commands = 0
+        async with self._client.pipeline(transaction=True) as pipe:
+            for op in ops:
+                kind, key = op[0], op[1]
+                messages_key, summary_key, version_key = self._keys(key)
+                if kind == "append":
+                    pipe.rpush(messages_key, _encode_message(op[2]))
+                    pipe.ltrim(messages_key, -self.max_messages, -1)
+                    pipe.expire(messages_key, self.ttl)
+                    commands += 3
+                else:
+                    pipe.delete(messages_key, summary_key)
+                    commands += 1
+                    if kind == "replace":
+                        messages, summary = op[2], op[3]
+                        if messages:
+                            pipe.rpush(messages_key, *[_encode_message(message) for message in messages])
+                            pipe.expire(messages_key, self.ttl)
+                            commands += 2
+                        if summary is not None:
+                            pipe.set(summary_key, _encode_message(summary), ex=self.ttl)
+                            commands += 1
+                pipe.incr(version_key)
+                pipe.expire(version_key, self.ttl)
+                bump = bumps.setdefault(key, [0, 0])
+                bump[0] += 1
+                bump[1] = commands
+                commands += 2
+            results = await pipe.execute()
+
+        for key, (count, index) in bumps.items():
+            expected = self._versions.get(key)
+            if expected is not None and results[index] == expected + count:
+                self._versions[key] = results[index]
+            else:
+                # Между нашими записями сессию меняла другая реплика
+                self._versions.pop(key, None)
+
+
+def _encode_message(message: StoredMessage) -> str:
+    """Сообщение в компактный JSON массив."""
+    return json.dumps(list(message), ensure_ascii=False, separators=(",", ":"))
+
+
+def create_history_store(max_messages: int = 20) -> Optional[HistoryStore]:
+    """Создать хранилище по настройке HISTORY_BACKEND (None - только память)."""
+    backend = settings.HISTORY_BACKEND
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return SQLiteHistoryStore(max_messages=max_messages)
+    if backend == "redis":
+        return RedisHistoryStore(max_messages=max_messages)
+    raise ValueError(f"Unknown HISTORY_BACKEND: {backend}")
@@ -0,0 +1,21 @@
+"""Приблизительная оценка количества токенов."""
+
+
+# Средний размер токена в байтах UTF-8 (для кириллицы оценка с запасом)
+BYTES_PER_TOKEN = 4
+
+# Служебные токены на каждое сообщение чата (роль, разделители)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Оценить количество токенов в сообщении без токенизатора модели.
+    
+    Args:
+        text: Текст сообщения
+        
+    Returns:
+        Оценка количества токенов с учетом служебных полей сообщения
+    """
+    return len(text.encode("utf-8")) // BYTES_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
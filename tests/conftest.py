@@ -114,10 +114,12 @@ def mock_history_manager() -> Generator[MagicMock, None, None]:
     """Мок менеджера истории диалогов."""
     manager = MagicMock()
     manager.get_context_messages.return_value = []
+    manager.ensure_loaded = AsyncMock()
     manager.add_message.return_value = None
     manager.clear_user_history.return_value = True
     manager.get_user_message_count.return_value = 0
     manager.clear_old_sessions.return_value = 0
+    manager.get_stats.return_value = {"sessions": 0, "resident_bytes": 0, "max_bytes": 0, "evictions": 0}
     manager.user_sessions = {}
     
     # Патчим глобальный экземпляр
@@ -1,7 +1,32 @@
 """Тесты для обработчиков Telegram бота."""
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
+import asyncio
+import json
+import sys
+import time
+from types import SimpleNamespace
+from typing import Generator
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetFile, SendChatAction, SendMessage
+from aiogram.types import Document, Message, PhotoSize, Sticker
+from src.bot.admission import AdmissionMiddleware, AdmissionQueue
+from src.bot.dialogs import DialogActors
+from src.bot.media import MediaIngestor, MediaRejected
+from src.bot.outbound import (
+    SEND_PRIORITY_FLAG, OutboundMiddleware, OutboundScheduler, SendPriorityMiddleware, send_priority
+)
 from src.bot.handlers import BotHandlers
+from src.bot.sharding import HashRing, update_user_id
+from src.bot.status import LLM_DEGRADED, LLM_DOWN, LLM_OK, StatusCollector
+from src.bot.supervisor import Supervisor, create_routing_dispatcher
+from src.bot.worker import UpdateWorker
+from src.bot.webhook import SECRET_HEADER, create_webhook_app
+from src.llm.resilience import CircuitBreaker
+from src.llm.streaming import FallbackText
+from src.multimodal.analysis_cache import AnalysisCache
 
 
 class TestBotHandlers:
@@ -22,9 +47,13 @@ class TestBotHandlers:
         return dp
     
     @pytest.fixture
-    def bot_handlers(self, mock_bot, mock_dispatcher, mock_settings) -> BotHandlers:
+    def bot_handlers(self, mock_bot, mock_dispatcher, mock_settings) -> Generator[BotHandlers, None, None]:
         """Фикстура обработчиков бота."""
-        return BotHandlers(mock_bot, mock_dispatcher)
+        handlers = BotHandlers(mock_bot, mock_dispatcher)
+        handlers.dialogs.debounce = 0  # Не ждать продолжения серии сообщений
+        # Свой кэш анализов на тест, чтобы ответы не переходили между тестами
+        with patch("src.bot.handlers.analysis_cache", AnalysisCache(path="")):
+            yield handlers
     
     def test_init_registers_handlers(self, mock_bot, mock_dispatcher, mock_settings) -> None:
         """Тест что все обработчики регистрируются при инициализации."""
@@ -156,17 +185,25 @@ class TestBotHandlers:
     @pytest.mark.asyncio
     async def test_get_system_status(self, bot_handlers: BotHandlers, mock_history_manager) -> None:
         """Тест получения статуса системы."""
-        mock_history_manager.user_sessions = {"user1": {"messages": [1, 2, 3]}}
+        mock_history_manager.user_sessions = {"user1": [1, 2, 3]}
         
         with patch("src.bot.handlers.llm_client") as mock_llm_client, \
              patch("src.bot.handlers.history_manager", mock_history_manager):
-            mock_llm_client.send_message.return_value = "test response"
+            mock_llm_client.response_cache.get_stats.return_value = {"hit_rate": 0.5, "coalesced": 2}
+            mock_llm_client.limiter.get_stats.return_value = {"in_flight": 1, "limit": 10, "queue_depth": 0}
+            mock_llm_client.breakers = {}
+            collector = StatusCollector(history=mock_history_manager, client=mock_llm_client)
             
-            with patch("psutil.cpu_percent", return_value=15.5):
-                with patch("psutil.virtual_memory") as mock_memory:
-                    mock_memory.return_value.percent = 60.2
-                    
-                    status = await bot_handlers._get_system_status()
+            with patch("psutil.cpu_percent", return_value=15.5) as mock_cpu, \
+                 patch("psutil.virtual_memory") as mock_memory, \
+                 patch("src.bot.handlers.status_collector", collector):
+                mock_memory.return_value.percent = 60.2
+                
+                status = await bot_handlers._get_system_status()
+        
+        # Статус не ходит в LLM и не ждет замера CPU
+        mock_llm_client.send_message.assert_not_called()
+        mock_cpu.assert_called_with(interval=None)
         
         assert "bot_status" in status
         assert "llm_status" in status  
@@ -181,6 +218,8 @@ class TestBotHandlers:
         # Проверяем память
         assert "1 активных диалогов" in status['memory_status']
         assert "3 сообщений" in status['memory_status']
+        assert "CPU 15.5%" in status['system_status']
+        assert "✅" in status['llm_status']
     
     @pytest.mark.asyncio
     async def test_handle_media_message_photo(self, bot_handlers: BotHandlers, mock_telegram_message, mock_logger) -> None:
@@ -213,6 +252,10 @@ class TestBotHandlers:
         mock_sticker.file_id = "test_sticker_id"
         mock_sticker.emoji = "😀"
         mock_sticker.set_name = "test_sticker_set"
+        mock_sticker.is_animated = mock_sticker.is_video = False
+        mock_sticker.width = mock_sticker.height = 512
+        mock_sticker.file_size = 1024
+        mock_telegram_message.photo = None
         mock_telegram_message.sticker = mock_sticker
         mock_telegram_message.caption = "Тестовый стикер"
         
@@ -265,6 +308,61 @@ class TestBotHandlers:
         
         mock_logger.error.assert_called()
     
+    @pytest.mark.asyncio
+    async def test_repeated_sticker_served_from_cache(self, bot_handlers: BotHandlers, mock_telegram_message, mock_logger) -> None:
+        """Повторный стикер отвечается из кэша: без скачивания и vision запроса."""
+        sticker = Sticker(file_id="f1", file_unique_id="popular", type="regular", width=512, height=512,
+                          is_animated=False, is_video=False, emoji="😀", set_name="memes", file_size=20_000)
+        mock_telegram_message.photo = None
+        mock_telegram_message.sticker = sticker
+        mock_telegram_message.caption = None
+        bot_handlers.bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path="p", file_size=None))
+        bot_handlers.bot.download_file = AsyncMock(return_value=MagicMock(read=MagicMock(return_value=b"webp")))
+        
+        mock_analyze = AsyncMock(side_effect=[FallbackText("❌ Ошибка анализа изображения: 502"), "Анализ стикера", "Другой"])
+        with patch.object(bot_handlers.image_processor, 'analyze_image', mock_analyze), \
+             patch("src.bot.handlers.logger", mock_logger):
+            for _ in range(4):
+                await bot_handlers.sticker_handler(mock_telegram_message)
+        
+        # Ошибка не кэшируется, успешный анализ переиспользуется
+        assert mock_analyze.await_count == 2
+        assert bot_handlers.bot.download_file.await_count == 2
+        answers = [call.args[0] for call in mock_telegram_message.answer.call_args_list]
+        assert answers[1:] == ["Анализ стикера", "Анализ стикера", "Анализ стикера"]
+    
+    @pytest.mark.asyncio
+    async def test_interrupted_stream_analysis_not_cached(self, bot_handlers: BotHandlers, mock_telegram_message, mock_logger) -> None:
+        """Анализ, оборвавшийся посреди потока, показывается, но не кэшируется."""
+        sticker = Sticker(file_id="f1", file_unique_id="broken", type="regular", width=512, height=512,
+                          is_animated=False, is_video=False, emoji="😀", set_name="memes", file_size=20_000)
+        mock_telegram_message.photo = None
+        mock_telegram_message.sticker = sticker
+        mock_telegram_message.caption = None
+        mock_telegram_message.answer = AsyncMock(return_value=MagicMock())
+        mock_telegram_message.bot.edit_message_text = AsyncMock()
+        bot_handlers.bot.get_file = AsyncMock(return_value=SimpleNamespace(file_path="p", file_size=None))
+        bot_handlers.bot.download_file = AsyncMock(return_value=MagicMock(read=MagicMock(return_value=b"webp")))
+        streams = []
+        
+        async def broken_stream(image_data, caption):
+            streams.append(caption)
+            yield "Этот стикер"
+            yield FallbackText("\n\n❌ Неожиданная ошибка при анализе: Connection reset")
+        
+        with patch.object(bot_handlers.image_processor, "analyze_image_stream", broken_stream), \
+             patch("src.bot.handlers.settings") as mock_handler_settings, \
+             patch("src.bot.handlers.logger", mock_logger):
+            mock_handler_settings.LLM_STREAMING = True
+            mock_handler_settings.MEDIA_CACHE_ENABLED = True
+            for _ in range(2):
+                await bot_handlers.sticker_handler(mock_telegram_message)
+        
+        # Оба раза поток запрашивался заново, обрыв виден пользователю
+        assert len(streams) == 2
+        shown = mock_telegram_message.bot.edit_message_text.call_args.kwargs["text"]
+        assert shown.startswith("Этот стикер") and "❌" in shown
+    
     @pytest.mark.asyncio
     async def test_message_handler_media(self, bot_handlers: BotHandlers, mock_telegram_message) -> None:
         """Тест обработки медиа сообщений."""
@@ -352,14 +450,12 @@ class TestBotHandlers:
         mock_logger.error.assert_called()
     
     @pytest.mark.asyncio
-    async def test_message_handler_session_cleanup(self, bot_handlers: BotHandlers, mock_telegram_message, mock_history_manager, mock_validator, mock_logger) -> None:
-        """Тест периодической очистки сессий."""
+    async def test_message_handler_does_not_clean_sessions(self, bot_handlers: BotHandlers, mock_telegram_message, mock_history_manager, mock_validator, mock_logger) -> None:
+        """Тест что очистка сессий не выполняется в обработчике сообщений."""
         mock_validator.validate_user_message.return_value = (True, None)
         mock_history_manager.get_context_messages.return_value = []
-        mock_history_manager.clear_old_sessions.return_value = 5
         
-        # Симулируем что у нас есть ровно 10 пользователей (кратно 10)
-        # Это должно вызвать очистку сессий
+        # Раньше очистка запускалась при числе сессий, кратном 10
         mock_history_manager.user_sessions = {f"user_{i}": {} for i in range(10)}
         
         # Патчим глобальные компоненты
@@ -372,9 +468,747 @@ class TestBotHandlers:
             
             await bot_handlers.message_handler(mock_telegram_message)
         
-        # Проверяем что была вызвана очистка
-        # Условие: len(user_sessions) % 10 == 0, т.е. 10 % 10 == 0
-        mock_history_manager.clear_old_sessions.assert_called_once()
+        # Очисткой занимается фоновая задача HistoryManager
+        mock_history_manager.clear_old_sessions.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_message_handler_streaming(self, bot_handlers: BotHandlers, mock_telegram_message, mock_history_manager, mock_validator, mock_logger) -> None:
+        """Тест потоковой отправки ответа LLM."""
+        async def fake_stream(*args):
+            for delta in ["Сарказм", " в потоке"]:
+                yield delta
+        
+        sent_message = MagicMock()
+        mock_telegram_message.answer = AsyncMock(return_value=sent_message)
+        mock_telegram_message.bot.edit_message_text = AsyncMock()
+        
+        with patch("src.bot.handlers.llm_client") as mock_llm_client, \
+             patch("src.bot.handlers.settings") as mock_handler_settings, \
+             patch("src.bot.handlers.history_manager", mock_history_manager), \
+             patch("src.bot.handlers.validator", mock_validator), \
+             patch("src.bot.handlers.logger", mock_logger):
+            mock_handler_settings.LLM_STREAMING = True
+            mock_llm_client.stream_message = MagicMock(side_effect=fake_stream)
+            
+            await bot_handlers.message_handler(mock_telegram_message)
+        
+        # Первый фрагмент отправлен сразу, финальный текст - редактированием
+        mock_telegram_message.answer.assert_called_once_with("Сарказм")
+        mock_telegram_message.bot.edit_message_text.assert_called_once()
+        assert mock_telegram_message.bot.edit_message_text.call_args.kwargs["text"] == "Сарказм в потоке"
+        mock_history_manager.add_message.assert_any_call("12345", "assistant", "Сарказм в потоке")
+
+    @pytest.mark.asyncio
+    async def test_message_handler_stream_interrupted(self, bot_handlers: BotHandlers, mock_telegram_message, mock_history_manager, mock_validator, mock_logger) -> None:
+        """Тест что оборванный поток показан с пометкой и так же сохранен в историю."""
+        from src.llm.streaming import FallbackText
+        
+        async def broken_stream(*args):
+            yield "Сарказм"
+            yield FallbackText("\n\n✂️ Ответ оборвался")
+        
+        mock_telegram_message.answer = AsyncMock(return_value=MagicMock())
+        mock_telegram_message.bot.edit_message_text = AsyncMock()
+        
+        with patch("src.bot.handlers.llm_client") as mock_llm_client, \
+             patch("src.bot.handlers.settings") as mock_handler_settings, \
+             patch("src.bot.handlers.history_manager", mock_history_manager), \
+             patch("src.bot.handlers.validator", mock_validator), \
+             patch("src.bot.handlers.logger", mock_logger):
+            mock_handler_settings.LLM_STREAMING = True
+            mock_llm_client.stream_message = MagicMock(side_effect=broken_stream)
+            
+            await bot_handlers.message_handler(mock_telegram_message)
+        
+        shown = mock_telegram_message.bot.edit_message_text.call_args.kwargs["text"]
+        assert shown == "Сарказм\n\n✂️ Ответ оборвался"
+        mock_history_manager.add_message.assert_any_call("12345", "assistant", shown)
+        mock_logger.warning.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_message_burst_coalesced(self, bot_handlers: BotHandlers, mock_history_manager, mock_validator, mock_logger) -> None:
+        """Тест что серия сообщений уходит в LLM одним запросом с ответом на последнее."""
+        bot_handlers.dialogs.debounce = 0.05
+        messages = []
+        for text in ["Привет", "У меня вопрос", "Как стать миллионером?"]:
+            message = MagicMock()
+            message.from_user.id = 12345
+            message.text = text
+            message.answer = AsyncMock()
+            message.bot.send_chat_action = AsyncMock()
+            messages.append(message)
+        
+        with patch("src.bot.handlers.llm_client") as mock_llm_client, \
+             patch("src.bot.handlers.history_manager", mock_history_manager), \
+             patch("src.bot.handlers.validator", mock_validator), \
+             patch("src.bot.handlers.logger", mock_logger):
+            mock_llm_client.send_message = AsyncMock(return_value="Никак")
+            await asyncio.gather(*(bot_handlers.message_handler(message) for message in messages))
+        
+        mock_llm_client.send_message.assert_called_once()
+        assert mock_llm_client.send_message.call_args[0][0] == "Привет\nУ меня вопрос\nКак стать миллионером?"
+        mock_history_manager.add_message.assert_any_call("12345", "user", "Привет\nУ меня вопрос\nКак стать миллионером?")
+        messages[-1].answer.assert_called_once_with("Никак")
+        messages[0].answer.assert_not_called()
+        assert bot_handlers.dialogs.get_stats()["coalesced"] == 2
+
+
+class TestDialogActors:
+    """Тесты для последовательной обработки сообщений пользователя."""
+    
+    @pytest.mark.asyncio
+    async def test_batches_in_order_without_overlap(self) -> None:
+        """Тест что пачки пользователя не пересекаются, а пришедшие во время ответа идут следующей."""
+        batches = []
+        running = set()
+        
+        async def handler(user_id, messages):
+            assert user_id not in running  # Один запрос на пользователя за раз
+            running.add(user_id)
+            batches.append((user_id, list(messages)))
+            await asyncio.sleep(0.05)
+            running.discard(user_id)
+        
+        actors = DialogActors(handler, debounce=0.01, max_wait=1.0, max_batch=5)
+        first = asyncio.create_task(actors.submit("1", "a"))
+        other = asyncio.create_task(actors.submit("2", "x"))
+        await asyncio.sleep(0.03)  # Пачка "a" уже в обработке
+        await asyncio.gather(first, other, actors.submit("1", "b"), actors.submit("1", "c"))
+        
+        assert [batch for batch in batches if batch[0] == "1"] == [("1", ["a"]), ("1", ["b", "c"])]
+        assert ("2", ["x"]) in batches
+        stats = actors.get_stats()
+        assert stats["batches"] == 3
+        assert stats["coalesced"] == 1
+        assert stats["active"] == 0  # Опустевшие акторы завершились
+    
+    @pytest.mark.asyncio
+    async def test_batch_limits(self) -> None:
+        """Тест ограничения размера пачки и отказа обработчика."""
+        batches = []
+        
+        async def handler(user_id, messages):
+            batches.append(list(messages))
+            if "boom" in messages:
+                raise RuntimeError("boom")
+        
+        actors = DialogActors(handler, debounce=0.05, max_wait=1.0, max_batch=2)
+        await asyncio.gather(*(actors.submit("1", item) for item in ["a", "b", "boom"]))
+        
+        assert batches == [["a", "b"], ["boom"]]
+        assert actors.get_stats()["failures"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_batch_text_limited_by_chars(self) -> None:
+        """Тест что объединенный текст пачки не длиннее лимита одного сообщения."""
+        batches = []
+        
+        async def handler(user_id, messages):
+            batches.append([message.text for message in messages])
+        
+        actors = DialogActors(handler, debounce=0.05, max_wait=1.0, max_batch=5, max_chars=10)
+        texts = ["aaaa", "bbbbb", "cc", "dddddddddddd"]
+        await asyncio.gather(*(actors.submit("1", SimpleNamespace(text=text)) for text in texts))
+        
+        # "aaaa\nbbbbb" - ровно 10 символов; слишком длинное сообщение идет отдельной пачкой
+        assert batches == [["aaaa", "bbbbb"], ["cc"], ["dddddddddddd"]]
+        assert all(len("\n".join(batch)) <= 10 for batch in batches[:2])
+
+
+class TestMediaIngestor:
+    """Тесты приема медиафайлов."""
+    
+    @pytest.fixture
+    def bot(self) -> Bot:
+        """Настоящий бот: скачивание идет через download_file aiogram."""
+        return Bot("123456:TEST-token")
+    
+    @staticmethod
+    def photo(side: int, size: int) -> PhotoSize:
+        return PhotoSize(file_id=f"id{side}", file_unique_id=f"u{side}", width=side, height=side * 3 // 4,
+                         file_size=size)
+    
+    def test_select(self, bot: Bot) -> None:
+        """Берется наименьшее достаточное фото, у анимированного стикера - превью."""
+        media = MediaIngestor(bot, max_bytes=10_000_000, max_side=4096, target_side=1024)
+        sizes = [self.photo(90, 1_000), self.photo(320, 20_000), self.photo(1280, 200_000), self.photo(2560, 900_000)]
+        assert media.select(SimpleNamespace(photo=sizes)).file_id == "id1280"
+        assert media.select(SimpleNamespace(photo=sizes[:2])).file_id == "id320"
+        
+        animated = Sticker(file_id="tgs", file_unique_id="tgs", type="regular", width=512, height=512,
+                           is_animated=True, is_video=False, thumbnail=self.photo(128, 4_000))
+        assert media.select(SimpleNamespace(photo=None, sticker=animated)).file_id == "id128"
+        
+        document = Document(file_id="pdf", file_unique_id="pdf", mime_type="application/pdf")
+        assert media.select(SimpleNamespace(photo=None, sticker=None, document=document)) is None
+    
+    @pytest.mark.asyncio
+    async def test_rejects_before_download(self, bot: Bot) -> None:
+        """Файл сверх лимитов по метаданным не запрашивается у Telegram."""
+        media = MediaIngestor(bot, max_bytes=1_000_000, max_side=4096, target_side=1024)
+        with patch.object(Bot, "get_file", AsyncMock()) as get_file:
+            with pytest.raises(MediaRejected, match="слишком большой"):
+                await media.download(media.select(SimpleNamespace(photo=[self.photo(1280, 5_000_000)])))
+            with pytest.raises(MediaRejected, match="5000x3750"):
+                await media.download(media.select(SimpleNamespace(photo=[self.photo(5000, 900_000)])))
+        get_file.assert_not_called()
+        assert media.get_stats()["rejected"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_download_stops_at_cap(self, bot: Bot) -> None:
+        """Скачивание обрывается на лимите, а не после чтения файла целиком."""
+        media = MediaIngestor(bot, max_bytes=256 * 1024, max_side=4096, target_side=1024, chunk_size=64 * 1024)
+        streamed = []
+        
+        async def stream_content(**kwargs):
+            for _ in range(100):
+                streamed.append(kwargs["chunk_size"])
+                yield b"x" * kwargs["chunk_size"]
+        
+        document = Document(file_id="doc", file_unique_id="doc", mime_type="image/png")
+        file_info = SimpleNamespace(file_path="documents/file.png", file_size=None)
+        with patch.object(Bot, "get_file", AsyncMock(return_value=file_info)), \
+             patch.object(bot.session, "stream_content", stream_content):
+            with pytest.raises(MediaRejected):
+                await media.download(media.select(SimpleNamespace(photo=None, sticker=None, document=document)))
+            assert len(streamed) == 5
+            
+            streamed.clear()
+            small = MediaIngestor(bot, max_bytes=10_000_000, max_side=4096, target_side=1024, chunk_size=1024)
+            data = await small.download(small.select(SimpleNamespace(photo=None, sticker=None, document=document)))
+        assert data == b"x" * 100 * 1024
+        await bot.session.close()
+
+
+class TestAnalysisCache:
+    """Тесты кэша анализов изображений."""
+    
+    def test_key_normalizes_caption(self) -> None:
+        """Подпись сравнивается без регистра и лишних пробелов, файл - точно."""
+        key = AnalysisCache.make_key("AgAD1", "  Что  это? ")
+        assert key == AnalysisCache.make_key("AgAD1", "что это?")
+        assert key != AnalysisCache.make_key("AgAD2", "что это?")
+        assert key != AnalysisCache.make_key("AgAD1", "")
+    
+    @pytest.mark.asyncio
+    async def test_per_entry_ttl_and_stats(self) -> None:
+        """У каждой записи свой TTL, попадания учитываются."""
+        cache = AnalysisCache(max_bytes=100_000, ttl=60, path="")
+        await cache.put("photo", "фото", ttl=10)
+        await cache.put("sticker", "стикер", ttl=1000)
+        assert await cache.lookup("photo") == "фото"
+        
+        later = time.monotonic() + 100
+        with patch("src.llm.cache.time.monotonic", return_value=later):
+            assert await cache.lookup("photo") is None
+            assert await cache.lookup("sticker") == "стикер"
+        
+        stats = cache.get_stats()
+        assert (stats["hits"], stats["misses"]) == (2, 1)
+        assert stats["entries"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_persists_on_disk(self, tmp_path) -> None:
+        """С path анализы переживают перезапуск, истекшие - нет."""
+        path = str(tmp_path / "media_cache.db")
+        cache = AnalysisCache(path=path)
+        await cache.start()
+        await cache.put("fresh", "анализ", ttl=3600)
+        await cache.put("stale", "старый", ttl=-1)
+        await cache.close()
+        
+        restarted = AnalysisCache(path=path)
+        await restarted.start()
+        try:
+            assert await restarted.lookup("fresh") == "анализ"
+            assert await restarted.lookup("stale") is None
+            assert await restarted.lookup("fresh") == "анализ"
+        finally:
+            await restarted.close()
+        assert restarted.get_stats()["disk_hits"] == 1
+
+
+class TestOutbound:
+    """Тесты планировщика исходящих сообщений."""
+    
+    @pytest.mark.asyncio
+    async def test_chat_limit_does_not_block_other_chats(self) -> None:
+        """Чат сверх своего лимита ждет, другие чаты отправляют сразу."""
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=20, group_rate=20, chat_burst=1)
+        await scheduler.start()
+        sent = {}
+        started = time.monotonic()
+        
+        async def send(name: str, chat_id: int) -> None:
+            await scheduler.acquire(chat_id)
+            sent[name] = time.monotonic() - started
+        
+        try:
+            await asyncio.gather(send("a1", 1), send("a2", 1), send("a3", 1), send("b1", 2))
+        finally:
+            await scheduler.close()
+        
+        assert sent["b1"] < 0.03
+        assert sent["a1"] < sent["a2"] < sent["a3"]
+        assert sent["a3"] >= 0.09  # Два интервала по 50 мс
+        assert scheduler.get_stats()["sent"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_priority_lane_served_first(self) -> None:
+        """При исчерпанном общем лимите ответ на команду обгоняет обычные."""
+        scheduler = OutboundScheduler(global_rate=50, chat_rate=100, group_rate=100, chat_burst=1, global_burst=1)
+        await scheduler.start()
+        order = []
+        
+        async def send(name: str, chat_id: int, priority: bool = False) -> None:
+            await scheduler.acquire(chat_id, priority)
+            order.append(name)
+        
+        try:
+            await scheduler.acquire(1000)  # Весь запас общей корзины
+            normal = [asyncio.create_task(send(f"n{i}", i)) for i in range(3)]
+            await asyncio.sleep(0)
+            await send("cmd", 99, priority=True)
+            await asyncio.gather(*normal)
+        finally:
+            await scheduler.close()
+        
+        assert order == ["cmd", "n0", "n1", "n2"]
+        assert scheduler.get_stats()["priority_sent"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_middleware_retries_after_flood_control(self) -> None:
+        """На RetryAfter чат ждет и запрос повторяется, "печатает..." не ждет очереди."""
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=1000, group_rate=1000, chat_burst=5)
+        middleware = OutboundMiddleware(scheduler, max_retries=2, max_retry_after=5)
+        method = SendMessage(chat_id=1, text="Сарказм")
+        calls = []
+        
+        async def make_request(bot, method):
+            calls.append(type(method).__name__)
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+            return "sent"
+        
+        await scheduler.start()
+        try:
+            assert await middleware(make_request, None, method) == "sent"
+            assert calls == ["SendMessage", "SendMessage"]
+            assert scheduler.get_stats()["retry_after"] == 1
+            
+            # Запросы без чата не ограничиваются
+            assert await middleware(make_request, None, GetFile(file_id="f")) == "sent"
+            
+            # Отправки ждут в очереди - статус "печатает..." пропускается
+            scheduler._lanes[1].append((2, asyncio.get_running_loop().create_future()))
+            assert await middleware(make_request, None, SendChatAction(chat_id=1, action="typing")) is True
+            assert calls[-1] == "GetFile"
+            
+            async def flood(bot, method):
+                raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=30)
+            
+            with pytest.raises(TelegramRetryAfter):
+                await middleware(flood, None, SendMessage(chat_id=3, text="x"))
+        finally:
+            await scheduler.close()
+    
+    @pytest.mark.asyncio
+    async def test_chat_action_keeps_chat_tokens(self) -> None:
+        """"Печатает..." не тратит лимит чата и не отправляется в чат на паузе."""
+        scheduler = OutboundScheduler(global_rate=1000, chat_rate=1, group_rate=1, chat_burst=1)
+        await scheduler.start()
+        try:
+            for _ in range(3):
+                assert scheduler.try_acquire(1)
+            started = time.monotonic()
+            await scheduler.acquire(1)
+            assert time.monotonic() - started < 0.05
+            
+            scheduler.penalize(2, 30)
+            assert scheduler.try_acquire(2) is False
+        finally:
+            await scheduler.close()
+        
+        assert scheduler.get_stats()["dropped_actions"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_priority_flag_sets_context(self) -> None:
+        """Флаг обработчика включает приоритет только на время обработчика."""
+        middleware = SendPriorityMiddleware()
+        seen = []
+        
+        async def handler(event, data):
+            seen.append(send_priority.get())
+        
+        await middleware(handler, None, {"handler": SimpleNamespace(flags={SEND_PRIORITY_FLAG: True})})
+        await middleware(handler, None, {"handler": SimpleNamespace(flags={})})
+        assert seen == [True, False]
+        assert send_priority.get() is False
+
+
+class TestStatusCollector:
+    """Тесты фонового сборщика состояния."""
+    
+    def test_counts_messages_and_llm_health(self, mock_history_manager) -> None:
+        """Сообщения считаются по буферам, здоровье LLM - по breaker'ам."""
+        mock_history_manager.user_sessions = {"1": [1, 2], "2": [1, 2, 3]}
+        primary, fallback = CircuitBreaker(failure_threshold=1), CircuitBreaker(failure_threshold=1)
+        client = SimpleNamespace(breakers={"primary": primary, "fallback": fallback})
+        collector = StatusCollector(history=mock_history_manager, client=client)
+        
+        snapshot = collector.collect()
+        assert (snapshot.sessions, snapshot.messages) == (2, 5)
+        assert snapshot.llm_state == LLM_OK
+        
+        primary.record_failure("rate_limit")
+        assert collector.collect().llm_state == LLM_DEGRADED
+        assert collector.snapshot.llm_error == "rate_limit"
+        fallback.record_failure("server_error")
+        assert collector.collect().llm_state == LLM_DOWN
+    
+    @pytest.mark.asyncio
+    async def test_background_refresh(self, mock_history_manager) -> None:
+        """Снимок обновляется в фоне, чтение его не пересобирает."""
+        collector = StatusCollector(interval=0.01, history=mock_history_manager,
+                                    client=SimpleNamespace(breakers={}))
+        await collector.start()
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            await collector.close()
+        
+        samples = collector.get_stats()["samples"]
+        assert samples >= 2
+        first = collector.snapshot
+        assert collector.snapshot is first
+        assert collector.get_stats()["samples"] == samples
+
+
+class TestAdmissionQueue:
+    """Тесты для очереди входящих обновлений."""
+    
+    @pytest.mark.asyncio
+    async def test_sheds_when_full_or_waited_too_long(self) -> None:
+        """Тест что лишние обновления сбрасываются сразу или по таймауту ожидания."""
+        queue = AdmissionQueue(concurrency=1, max_queue=1, max_wait=0.05)
+        assert await queue.acquire()
+        
+        waiter = asyncio.create_task(queue.acquire())
+        await asyncio.sleep(0)
+        assert not await queue.acquire()  # Очередь заполнена - отказ без ожидания
+        assert not await waiter  # Место так и не освободилось
+        
+        queue.release()
+        stats = queue.get_stats()
+        assert stats["in_flight"] == 0
+        assert stats["shed_full"] == 1
+        assert stats["shed_timeout"] == 1
+        assert stats["wait_max_ms"] >= 50
+    
+    @pytest.mark.asyncio
+    async def test_waiters_admitted_in_order(self) -> None:
+        """Тест что освободившееся место получают по порядку прихода."""
+        queue = AdmissionQueue(concurrency=1, max_queue=10, max_wait=1.0)
+        await queue.acquire()
+        order = []
+        
+        async def enter(name):
+            await queue.acquire()
+            order.append(name)
+            queue.release()
+        
+        tasks = [asyncio.create_task(enter(name)) for name in "abc"]
+        await asyncio.sleep(0)
+        queue.release()
+        await asyncio.gather(*tasks)
+        
+        assert order == ["a", "b", "c"]
+        assert queue.get_stats()["admitted"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_middleware_replies_instantly_on_overload(self) -> None:
+        """Тест что сброшенное сообщение получает ответ, а команды очередь не ждут."""
+        queue = AdmissionQueue(concurrency=1, max_queue=0, max_wait=1.0)
+        middleware = AdmissionMiddleware(queue, reply="Занято")
+        handler = AsyncMock(return_value="ok")
+        message = MagicMock(spec=Message)
+        message.from_user = SimpleNamespace(id=1)
+        message.answer = AsyncMock()
+        heavy = {"handler": SimpleNamespace(flags={"admission": True})}
+        command = {"handler": SimpleNamespace(flags={})}
+        
+        await queue.acquire()  # Единственное место занято
+        assert await middleware(handler, message, heavy) is None
+        message.answer.assert_called_once_with("Занято")
+        handler.assert_not_called()
+        
+        assert await middleware(handler, message, command) == "ok"
+        
+        queue.release()
+        assert await middleware(handler, message, heavy) == "ok"
+        assert queue.get_stats()["in_flight"] == 0
+
+
+class TestWebhook:
+    """Тесты для приема обновлений через webhook."""
+    
+    @pytest.mark.asyncio
+    async def test_updates_require_secret(self) -> None:
+        """Тест что обновление с верным секретом доходит до обработчика, без него - 401."""
+        received = asyncio.Queue()
+        dp = Dispatcher()
+        
+        async def handler(message: Message) -> None:
+            await received.put(message.text)
+        
+        dp.message.register(handler)
+        bot = Bot("123456:TEST-token")
+        update = {
+            "update_id": 1,
+            "message": {
+                "message_id": 1, "date": 0, "text": "Привет",
+                "chat": {"id": 1, "type": "private"},
+                "from": {"id": 1, "is_bot": False, "first_name": "Тест"},
+            },
+        }
+        
+        client = TestClient(TestServer(create_webhook_app(dp, bot, "s3cret", path="/hook")))
+        await client.start_server()
+        try:
+            response = await client.post("/hook", json=update, headers={SECRET_HEADER: "wrong"})
+            assert response.status == 401
+            response = await client.post("/hook", json=update)
+            assert response.status == 401
+            
+            response = await client.post("/hook", json=update, headers={SECRET_HEADER: "s3cret"})
+            assert response.status == 200
+            assert await asyncio.wait_for(received.get(), 1) == "Привет"
+            assert received.empty()
+            
+            response = await client.get("/healthz")
+            assert await response.text() == "ok"
+        finally:
+            await client.close()
+    
+    def test_secret_is_mandatory(self) -> None:
+        """Тест что приложение без секрета не создается."""
+        with pytest.raises(ValueError):
+            create_webhook_app(Dispatcher(), Bot("123456:TEST-token"), "")
+
+
+# Воркер для тестов супервизора: считает строки и шлет пульс на каждую
+COUNTING_WORKER = """
+import json, sys
+handled = 0
+print(json.dumps({"handled": 0}), flush=True)
+for line in sys.stdin:
+    handled += 1
+    print(json.dumps({"handled": handled}), flush=True)
+"""
+
+
+def make_update(update_id: int, user_id: int) -> dict:
+    """Сырое обновление Telegram с текстовым сообщением."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": f"Сообщение {update_id}",
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+        },
+    }
+
+
+class TestSharding:
+    """Тесты для распределения пользователей по воркерам."""
+    
+    def test_ring_is_stable_and_balanced(self) -> None:
+        """Тест что пользователь всегда на одном узле, а узлы нагружены ровно."""
+        ring = HashRing(range(4))
+        owners = [ring.node_for(user_id) for user_id in range(10_000)]
+        
+        rebuilt = HashRing(range(4))  # Например, в другом процессе
+        assert owners == [rebuilt.node_for(user_id) for user_id in range(10_000)]
+        for node in range(4):
+            assert 1500 < owners.count(node) < 3500
+    
+    def test_adding_node_moves_only_its_share(self) -> None:
+        """Тест что новый узел забирает пользователей только себе."""
+        ring = HashRing(range(4))
+        before = [ring.node_for(user_id) for user_id in range(10_000)]
+        ring.add(4)
+        after = [ring.node_for(user_id) for user_id in range(10_000)]
+        
+        moved = [(old, new) for old, new in zip(before, after) if old != new]
+        assert all(new == 4 for _, new in moved)
+        assert len(moved) < 10_000 * 0.35
+        
+        ring.remove(4)
+        assert [ring.node_for(user_id) for user_id in range(10_000)] == before
+    
+    def test_update_user_id(self) -> None:
+        """Тест извлечения пользователя из разных типов обновлений."""
+        assert update_user_id(make_update(1, 42)) == 42
+        assert update_user_id({"update_id": 2, "callback_query": {"id": "q", "from": {"id": 7}}}) == 7
+        assert update_user_id({"update_id": 3, "channel_post": {"chat": {"id": -100}}}) == -100
+        assert update_user_id({"update_id": 4}) is None
+
+
+class TestSupervisor:
+    """Тесты для супервизора процессов-воркеров."""
+    
+    async def _wait_handled(self, supervisor: Supervisor, count: int) -> None:
+        """Дождаться обработки count обновлений."""
+        deadline = time.monotonic() + 10
+        while supervisor.get_stats()["handled"] < count:
+            assert time.monotonic() < deadline, supervisor.get_stats()
+            await asyncio.sleep(0.02)
+    
+    @pytest.mark.asyncio
+    async def test_dispatch_by_user_and_restart(self) -> None:
+        """Тест что обновления пользователя идут на его воркер, а упавший воркер перезапускается."""
+        supervisor = Supervisor(workers=2, command=[sys.executable, "-c", COUNTING_WORKER],
+                                heartbeat_timeout=5.0, restart_delay=0.05)
+        await supervisor.start()
+        try:
+            await asyncio.wait_for(supervisor.wait_ready(), 10)
+            users = list(range(1, 21))
+            for update_id in range(100):
+                supervisor.dispatch(make_update(update_id, users[update_id % len(users)]))
+            await self._wait_handled(supervisor, 100)
+            
+            expected = {0: 0, 1: 0}
+            for update_id in range(100):
+                expected[supervisor.worker_for(make_update(update_id, users[update_id % len(users)])).index] += 1
+            assert [worker.handled for worker in supervisor.workers] == [expected[0], expected[1]]
+            
+            supervisor.workers[0].process.kill()
+            await asyncio.sleep(0.1)
+            victim = next(user for user in users if supervisor.worker_for(make_update(0, user)).index == 0)
+            supervisor.dispatch(make_update(100, victim))  # Дождется нового процесса в очереди
+            await asyncio.wait_for(supervisor.wait_ready(), 10)
+            await self._wait_handled(supervisor, 101)
+            
+            stats = supervisor.get_stats()
+            assert stats["restarts"] == 1
+            assert stats["alive"] == 2
+        finally:
+            await supervisor.close()
+        assert not any(worker.alive for worker in supervisor.workers)
+    
+    @pytest.mark.asyncio
+    async def test_silent_worker_restarted(self) -> None:
+        """Тест что воркер без пульса считается зависшим и перезапускается."""
+        supervisor = Supervisor(workers=1, command=[sys.executable, "-c", "import time; time.sleep(60)"],
+                                heartbeat_timeout=0.2, startup_timeout=0.2, restart_delay=0.01)
+        await supervisor.start()
+        try:
+            deadline = time.monotonic() + 10
+            while supervisor.get_stats()["restarts"] < 2:
+                assert time.monotonic() < deadline
+                await asyncio.sleep(0.05)
+        finally:
+            await supervisor.close()
+    
+    @pytest.mark.asyncio
+    async def test_update_worker_feeds_dispatcher(self, capsysbinary) -> None:
+        """Тест что воркер обрабатывает строки stdin диспетчером и сообщает счетчики."""
+        texts = []
+        dp = Dispatcher()
+        
+        async def handler(message: Message) -> None:
+            texts.append(message.text)
+        
+        dp.message.register(handler)
+        reader = asyncio.StreamReader()
+        for update_id in range(3):
+            reader.feed_data(json.dumps(make_update(update_id, 1)).encode() + b"\n")
+        reader.feed_eof()
+        
+        worker = UpdateWorker(dp, Bot("123456:TEST-token"), heartbeat_interval=60)
+        await worker.serve(reader)
+        
+        assert sorted(texts) == ["Сообщение 0", "Сообщение 1", "Сообщение 2"]
+        heartbeats = [json.loads(line) for line in capsysbinary.readouterr().out.splitlines()]
+        assert heartbeats[-1] == {"received": 3, "handled": 3, "in_flight": 0, "failures": 0}
+    
+    @pytest.mark.asyncio
+    async def test_routing_dispatcher_only_forwards(self) -> None:
+        """Тест что диспетчер супервизора отдает обновления воркерам без обработчиков бота."""
+        supervisor = MagicMock()
+        supervisor.dispatch = MagicMock(return_value=True)
+        dp = create_routing_dispatcher(supervisor)
+        
+        await dp.feed_raw_update(Bot("123456:TEST-token"), make_update(1, 42))
+        
+        supervisor.dispatch.assert_called_once()
+        assert supervisor.dispatch.call_args[0][0]["message"]["from"]["id"] == 42
+        assert dp.resolve_used_update_types() == []
+    
+    def test_update_types_match_handlers(self, mock_settings) -> None:
+        """Тест что BotHandlers.UPDATE_TYPES совпадает с типами зарегистрированных обработчиков."""
+        dp = Dispatcher()
+        BotHandlers(MagicMock(), dp)
+        assert sorted(dp.resolve_used_update_types()) == sorted(BotHandlers.UPDATE_TYPES)
+
+
+class TestStreamingReply:
+    """Тесты для потоковой отправки ответов."""
+    
+    @staticmethod
+    async def _chunks(*parts):
+        for part in parts:
+            yield part
+    
+    @pytest.fixture
+    def message(self) -> MagicMock:
+        """Мок входящего сообщения."""
+        message = MagicMock()
+        message.answer = AsyncMock(return_value=MagicMock(message_id=1))
+        message.bot.edit_message_text = AsyncMock()
+        return message
+    
+    @pytest.mark.asyncio
+    async def test_edits_are_throttled(self, message) -> None:
+        """Тест что промежуточные редактирования ограничены интервалом."""
+        from src.bot.streaming import StreamingReply
+        
+        reply = StreamingReply(message, edit_interval=60)
+        text = await reply.consume(self._chunks("a", "b", "c", "d"))
+        
+        assert text == "abcd"
+        message.answer.assert_called_once_with("a")
+        # Только одно финальное редактирование, промежуточные пропущены
+        message.bot.edit_message_text.assert_called_once()
+        assert message.bot.edit_message_text.call_args.kwargs["text"] == "abcd"
+    
+    @pytest.mark.asyncio
+    async def test_edit_each_chunk_without_throttle(self, message) -> None:
+        """Тест редактирования на каждом фрагменте при нулевом интервале."""
+        from src.bot.streaming import StreamingReply
+        
+        await StreamingReply(message, edit_interval=0).consume(self._chunks("a", "b", "c"))
+        
+        assert message.bot.edit_message_text.call_count == 2
+    
+    @pytest.mark.asyncio
+    async def test_long_answer_rolls_over(self, message) -> None:
+        """Тест что слишком длинный ответ продолжается новым сообщением."""
+        from src.bot.streaming import StreamingReply, TELEGRAM_MESSAGE_LIMIT
+        
+        chunk = "x" * 1000
+        parts = [chunk] * 5
+        text = await StreamingReply(message, edit_interval=60).consume(self._chunks(*parts))
+        
+        assert len(text) == 5000
+        assert message.answer.call_count == 2
+        assert message.answer.call_args_list[1][0][0] == "x" * (5000 - TELEGRAM_MESSAGE_LIMIT)
+    
+    @pytest.mark.asyncio
+    async def test_skips_whitespace_only_start(self, message) -> None:
+        """Тест что пустые фрагменты не отправляются в Telegram."""
+        from src.bot.streaming import StreamingReply
+        
+        await StreamingReply(message, edit_interval=60).consume(self._chunks("", " ", "Ответ"))
         
-        # Проверяем логирование очистки  
-        mock_logger.info.assert_any_call("Cleaned 5 old sessions during maintenance")
+        message.answer.assert_called_once_with(" Ответ")
@@ -198,3 +198,31 @@ class TestSettings:
                 assert settings.LLM_TIMEOUT == 0
                 assert settings.LLM_TEMPERATURE == 2.0
                 assert settings.LLM_RETRY_ATTEMPTS == 1
+    
+    def test_webhook_mode_requires_url(self) -> None:
+        """Тест что режим webhook требует публичный адрес и секрет, а неизвестный режим - ошибка."""
+        base_env = {
+            "TELEGRAM_BOT_TOKEN": "test_bot_token",
+            "OPENROUTER_API_KEY": "test_api_key",
+        }
+        
+        with patch("src.config.settings.load_dotenv"):
+            with patch.dict("os.environ", {**base_env, "BOT_MODE": "webhook"}, clear=True):
+                with pytest.raises(ValueError, match="WEBHOOK_URL"):
+                    Settings()
+            
+            with patch.dict("os.environ", {**base_env, "BOT_MODE": "carrier_pigeon"}, clear=True):
+                with pytest.raises(ValueError, match="BOT_MODE"):
+                    Settings()
+            
+            webhook_env = {**base_env, "BOT_MODE": "Webhook", "WEBHOOK_URL": "https://bot.example.com"}
+            with patch.dict("os.environ", webhook_env, clear=True):
+                # Случайный секрет у каждого экземпляра сломал бы остальные за балансировщиком
+                with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+                    Settings()
+            
+            with patch.dict("os.environ", {**webhook_env, "WEBHOOK_SECRET": "shared"}, clear=True):
+                settings = Settings()
+                assert settings.BOT_MODE == "webhook"
+                assert settings.WEBHOOK_PATH == "/telegram/webhook"
+                assert settings.WEBHOOK_PORT == 8080
@@ -0,0 +1,279 @@
+"""Тесты для постоянного хранилища истории."""
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from src.bot.handlers import BotHandlers
+from src.utils.history import HistoryManager
+from src.utils.fake_redis import FakeRedis
+from src.utils.history_store import HistoryStore, RedisHistoryStore, SQLiteHistoryStore
+
+
+class TestHistoryStore:
+    """Тесты для интерфейса хранилища истории."""
+
+    def test_incomplete_store_rejected_on_creation(self) -> None:
+        """Тест что хранилище без обязательного метода нельзя создать."""
+        class NoDeleteStore(HistoryStore):
+            async def load(self, key):
+                return [], None
+
+            def append(self, key, message):
+                pass
+
+            def replace(self, key, messages, summary):
+                pass
+
+        with pytest.raises(TypeError, match="delete"):
+            NoDeleteStore()
+
+
+class TestSQLiteHistoryStore:
+    """Тесты для SQLiteHistoryStore и ленивой загрузки сессий."""
+
+    @pytest.fixture
+    def db_path(self, tmp_path) -> str:
+        """Путь к временной базе."""
+        return str(tmp_path / "history.db")
+
+    async def _open_manager(self, db_path: str, max_messages: int = 20) -> HistoryManager:
+        """Менеджер истории с запущенным SQLite хранилищем."""
+        store = SQLiteHistoryStore(db_path, max_messages=max_messages, flush_interval=0.05, batch_size=100)
+        manager = HistoryManager(max_messages=max_messages, store=store)
+        await manager.start()
+        return manager
+
+    @pytest.mark.asyncio
+    async def test_history_survives_restart(self, db_path: str) -> None:
+        """Тест что история переживает перезапуск и грузится лениво."""
+        manager = await self._open_manager(db_path)
+        manager.add_message("42", "user", "Привет")
+        manager.add_message("42", "assistant", "Ну привет")
+        await manager.close()
+
+        restarted = await self._open_manager(db_path)
+        try:
+            assert restarted.get_session_count() == 0  # Ничего не грузится заранее
+
+            await restarted.ensure_loaded("42")
+
+            assert restarted.get_context_messages("42") == [
+                {"role": "user", "content": "Привет"},
+                {"role": "assistant", "content": "Ну привет"},
+            ]
+            assert restarted.store.get_stats()["loads"] == 1
+
+            await restarted.ensure_loaded("42")  # Второй раз - из памяти
+            assert restarted.store.get_stats()["loads"] == 1
+        finally:
+            await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_writes_are_batched(self, db_path: str) -> None:
+        """Тест что запись идет пачками в фоне, а база хранит последние сообщения."""
+        manager = await self._open_manager(db_path, max_messages=3)
+        for i in range(10):
+            manager.add_message("7", "user", f"Сообщение {i}")
+        assert manager.store.get_stats()["pending"] == 10
+
+        await manager.store.flush()
+        stats = manager.store.get_stats()
+        assert stats["pending"] == 0
+        assert stats["flushes"] == 1
+        await manager.close()
+
+        restarted = await self._open_manager(db_path, max_messages=3)
+        try:
+            stored_messages, _ = await restarted.store.load("7")
+            assert [content for _, content, _, _ in stored_messages] == [
+                "Сообщение 7", "Сообщение 8", "Сообщение 9"
+            ]
+        finally:
+            await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_summary_and_clear_persisted(self, db_path: str) -> None:
+        """Тест сохранения сводки и удаления истории."""
+        manager = await self._open_manager(db_path)
+        for i in range(4):
+            manager.add_message("1", "user", f"Реплика {i}")
+            manager.add_message("2", "user", f"Реплика {i}")
+        batch, _ = manager.get_compaction_batch("1", keep=1)
+        manager.apply_summary("1", batch, "Сводка")
+        manager.clear_user_history("2")
+        await manager.close()
+
+        restarted = await self._open_manager(db_path)
+        try:
+            await restarted.ensure_loaded("1")
+            await restarted.ensure_loaded("2")
+
+            context = restarted.get_context_messages("1")
+            assert context[0]["role"] == "system"
+            assert context[0]["content"].endswith("Сводка")
+            assert [msg["content"] for msg in context[1:]] == ["Реплика 3"]
+            assert restarted.get_user_message_count("2") == 0
+        finally:
+            await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_expired_session_not_loaded(self, db_path: str) -> None:
+        """Тест что сессия, истекшая за время простоя, не восстанавливается."""
+        manager = await self._open_manager(db_path)
+        with patch("src.utils.history.time.time", return_value=time.time() - 7200):
+            manager.add_message("5", "user", "Давно это было")
+        await manager.close()
+
+        restarted = await self._open_manager(db_path)
+        try:
+            await restarted.ensure_loaded("5")
+
+            assert restarted.get_user_message_count("5") == 0
+            await restarted.store.flush()
+            assert await restarted.store.load("5") == ([], None)
+        finally:
+            await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_clear_after_restart(self, db_path: str) -> None:
+        """Тест что /clear после перезапуска удаляет историю из хранилища."""
+        manager = await self._open_manager(db_path)
+        manager.add_message("42", "user", "Привет")
+        manager.add_message("42", "assistant", "Ну привет")
+        await manager.close()
+
+        restarted = await self._open_manager(db_path)
+        message = MagicMock()
+        message.from_user.id = 42
+        message.answer = AsyncMock()
+        try:
+            with patch("src.bot.handlers.history_manager", restarted):
+                await BotHandlers(MagicMock(), MagicMock()).clear_handler(message)
+            assert "очищена" in message.answer.call_args[0][0]
+        finally:
+            await restarted.close()
+
+        reopened = await self._open_manager(db_path)
+        try:
+            await reopened.ensure_loaded("42")
+            assert reopened.get_user_message_count("42") == 0
+        finally:
+            await reopened.close()
+
+
+class TestRedisHistoryStore:
+    """Тесты для RedisHistoryStore на локальном Redis-совместимом сервере."""
+
+    @pytest.fixture
+    async def redis_url(self):
+        """Запущенный FakeRedis."""
+        server = FakeRedis()
+        url = await server.start()
+        yield url
+        await server.close()
+
+    async def _open_manager(self, redis_url: str, max_messages: int = 20) -> HistoryManager:
+        """Менеджер истории (реплика бота) с запущенным Redis хранилищем."""
+        store = RedisHistoryStore(redis_url, max_messages=max_messages, ttl=600, prefix="test")
+        manager = HistoryManager(max_messages=max_messages, store=store)
+        await manager.start()
+        return manager
+
+    @pytest.mark.asyncio
+    async def test_append_pipelined_with_trim_and_ttl(self, redis_url: str) -> None:
+        """Тест что пачка добавлений уходит одной транзакцией с обрезкой и TTL."""
+        manager = await self._open_manager(redis_url, max_messages=3)
+        try:
+            for i in range(10):
+                manager.add_message("7", "user", f"Сообщение {i}")
+            await manager.store.flush()
+
+            assert manager.store.get_stats()["flushes"] == 1
+            stored_messages, summary = await manager.store.load("7")
+            assert [content for _, content, _, _ in stored_messages] == [
+                "Сообщение 7", "Сообщение 8", "Сообщение 9"
+            ]
+            assert summary is None
+            assert 0 < await manager.store._client.ttl("test:7:messages") <= 600
+        finally:
+            await manager.close()
+
+    @pytest.mark.asyncio
+    async def test_replicas_share_sessions(self, redis_url: str) -> None:
+        """Тест что реплики видят изменения друг друга, а горячая сессия не перечитывается."""
+        replica_a = await self._open_manager(redis_url)
+        replica_b = await self._open_manager(redis_url)
+        try:
+            await replica_a.ensure_loaded("42")
+            replica_a.add_message("42", "user", "Привет")
+            replica_a.add_message("42", "assistant", "Ну привет")
+            await replica_a.store.flush()
+
+            await replica_b.ensure_loaded("42")
+            assert replica_b.get_user_message_count("42") == 2
+            replica_b.add_message("42", "user", "Как дела?")
+            await replica_b.store.flush()
+
+            # Своя запись не делает сессию устаревшей
+            await replica_b.ensure_loaded("42")
+            assert replica_b.store.get_stats()["stale"] == 0
+
+            # Реплика A видит сообщение, записанное B
+            await replica_a.ensure_loaded("42")
+            assert [msg["content"] for msg in replica_a.get_context_messages("42")] == [
+                "Привет", "Ну привет", "Как дела?"
+            ]
+            assert replica_a.store.get_stats()["stale"] == 1
+
+            # Очистка на одной реплике видна на другой
+            replica_a.clear_user_history("42")
+            await replica_a.store.flush()
+            await replica_b.ensure_loaded("42")
+            assert replica_b.get_user_message_count("42") == 0
+        finally:
+            await replica_a.close()
+            await replica_b.close()
+
+    @pytest.mark.asyncio
+    async def test_summary_replaces_history(self, redis_url: str) -> None:
+        """Тест сохранения сводки и того, что истечение в памяти не удаляет данные в Redis."""
+        manager = await self._open_manager(redis_url)
+        try:
+            for i in range(4):
+                manager.add_message("1", "user", f"Реплика {i}")
+            batch, _ = manager.get_compaction_batch("1", keep=1)
+            manager.apply_summary("1", batch, "Сводка")
+            await manager.store.flush()
+
+            manager.clear_old_sessions(now=time.monotonic() + 3600 * 2)
+            assert manager.get_session_count() == 0
+
+            await manager.ensure_loaded("1")
+            context = manager.get_context_messages("1")
+            assert context[0]["role"] == "system"
+            assert context[0]["content"].endswith("Сводка")
+            assert [msg["content"] for msg in context[1:]] == ["Реплика 3"]
+        finally:
+            await manager.close()
+
+    @pytest.mark.asyncio
+    async def test_clear_on_replica_without_session(self, redis_url: str) -> None:
+        """Тест что реплика, не загружавшая сессию, все равно очищает ее в Redis."""
+        replica_a = await self._open_manager(redis_url)
+        replica_b = await self._open_manager(redis_url)
+        try:
+            await replica_a.ensure_loaded("42")
+            replica_a.add_message("42", "user", "Привет")
+            replica_a.add_message("42", "assistant", "Ну привет")
+            await replica_a.store.flush()
+
+            replica_b.clear_user_history("42")
+            await replica_b.store.flush()
+
+            assert await replica_b.store.load("42") == ([], None)
+            await replica_a.ensure_loaded("42")
+            assert replica_a.get_user_message_count("42") == 0
+        finally:
+            await replica_a.close()
+            await replica_b.close()
@@ -1,9 +1,11 @@
 """Тесты для LLM клиента."""
 import pytest
 import asyncio
+import json
 import aiohttp
-from unittest.mock import patch, AsyncMock, mock_open
+from unittest.mock import patch, AsyncMock, MagicMock, mock_open
 from src.llm.client import LLMClient
+from src.utils.history import HistoryManager
 
 
 class TestLLMClient:
@@ -17,10 +19,10 @@ class TestLLMClient:
     
     def test_init(self, llm_client: LLMClient, mock_settings) -> None:
         """Тест инициализации клиента."""
-        assert llm_client.api_url == "https://openrouter.ai/api/v1/chat/completions"
-        assert "Authorization" in llm_client.headers
-        assert llm_client.headers["Authorization"].startswith("Bearer ")
-        assert llm_client.headers["Content-Type"] == "application/json"
+        assert llm_client.backend.chat_url == "https://openrouter.ai/api/v1/chat/completions"
+        assert "Authorization" in llm_client.backend.headers
+        assert llm_client.backend.headers["Authorization"].startswith("Bearer ")
+        assert llm_client.backend.headers["Content-Type"] == "application/json"
         assert llm_client.system_prompt is not None
     
     def test_load_system_prompt_success(self, mock_settings) -> None:
@@ -89,6 +91,34 @@ class TestLLMClient:
         assert payload["messages"][-1]["role"] == "user"
         assert payload["messages"][-1]["content"] == user_message
     
+    def test_prepare_payload_token_budget(self, llm_client: LLMClient) -> None:
+        """Тест что длинная история урезается по бюджету токенов, а не по количеству."""
+        long_text = "д" * 4000  # ~2000 токенов по оценке
+        context_messages = [{"role": "user", "content": long_text} for _ in range(5)]
+        context_messages.append({"role": "assistant", "content": "Короткий ответ"})
+        
+        llm_client.budgeter.max_context_tokens = 4000
+        payload = llm_client._prepare_payload("Новое сообщение", context_messages)
+        
+        # system + одно длинное + короткий ответ + user
+        assert len(payload["messages"]) == 4
+        assert payload["messages"][-2]["content"] == "Короткий ответ"
+    
+    def test_prepare_payload_uses_precomputed_tokens(self, llm_client: LLMClient) -> None:
+        """Тест что используются оценки токенов из истории."""
+        from src.utils.history import ContextMessages
+        
+        context_messages = ContextMessages(
+            [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}],
+            token_counts=[10 ** 6, 1],
+        )
+        
+        with patch("src.llm.budget.estimate_tokens") as mock_estimate:
+            payload = llm_client._prepare_payload("Новое сообщение", context_messages)
+        
+        mock_estimate.assert_not_called()
+        assert [m["content"] for m in payload["messages"][1:]] == ["b", "Новое сообщение"]
+    
     def test_get_max_context_messages(self, llm_client: LLMClient) -> None:
         """Тест получения максимального количества контекстных сообщений."""
         max_messages = llm_client._get_max_context_messages()
@@ -99,16 +129,14 @@ class TestLLMClient:
         """Тест успешного HTTP запроса."""
         payload = {"test": "payload"}
         
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("src.llm.backend.http_transport") as mock_transport:
             mock_response = AsyncMock()
             mock_response.status = 200
-            mock_response.json = AsyncMock(return_value=mock_openrouter_response)
+            mock_response.read = AsyncMock(return_value=json.dumps(mock_openrouter_response).encode("utf-8"))
             
-            # Настраиваем async context manager
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=mock_session.return_value)
-            mock_session.return_value.__aexit__ = AsyncMock(return_value=None)
-            mock_session.return_value.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
-            mock_session.return_value.post.return_value.__aexit__ = AsyncMock(return_value=None)
+            # Настраиваем async context manager общего транспорта
+            mock_transport.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_transport.post.return_value.__aexit__ = AsyncMock(return_value=None)
             
             result = await llm_client._make_request(payload)
         
@@ -119,16 +147,15 @@ class TestLLMClient:
         """Тест обработки ошибки rate limit."""
         payload = {"test": "payload"}
         
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("src.llm.backend.http_transport") as mock_transport:
             mock_response = AsyncMock()
             mock_response.status = 429
+            mock_response.headers = {}
             mock_response.text = AsyncMock(return_value="Rate limit exceeded")
             
-            # Настраиваем async context manager
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=mock_session.return_value)
-            mock_session.return_value.__aexit__ = AsyncMock(return_value=None)
-            mock_session.return_value.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
-            mock_session.return_value.post.return_value.__aexit__ = AsyncMock(return_value=None)
+            # Настраиваем async context manager общего транспорта
+            mock_transport.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_transport.post.return_value.__aexit__ = AsyncMock(return_value=None)
             
             with pytest.raises(Exception, match="Rate limit exceeded"):
                 await llm_client._make_request(payload)
@@ -138,16 +165,15 @@ class TestLLMClient:
         """Тест обработки ошибки авторизации."""
         payload = {"test": "payload"}
         
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("src.llm.backend.http_transport") as mock_transport:
             mock_response = AsyncMock()
             mock_response.status = 401
+            mock_response.headers = {}
             mock_response.text = AsyncMock(return_value="Invalid API key")
             
-            # Настраиваем async context manager
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=mock_session.return_value)
-            mock_session.return_value.__aexit__ = AsyncMock(return_value=None)
-            mock_session.return_value.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
-            mock_session.return_value.post.return_value.__aexit__ = AsyncMock(return_value=None)
+            # Настраиваем async context manager общего транспорта
+            mock_transport.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_transport.post.return_value.__aexit__ = AsyncMock(return_value=None)
             
             with pytest.raises(Exception, match="Invalid API key"):
                 await llm_client._make_request(payload)
@@ -157,16 +183,15 @@ class TestLLMClient:
         """Тест обработки серверной ошибки."""
         payload = {"test": "payload"}
         
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("src.llm.backend.http_transport") as mock_transport:
             mock_response = AsyncMock()
             mock_response.status = 500
+            mock_response.headers = {}
             mock_response.text = AsyncMock(return_value="Internal Server Error")
             
-            # Настраиваем async context manager
-            mock_session.return_value.__aenter__ = AsyncMock(return_value=mock_session.return_value)
-            mock_session.return_value.__aexit__ = AsyncMock(return_value=None)
-            mock_session.return_value.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
-            mock_session.return_value.post.return_value.__aexit__ = AsyncMock(return_value=None)
+            # Настраиваем async context manager общего транспорта
+            mock_transport.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_transport.post.return_value.__aexit__ = AsyncMock(return_value=None)
             
             with pytest.raises(Exception, match="API error 500"):
                 await llm_client._make_request(payload)
@@ -303,3 +328,881 @@ class TestLLMClient:
             assert mock_request.call_count == 3
             mock_logger.log_llm_error.assert_called()
             mock_logger.error.assert_called()
+    
+    @pytest.mark.asyncio
+    async def test_stream_message_yields_deltas(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест потоковой отправки сообщения."""
+        async def fake_stream(payload, timings=None):
+            assert payload["stream"] is True
+            for delta in ["Саркастический", " ответ"]:
+                yield delta
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(llm_client, "_stream_request", side_effect=fake_stream):
+            chunks = [chunk async for chunk in llm_client.stream_message("Привет", None, "test_user")]
+        
+        assert chunks == ["Саркастический", " ответ"]
+        mock_logger.log_llm_request.assert_called_once()
+    
+    @pytest.mark.asyncio
+    async def test_stream_message_fallback(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест fallback ответа когда поток так и не начался."""
+        async def failing_stream(payload, timings=None):
+            raise Exception("Rate limit exceeded")
+            yield  # pragma: no cover
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch("src.llm.client.asyncio.sleep", AsyncMock()), \
+             patch.object(llm_client, "_stream_request", side_effect=failing_stream) as mock_stream:
+            chunks = [chunk async for chunk in llm_client.stream_message("Привет", None, "test_user")]
+        
+        assert len(chunks) == 1
+        assert any(word in chunks[0].lower() for word in ["лимит", "превыс", "много"])
+        assert mock_stream.call_count == 3
+    
+    @pytest.mark.asyncio
+    async def test_stream_message_no_retry_after_partial_output(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест что поток не повторяется, если часть ответа уже отдана."""
+        from src.llm.streaming import FallbackText
+        
+        async def broken_stream(payload, timings=None):
+            yield "Начало"
+            raise Exception("Connection reset")
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(llm_client, "_stream_request", side_effect=broken_stream) as mock_stream:
+            chunks = [chunk async for chunk in llm_client.stream_message("Привет", None, "test_user")]
+        
+        # Оборванный ответ не выглядит полным: в конце пометка об ошибке
+        assert chunks[0] == "Начало"
+        assert len(chunks) == 2
+        assert isinstance(chunks[1], FallbackText)
+        assert "оборвался" in chunks[1]
+        assert mock_stream.call_count == 1
+        mock_logger.log_llm_error.assert_called_once()
+        mock_logger.error.assert_called_once()
+
+
+class TestSSEParsing:
+    """Тесты разбора SSE потока OpenRouter."""
+    
+    @pytest.mark.asyncio
+    async def test_iter_sse_deltas(self) -> None:
+        """Тест разбора событий, комментариев и маркера [DONE]."""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from src.llm.streaming import iter_sse_deltas
+        from src.llm.transport import HttpTransport
+        
+        async def sse_handler(request: web.Request) -> web.StreamResponse:
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            await response.write(b": OPENROUTER PROCESSING\n\n")
+            for text in ["Раз", "", " два"]:
+                event = '{"choices": [{"delta": {"content": "%s"}}]}' % text
+                await response.write(f"data: {event}\n\n".encode("utf-8"))
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        
+        app = web.Application()
+        app.router.add_post("/stream", sse_handler)
+        server = TestServer(app)
+        await server.start_server()
+        transport = HttpTransport()
+        try:
+            async with transport.post(str(server.make_url("/stream")), json={}) as response:
+                deltas = [delta async for delta in iter_sse_deltas(response)]
+        finally:
+            await transport.close()
+            await server.close()
+        
+        assert deltas == ["Раз", " два"]
+
+
+class TestResponseCache:
+    """Тесты для кэша ответов LLM."""
+    
+    @pytest.fixture
+    def cache(self):
+        """Фикстура кэша с небольшим бюджетом."""
+        from src.llm.cache import ResponseCache
+        return ResponseCache(max_bytes=2000, ttl=60)
+    
+    def test_make_key_normalizes_whitespace(self, cache) -> None:
+        """Тест что ключ не зависит от лишних пробелов."""
+        context = [{"role": "user", "content": "Привет  мир"}]
+        key1 = cache.make_key("m", 0.8, "sys", context, "Как дела? ")
+        key2 = cache.make_key("m", 0.8, "sys", [{"role": "user", "content": " Привет мир"}], "Как  дела?")
+        assert key1 == key2
+    
+    def test_make_key_depends_on_model_and_temperature(self, cache) -> None:
+        """Тест что разные параметры модели дают разные ключи."""
+        assert cache.make_key("m1", 0.8, "sys", None, "x") != cache.make_key("m2", 0.8, "sys", None, "x")
+        assert cache.make_key("m", 0.8, "sys", None, "x") != cache.make_key("m", 0.5, "sys", None, "x")
+    
+    def test_put_and_get(self, cache) -> None:
+        """Тест сохранения и чтения из кэша."""
+        cache.put("key", "value")
+        assert cache.lookup("key") == "value"
+        assert cache.lookup("missing") is None
+        assert cache.get_stats()["hits"] == 1
+        assert cache.get_stats()["misses"] == 1
+    
+    def test_ttl_expiry(self, cache) -> None:
+        """Тест что просроченные записи не возвращаются."""
+        cache.put("key", "value")
+        with patch("src.llm.cache.time.monotonic", return_value=10 ** 9):
+            assert cache.get("key") is None
+        assert cache.total_bytes == 0
+    
+    def test_memory_budget_evicts_lru(self, cache) -> None:
+        """Тест вытеснения давно неиспользованных записей по бюджету памяти."""
+        for i in range(5):
+            cache.put(f"key{i}", "x" * 300)
+            cache.get("key0")  # key0 остается самой свежей
+        
+        assert cache.total_bytes <= cache.max_bytes
+        assert cache.get("key0") is not None
+        assert cache.get("key1") is None
+        assert cache.evictions > 0
+    
+    @pytest.mark.asyncio
+    async def test_single_flight(self, cache) -> None:
+        """Тест что одновременные одинаковые запросы разделяют один вызов."""
+        calls = 0
+        
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "ответ", True
+        
+        results = await asyncio.gather(*[cache.get_or_compute("key", compute) for _ in range(5)])
+        
+        assert results == ["ответ"] * 5
+        assert calls == 1
+        stats = cache.get_stats()
+        assert stats["misses"] == 1
+        assert stats["coalesced"] == 4
+        
+        # Повторный запрос - попадание в кэш
+        assert await cache.get_or_compute("key", compute) == "ответ"
+        assert cache.get_stats()["hits"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_fallback_not_cached(self, cache) -> None:
+        """Тест что некэшируемый результат не сохраняется."""
+        async def compute():
+            return "fallback", False
+        
+        assert await cache.get_or_compute("key", compute) == "fallback"
+        assert cache.get("key") is None
+    
+    @pytest.mark.asyncio
+    async def test_error_propagates_to_waiters(self, cache) -> None:
+        """Тест что ошибка вычисления передается всем ожидающим."""
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("boom")
+        
+        results = await asyncio.gather(
+            cache.get_or_compute("key", compute),
+            cache.get_or_compute("key", compute),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert "key" not in cache._inflight
+    
+    @pytest.mark.asyncio
+    async def test_send_message_uses_cache(self, mock_settings, mock_logger) -> None:
+        """Тест что повторное сообщение без истории берется из кэша."""
+        with patch("builtins.open", mock_open(read_data="Промпт")):
+            client = LLMClient()
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(client, "_make_request", AsyncMock(return_value="Ответ")) as mock_request:
+            first = await client.send_message("Привет", [], "user1")
+            second = await client.send_message(" Привет ", [], "user2")
+        
+        assert first == second == "Ответ"
+        assert mock_request.call_count == 1
+        assert client.response_cache.get_stats()["hits"] == 1
+
+
+class TestResilience:
+    """Тесты для circuit breaker, Retry-After и бюджета повторов."""
+    
+    @pytest.fixture
+    def llm_client(self, mock_settings) -> LLMClient:
+        """Фикстура LLM клиента без кэша ответов."""
+        with patch("builtins.open", mock_open(read_data="Промпт")):
+            client = LLMClient()
+        client.response_cache.max_bytes = 0  # Ничего не кэшируем
+        return client
+    
+    def test_parse_retry_after(self) -> None:
+        """Тест разбора заголовка Retry-After."""
+        from src.llm.resilience import parse_retry_after
+        
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after("-1") == 0.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("не число") is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    
+    def test_compute_backoff_is_jittered_and_capped(self) -> None:
+        """Тест что задержка лежит в пределах экспоненты и потолка."""
+        from src.llm.resilience import compute_backoff
+        
+        delays = [compute_backoff(10, base_delay=1.0, max_delay=5.0) for _ in range(50)]
+        assert all(0 <= delay <= 5.0 for delay in delays)
+        assert len(set(delays)) > 1
+    
+    def test_breaker_opens_after_threshold(self) -> None:
+        """Тест размыкания цепи после серии ошибок."""
+        from src.llm.resilience import CircuitBreaker
+        
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+        for _ in range(3):
+            assert breaker.allow_request()
+            breaker.record_failure("server_error")
+        
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.allow_request() is False
+        assert breaker.get_stats()["rejected"] == 1
+    
+    def test_breaker_half_open_probe(self) -> None:
+        """Тест пробного запроса после паузы восстановления."""
+        from src.llm.resilience import CircuitBreaker
+        
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=30)
+        with patch("src.llm.resilience.time.monotonic", return_value=100.0):
+            breaker.record_failure("timeout")
+        
+        with patch("src.llm.resilience.time.monotonic", return_value=131.0):
+            assert breaker.allow_request() is True  # пробник
+            assert breaker.allow_request() is False  # второй запрос ждет
+            assert breaker.state == CircuitBreaker.HALF_OPEN
+            
+            breaker.record_failure("timeout")
+            assert breaker.state == CircuitBreaker.OPEN
+        
+        with patch("src.llm.resilience.time.monotonic", return_value=162.0):
+            assert breaker.allow_request() is True
+            breaker.record_success()
+            assert breaker.state == CircuitBreaker.CLOSED
+            assert breaker.allow_request() is True
+    
+    def test_breaker_respects_retry_after(self) -> None:
+        """Тест что Retry-After продлевает размыкание."""
+        from src.llm.resilience import CircuitBreaker
+        
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=5)
+        with patch("src.llm.resilience.time.monotonic", return_value=0.0):
+            breaker.record_failure("rate_limit", retry_after=60)
+        with patch("src.llm.resilience.time.monotonic", return_value=30.0):
+            assert breaker.allow_request() is False
+        with patch("src.llm.resilience.time.monotonic", return_value=61.0):
+            assert breaker.allow_request() is True
+    
+    def test_retry_budget_exhaustion(self) -> None:
+        """Тест что бюджет повторов ограничивает количество повторов."""
+        from src.llm.resilience import RetryBudget
+        
+        budget = RetryBudget(ratio=0.5, min_per_second=0, max_tokens=2)
+        assert budget.try_acquire()
+        assert budget.try_acquire()
+        assert budget.try_acquire() is False
+        assert budget.exhausted == 1
+        
+        budget.record_request()
+        budget.record_request()
+        assert budget.try_acquire()
+    
+    @pytest.mark.asyncio
+    async def test_open_circuit_returns_fallback_immediately(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест мгновенного fallback при разомкнутой цепи."""
+        from src.llm.resilience import CircuitBreaker
+        
+        breaker = llm_client._get_breaker(llm_client._prepare_payload("x")["model"])
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure("rate_limit")
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(llm_client, "_make_request", AsyncMock()) as mock_request:
+            result = await llm_client.send_message("Привет", None, "user")
+        
+        mock_request.assert_not_called()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert any(word in result.lower() for word in ["лимит", "превыс", "много"])
+    
+    @pytest.mark.asyncio
+    async def test_retry_after_is_honored(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест что задержка повтора берется из Retry-After."""
+        from src.llm.resilience import LLMRequestError
+        
+        mock_sleep = AsyncMock()
+        with patch("src.llm.client.logger", mock_logger), \
+             patch("src.llm.client.asyncio.sleep", mock_sleep), \
+             patch.object(llm_client, "_make_request", AsyncMock(side_effect=[
+                 LLMRequestError("Rate limit exceeded", 429, retry_after=0.5),
+                 "Ответ",
+             ])):
+            result = await llm_client.send_message("Привет", None, "user")
+        
+        assert result == "Ответ"
+        mock_sleep.assert_called_once_with(0.5)
+    
+    @pytest.mark.asyncio
+    async def test_long_retry_after_skips_retry(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест что слишком долгий Retry-After сразу дает fallback."""
+        from src.llm.resilience import LLMRequestError
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(llm_client, "_make_request", AsyncMock(
+                 side_effect=LLMRequestError("Rate limit exceeded", 429, retry_after=3600)
+             )) as mock_request:
+            await llm_client.send_message("Привет", None, "user")
+        
+        assert mock_request.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_auth_error_not_retried(self, llm_client: LLMClient, mock_logger) -> None:
+        """Тест что ошибка авторизации не повторяется."""
+        from src.llm.resilience import LLMRequestError
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(llm_client, "_make_request", AsyncMock(
+                 side_effect=LLMRequestError("Invalid API key", 401)
+             )) as mock_request:
+            await llm_client.send_message("Привет", None, "user")
+        
+        assert mock_request.call_count == 1
+    
+    @pytest.mark.asyncio
+    async def test_make_request_parses_retry_after(self, llm_client: LLMClient) -> None:
+        """Тест что Retry-After из ответа попадает в исключение."""
+        from src.llm.resilience import LLMRequestError
+        
+        with patch("src.llm.backend.http_transport") as mock_transport:
+            mock_response = AsyncMock()
+            mock_response.status = 429
+            mock_response.headers = {"Retry-After": "7"}
+            mock_transport.post.return_value.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_transport.post.return_value.__aexit__ = AsyncMock(return_value=None)
+            
+            with pytest.raises(LLMRequestError) as exc_info:
+                await llm_client._make_request({"model": "m"})
+        
+        assert exc_info.value.status == 429
+        assert exc_info.value.retry_after == 7.0
+
+
+class TestAdaptiveLimiter:
+    """Тесты для адаптивного лимита параллелизма."""
+    
+    @pytest.fixture
+    def limiter(self):
+        """Фикстура лимитера с маленькими границами."""
+        from src.llm.limiter import AdaptiveLimiter
+        return AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=4, max_queue=2, max_wait=0.5)
+    
+    @pytest.mark.asyncio
+    async def test_excess_requests_wait_in_queue(self, limiter) -> None:
+        """Тест что запросы сверх лимита ждут освобождения слота."""
+        release = asyncio.Event()
+        max_in_flight = 0
+        
+        async def worker():
+            nonlocal max_in_flight
+            async with limiter.slot():
+                max_in_flight = max(max_in_flight, limiter.in_flight)
+                await release.wait()
+        
+        tasks = [asyncio.create_task(worker()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        assert limiter.get_stats()["queue_depth"] == 2
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        
+        assert max_in_flight == 2
+        stats = limiter.get_stats()
+        assert stats["in_flight"] == 0
+        assert stats["queue_depth"] == 0
+        assert stats["wait_max_ms"] > 0
+    
+    @pytest.mark.asyncio
+    async def test_queue_overflow_rejected(self, limiter) -> None:
+        """Тест отказа при переполненной очереди."""
+        from src.llm.limiter import ConcurrencyLimitExceeded
+        
+        release = asyncio.Event()
+        
+        async def worker():
+            async with limiter.slot():
+                await release.wait()
+        
+        tasks = [asyncio.create_task(worker()) for _ in range(4)]
+        await asyncio.sleep(0.01)
+        
+        with pytest.raises(ConcurrencyLimitExceeded):
+            async with limiter.slot():
+                pass
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.get_stats()["rejected"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_queue_wait_timeout(self, limiter) -> None:
+        """Тест ограничения времени ожидания в очереди."""
+        from src.llm.limiter import ConcurrencyLimitExceeded
+        
+        limiter.max_wait = 0.01
+        release = asyncio.Event()
+        
+        async def worker():
+            async with limiter.slot():
+                await release.wait()
+        
+        tasks = [asyncio.create_task(worker()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        
+        with pytest.raises(ConcurrencyLimitExceeded):
+            async with limiter.slot():
+                pass
+        
+        assert limiter.get_stats()["queue_depth"] == 0
+        release.set()
+        await asyncio.gather(*tasks)
+        assert limiter.get_stats()["timeouts"] == 1
+        assert limiter.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_limit_grows_while_latency_flat(self, limiter) -> None:
+        """Тест аддитивного роста лимита при стабильной задержке."""
+        for _ in range(10):
+            await limiter.acquire()
+            limiter.release(0.1, None)
+        
+        assert limiter.get_stats()["limit"] == 4
+    
+    @pytest.mark.asyncio
+    async def test_limit_holds_when_latency_rises(self, limiter) -> None:
+        """Тест что лимит не растет при росте задержки."""
+        await limiter.acquire()
+        limiter.release(0.1, None)
+        limit_before = limiter.limit
+        
+        for _ in range(5):
+            await limiter.acquire()
+            limiter.release(5.0, None)
+        
+        assert limiter.limit == limit_before
+    
+    @pytest.mark.asyncio
+    async def test_limit_cut_on_rate_limit(self, limiter) -> None:
+        """Тест мультипликативного уменьшения лимита на 429 и таймаутах."""
+        from src.llm.resilience import LLMRequestError
+        
+        limiter.limit = 4.0
+        await limiter.acquire()
+        limiter.release(0.1, LLMRequestError("Rate limit exceeded", 429))
+        assert limiter.get_stats()["limit"] == 2
+        
+        # Повторная ошибка в том же окне не режет лимит еще раз
+        await limiter.acquire()
+        limiter.release(0.1, asyncio.TimeoutError())
+        assert limiter.get_stats()["limit"] == 2
+        
+        # Прочие ошибки лимит не меняют
+        await limiter.acquire()
+        limiter.release(0.1, Exception("API error 400"))
+        assert limiter.get_stats()["limit"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_send_message_sheds_on_full_queue(self, mock_settings, mock_logger) -> None:
+        """Тест fallback ответа, когда очередь к LLM переполнена."""
+        from src.llm.limiter import ConcurrencyLimitExceeded
+        
+        with patch("builtins.open", mock_open(read_data="Промпт")):
+            client = LLMClient()
+        
+        with patch("src.llm.client.logger", mock_logger), \
+             patch.object(client.limiter, "acquire", AsyncMock(side_effect=ConcurrencyLimitExceeded("full"))), \
+             patch.object(client, "_make_request", AsyncMock()) as mock_request:
+            result = await client.send_message("Привет", None, "user")
+        
+        mock_request.assert_not_called()
+        assert any(word in result.lower() for word in ["лимит", "превыс", "много"])
+    
+    @pytest.mark.asyncio
+    async def test_background_waits_behind_user_requests(self, limiter) -> None:
+        """Тест что фоновый запрос пропускает вперед запросы пользователей."""
+        release = asyncio.Event()
+        order = []
+    
+        async def worker(name, background=False):
+            async with limiter.slot(background=background):
+                order.append(name)
+                await release.wait()
+        
+        busy = [asyncio.create_task(worker(f"busy{i}")) for i in range(2)]
+        await asyncio.sleep(0.01)
+        background = asyncio.create_task(worker("summary", background=True))
+        await asyncio.sleep(0.01)
+        user = asyncio.create_task(worker("user"))
+        await asyncio.sleep(0.01)
+        
+        stats = limiter.get_stats()
+        assert stats["queue_depth"] == 1
+        assert stats["background_depth"] == 1
+        
+        release.set()
+        await asyncio.gather(*busy, background, user)
+        assert order == ["busy0", "busy1", "user", "summary"]
+        assert limiter.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_complete_uses_background_slot(self, mock_settings) -> None:
+        """Тест что фоновый запрос сводки занимает слот лимитера."""
+        with patch("builtins.open", mock_open(read_data="Промпт")):
+            client = LLMClient()
+        
+        in_flight = []
+    
+        async def make_request(payload):
+            in_flight.append(client.limiter.in_flight)
+            return "Сводка"
+        
+        with patch.object(client.limiter, "slot", wraps=client.limiter.slot) as mock_slot, \
+             patch.object(client, "_make_request", side_effect=make_request):
+            result = await client.complete([{"role": "user", "content": "текст"}], "cheap/model", 100)
+        
+        assert result == "Сводка"
+        mock_slot.assert_called_once_with(background=True)
+        assert in_flight == [1]
+        assert client.limiter.in_flight == 0
+
+
+class TestPayloadEncoder:
+    """Тесты для кодирования payload с кэшированным префиксом."""
+    
+    @pytest.fixture
+    def llm_client(self, mock_settings) -> LLMClient:
+        """Фикстура LLM клиента."""
+        with patch("builtins.open", mock_open(read_data="Системный промпт с \"кавычками\"")):
+            return LLMClient()
+    
+    def test_encoded_payload_matches_json(self, llm_client: LLMClient) -> None:
+        """Тест что закодированный payload совпадает с обычной сериализацией."""
+        import json
+        
+        context = [{"role": "user", "content": "Привет"}, {"role": "assistant", "content": "Ну здравствуй"}]
+        payload = llm_client._prepare_payload("Как дела?", context)
+        
+        encoded = llm_client.payload_encoder.encode(payload)
+        
+        assert json.loads(encoded) == payload
+        assert "Привет".encode("utf-8") in encoded  # Без \uXXXX экранирования
+    
+    def test_prefix_is_cached(self, llm_client: LLMClient) -> None:
+        """Тест что префикс кодируется один раз на набор параметров."""
+        import json
+        
+        encoder = llm_client.payload_encoder
+        with patch.object(encoder, "_build_prefix", wraps=encoder._build_prefix) as mock_build:
+            for text in ["раз", "два", "три"]:
+                encoder.encode(llm_client._prepare_payload(text))
+            stream_payload = llm_client._prepare_payload("поток")
+            stream_payload["stream"] = True
+            assert json.loads(encoder.encode(stream_payload)) == stream_payload
+        
+        assert mock_build.call_count == 2  # обычный и потоковый запрос
+    
+    def test_history_view_reuses_encoded_json(self, llm_client: LLMClient) -> None:
+        """Тест что история из снимка не сериализуется заново и дает те же байты."""
+        history = HistoryManager()
+        for i in range(6):
+            history.add_message("1", "user" if i % 2 == 0 else "assistant", f"Реплика \"{i}\"")
+        view = history.get_context_messages("1")
+        
+        payload = llm_client._prepare_payload("Как дела?", view)
+        view.encoded()  # Фрагменты кодируются один раз при первом запросе
+        with patch("src.utils.history._encode_wire") as mock_encode:
+            encoded = llm_client.payload_encoder.encode(payload)
+        
+        mock_encode.assert_not_called()
+        plain_payload = dict(payload, messages=list(payload["messages"]))
+        assert encoded == llm_client.payload_encoder.encode(plain_payload)
+        assert payload["messages"].context is view
+    
+    def test_foreign_payload_encoded_fully(self, llm_client: LLMClient) -> None:
+        """Тест что payload с другим системным сообщением кодируется целиком."""
+        import json
+        
+        payload = {"model": "m", "messages": [{"role": "system", "content": "другой"}]}
+        assert json.loads(llm_client.payload_encoder.encode(payload)) == payload
+    
+    def test_prompt_caching_marker(self) -> None:
+        """Тест маркера кэширования промпта у провайдера."""
+        from src.llm.payload import build_system_message
+        
+        plain = build_system_message("Промпт")
+        assert plain == {"role": "system", "content": "Промпт"}
+        
+        cached = build_system_message("Промпт", prompt_caching=True)
+        assert cached["content"][0]["text"] == "Промпт"
+        assert cached["content"][0]["cache_control"] == {"type": "ephemeral"}
+
+
+class TestHistorySummarizer:
+    """Тесты для фонового сжатия истории."""
+    
+    @pytest.fixture
+    def history(self):
+        """Фикстура истории с длинным диалогом."""
+        from src.utils.history import HistoryManager
+        
+        history = HistoryManager()
+        for i in range(8):
+            history.add_message("user_1", "user" if i % 2 == 0 else "assistant", f"Реплика {i}")
+        return history
+    
+    @pytest.fixture
+    def client(self):
+        """Фикстура LLM клиента с мок-запросом сводки."""
+        client = MagicMock()
+        client.complete = AsyncMock(return_value="Сводка разговора")
+        return client
+    
+    @pytest.mark.asyncio
+    async def test_compact_applies_summary(self, history, client) -> None:
+        """Тест сжатия ранней части диалога."""
+        from src.llm.summarizer import HistorySummarizer
+        
+        summarizer = HistorySummarizer(history, client, model="cheap/model", trigger=8, keep=3, max_tokens=100)
+        
+        assert await summarizer.compact("user_1") is True
+        
+        messages, model, max_tokens = client.complete.call_args.args
+        assert model == "cheap/model"
+        assert max_tokens == 100
+        assert "Пользователь: Реплика 0" in messages[1]["content"]
+        assert "Реплика 5" not in messages[1]["content"]
+        
+        context = history.get_context_messages("user_1")
+        assert context[0]["role"] == "system"
+        assert "Сводка разговора" in context[0]["content"]
+        assert [msg["content"] for msg in context[1:]] == ["Реплика 5", "Реплика 6", "Реплика 7"]
+        assert summarizer.get_stats()["compacted_messages"] == 5
+    
+    @pytest.mark.asyncio
+    async def test_schedule_runs_in_background(self, history, client) -> None:
+        """Тест постановки в очередь и работы фонового обработчика."""
+        from src.llm.summarizer import HistorySummarizer
+        
+        summarizer = HistorySummarizer(history, client, model="cheap/model", trigger=8, keep=2, max_tokens=100)
+        
+        # Без запущенного обработчика ничего не ставится
+        assert summarizer.schedule("user_1") is False
+        
+        await summarizer.start()
+        try:
+            assert summarizer.schedule("short_user") is False
+            assert summarizer.schedule("user_1") is True
+            assert summarizer.schedule("user_1") is False  # уже в очереди
+            
+            await asyncio.wait_for(summarizer._queue.join(), timeout=1)
+        finally:
+            await summarizer.close()
+        
+        assert history.get_user_message_count("user_1") == 2
+        assert summarizer.get_stats()["compactions"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_failure_keeps_history(self, history, client) -> None:
+        """Тест что ошибка сводки не трогает историю."""
+        from src.llm.summarizer import HistorySummarizer
+        
+        client.complete.side_effect = Exception("Rate limit exceeded")
+        summarizer = HistorySummarizer(history, client, model="cheap/model", trigger=8, keep=2, max_tokens=100)
+        
+        await summarizer.start()
+        try:
+            summarizer.schedule("user_1")
+            await asyncio.wait_for(summarizer._queue.join(), timeout=1)
+        finally:
+            await summarizer.close()
+        
+        assert history.get_user_message_count("user_1") == 8
+        assert summarizer.get_stats()["failures"] == 1
+
+
+class TestFakeOpenRouter:
+    """Тесты LLM клиента против локального имитатора OpenRouter."""
+    
+    @pytest.fixture
+    async def fake_server(self):
+        """Запущенный имитатор с быстрыми ответами."""
+        from src.llm.fake_openrouter import FakeOpenRouter, FakeOpenRouterConfig
+        
+        server = FakeOpenRouter(FakeOpenRouterConfig(latency=0.01, chunk_delay=0, retry_after=0.01), seed=1)
+        await server.start()
+        yield server
+        await server.close()
+    
+    @pytest.fixture
+    async def client(self, fake_server):
+        """LLM клиент, направленный на имитатор."""
+        from src.llm.backend import LLMBackend
+        from src.llm.transport import HttpTransport
+        
+        transport = HttpTransport()
+        with patch("builtins.open", mock_open(read_data="Системный промпт")):
+            client = LLMClient(LLMBackend(fake_server.base_url, "fake-key", transport))
+        yield client
+        await transport.close()
+    
+    @pytest.mark.asyncio
+    async def test_send_message(self, fake_server, client: LLMClient) -> None:
+        """Тест обычного запроса через бэкенд."""
+        response = await client.send_message("Привет", [], "user_1")
+        
+        assert response == fake_server.config.reply
+        assert fake_server.get_stats()["requests"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_stream_message(self, fake_server, client: LLMClient) -> None:
+        """Тест SSE потока от имитатора."""
+        parts = [part async for part in client.stream_message("Привет поток", [], "user_1")]
+        
+        assert len(parts) > 1
+        assert "".join(parts) == fake_server.config.reply
+        assert fake_server.get_stats()["streamed"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_rate_limited_falls_back(self, fake_server, client: LLMClient) -> None:
+        """Тест что постоянные 429 дают fallback ответ после повторов."""
+        fake_server.config.rate_limit_rate = 1.0
+        
+        response = await client.send_message("Привет", [], "user_1")
+        
+        assert response != fake_server.config.reply
+        assert fake_server.get_stats()["rate_limited"] >= 1
+        assert client.breakers["test/model"].last_error_type == "rate_limit"
+    
+    @pytest.mark.asyncio
+    async def test_max_concurrency_returns_429(self, fake_server) -> None:
+        """Тест лимита одновременных запросов имитатора."""
+        fake_server.config.max_concurrency = 1
+        fake_server.config.latency = 0.2
+        fake_server.config.latency_sigma = 0
+        
+        async with aiohttp.ClientSession() as session:
+            async def post() -> int:
+                async with session.post(
+                    f"{fake_server.base_url}/chat/completions",
+                    json={"model": "m", "messages": []},
+                    headers={"Authorization": "Bearer fake"},
+                ) as response:
+                    return response.status
+            
+            statuses = await asyncio.gather(post(), post(), post())
+        
+        assert sorted(statuses) == [200, 429, 429]
+        assert fake_server.get_stats()["rate_limited"] == 2
+
+
+class TestLatencyTimings:
+    """Тесты для пофазных задержек."""
+    
+    def test_histogram_percentiles(self) -> None:
+        """Тест оценки перцентилей по корзинам."""
+        from src.llm.timings import Histogram
+        
+        histogram = Histogram()
+        for _ in range(90):
+            histogram.observe(0.02)
+        for _ in range(10):
+            histogram.observe(0.7)
+        
+        snapshot = histogram.snapshot()
+        assert snapshot["count"] == 100
+        assert snapshot["p50_ms"] == 25
+        assert snapshot["p95_ms"] == 700
+        assert snapshot["max_ms"] == 700
+    
+    def test_recorder_groups_by_model_and_outcome(self) -> None:
+        """Тест группировки по модели, исходу и фазе."""
+        from src.llm.timings import LatencyRecorder, RequestTimings
+        
+        recorder = LatencyRecorder()
+        timings = RequestTimings()
+        timings.add("ttfb", 0.1)
+        timings.add("backoff", 0.5)
+        timings.add("backoff", 0.5)
+        recorder.record("m", "ok", timings)
+        recorder.observe("m", "rate_limit", "total", 2.0)
+        
+        stats = recorder.get_stats()
+        assert set(stats) == {"m|ok", "m|rate_limit"}
+        assert stats["m|ok"]["backoff"]["max_ms"] == 1000
+        assert recorder.get_phase("m", "timeout", "total")["count"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_phases_recorded_against_fake_server(self) -> None:
+        """Тест что trace хуки и клиент заполняют все фазы запроса."""
+        from src.llm.backend import LLMBackend
+        from src.llm.fake_openrouter import FakeOpenRouter, FakeOpenRouterConfig
+        from src.llm.timings import LatencyRecorder
+        from src.llm.transport import HttpTransport
+        
+        server = FakeOpenRouter(FakeOpenRouterConfig(latency=0.05, latency_sigma=0))
+        await server.start()
+        transport = HttpTransport()
+        recorder = LatencyRecorder()
+        try:
+            with patch("builtins.open", mock_open(read_data="Промпт")):
+                client = LLMClient(LLMBackend(server.base_url, "fake-key", transport))
+            with patch("src.llm.client.latency_recorder", recorder):
+                await client.send_message("Привет", [], "user_1")
+        finally:
+            await transport.close()
+            await server.close()
+        
+        phases = recorder.get_stats()["test/model|ok"]
+        assert set(phases) == {"queue", "connect", "ttfb", "body", "parse", "total"}
+        assert phases["ttfb"]["max_ms"] >= 50
+        assert phases["total"]["max_ms"] >= phases["ttfb"]["max_ms"]
+    
+    @pytest.mark.asyncio
+    async def test_image_stream_phases_recorded_against_fake_server(self) -> None:
+        """Тест что потоковый vision запрос записывает фазы так же, как обычный."""
+        import io
+        from PIL import Image
+        from src.llm.backend import LLMBackend
+        from src.llm.fake_openrouter import FakeOpenRouter, FakeOpenRouterConfig
+        from src.llm.timings import LatencyRecorder
+        from src.llm.transport import HttpTransport
+        from src.multimodal.image_processor import ImageProcessor
+        
+        image = io.BytesIO()
+        Image.new("RGB", (64, 64), "red").save(image, format="PNG")
+        server = FakeOpenRouter(FakeOpenRouterConfig(latency=0.05, latency_sigma=0, chunk_delay=0))
+        await server.start()
+        transport = HttpTransport()
+        recorder = LatencyRecorder()
+        try:
+            processor = ImageProcessor(LLMBackend(server.base_url, "fake-key", transport))
+            with patch("src.multimodal.image_processor.latency_recorder", recorder):
+                parts = [part async for part in processor.analyze_image_stream(image.getvalue(), "кот")]
+        finally:
+            await transport.close()
+            await server.close()
+        
+        assert "".join(parts) == server.config.reply
+        phases = recorder.get_stats()["anthropic/claude-3.5-sonnet|ok"]
+        assert set(phases) == {"connect", "ttfb", "body", "total"}
+        assert phases["ttfb"]["max_ms"] >= 50
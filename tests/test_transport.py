@@ -0,0 +1,73 @@
+"""Тесты для общего HTTP транспорта."""
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from src.llm.transport import HttpTransport
+
+
+async def _echo_handler(request: web.Request) -> web.Response:
+    """Простой обработчик, возвращающий тело запроса."""
+    data = await request.json()
+    return web.json_response(data)
+
+
+class TestHttpTransport:
+    """Тесты для класса HttpTransport."""
+
+    @pytest.fixture
+    async def server(self):
+        """Локальный aiohttp сервер для запросов."""
+        app = web.Application()
+        app.router.add_post("/echo", _echo_handler)
+        server = TestServer(app)
+        await server.start_server()
+        yield server
+        await server.close()
+
+    @pytest.fixture
+    async def transport(self):
+        """Фикстура транспорта с маленьким пулом."""
+        transport = HttpTransport(limit=2, limit_per_host=1, dns_cache_ttl=10, keepalive_timeout=30)
+        await transport.start()
+        yield transport
+        await transport.close()
+
+    @pytest.mark.asyncio
+    async def test_post_returns_response(self, server, transport: HttpTransport) -> None:
+        """Тест что запрос проходит через транспорт."""
+        async with transport.post(str(server.make_url("/echo")), json={"ping": 1}) as response:
+            assert response.status == 200
+            assert await response.json() == {"ping": 1}
+
+    @pytest.mark.asyncio
+    async def test_connections_are_reused(self, server, transport: HttpTransport) -> None:
+        """Тест что keep-alive соединение переиспользуется между запросами."""
+        for i in range(3):
+            async with transport.post(str(server.make_url("/echo")), json={"n": i}) as response:
+                await response.read()
+
+        stats = transport.get_stats()
+        assert stats["requests_total"] == 3
+        assert stats["connections_created"] == 1
+        assert stats["connections_reused"] == 2
+        assert stats["connections_in_use"] == 0
+
+    @pytest.mark.asyncio
+    async def test_in_use_counter(self, server, transport: HttpTransport) -> None:
+        """Тест учета занятых соединений."""
+        async with transport.post(str(server.make_url("/echo")), json={}) as response:
+            assert transport.get_stats()["connections_in_use"] == 1
+            await response.read()
+        assert transport.get_stats()["connections_in_use"] == 0
+
+    @pytest.mark.asyncio
+    async def test_close_and_reopen(self, server) -> None:
+        """Тест что после закрытия сессия создается заново."""
+        transport = HttpTransport()
+        await transport.start()
+        await transport.close()
+
+        async with transport.post(str(server.make_url("/echo")), json={"ok": True}) as response:
+            assert response.status == 200
+        await transport.close()
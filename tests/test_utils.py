@@ -1,7 +1,7 @@
 """Тесты для утилит проекта."""
+import json
 import pytest
-from datetime import datetime, timedelta
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 from src.utils.history import HistoryManager
 from src.utils.validators import MessageValidator
 
@@ -95,6 +95,83 @@ class TestHistoryManager:
         for message in context:
             assert "timestamp" not in message
     
+    def test_add_message_stores_token_estimate(self, history_manager: HistoryManager) -> None:
+        """Тест что оценка токенов считается при сохранении сообщения."""
+        from src.utils.tokens import estimate_tokens
+        
+        history_manager.add_message("test_user", "user", "Сообщение для оценки")
+        history_manager.add_message("test_user", "assistant", "x" * 400)
+        
+        session = history_manager.user_sessions["test_user"]
+        assert session[0].tokens == estimate_tokens("Сообщение для оценки")
+        
+        context = history_manager.get_context_messages("test_user")
+        assert context.token_counts == [msg.tokens for msg in session]
+        assert context.token_counts[1] == 104
+    
+    def test_apply_summary_replaces_old_messages(self, history_manager: HistoryManager) -> None:
+        """Тест замены ранних сообщений сводкой."""
+        from src.utils.history import SUMMARY_PREFIX
+        
+        user_id = "test_user"
+        for i in range(6):
+            history_manager.add_message(user_id, "user" if i % 2 == 0 else "assistant", f"Сообщение {i}")
+        
+        batch, previous = history_manager.get_compaction_batch(user_id, keep=2)
+        assert [msg.content for msg in batch] == ["Сообщение 0", "Сообщение 1", "Сообщение 2", "Сообщение 3"]
+        assert previous is None
+        
+        # Пока шло сжатие, пришло новое сообщение
+        history_manager.add_message(user_id, "user", "Сообщение 6")
+        
+        assert history_manager.apply_summary(user_id, batch, "Пользователь считал до шести") is True
+        assert history_manager.get_user_message_count(user_id) == 3
+        
+        context = history_manager.get_context_messages(user_id)
+        assert context[0] == {"role": "system", "content": SUMMARY_PREFIX + "Пользователь считал до шести"}
+        assert [msg["content"] for msg in context[1:]] == ["Сообщение 4", "Сообщение 5", "Сообщение 6"]
+        assert len(context.token_counts) == len(context)
+        
+        _, previous = history_manager.get_compaction_batch(user_id, keep=2)
+        assert previous == "Пользователь считал до шести"
+    
+    def test_context_view_cached_and_extended(self, history_manager: HistoryManager) -> None:
+        """Тест что снимок контекста кэшируется и продолжается без пересборки."""
+        history_manager.max_messages = 3
+        for i in range(3):
+            history_manager.add_message("1", "user", f"Сообщение {i}")
+        view = history_manager.get_context_messages("1")
+        
+        assert history_manager.get_context_messages("1") is view
+        with pytest.raises(TypeError):
+            view.append({"role": "user", "content": "нельзя"})
+        
+        history_manager.add_message("1", "assistant", "Ответ")
+        extended = history_manager.get_context_messages("1")
+        
+        assert extended is not view
+        assert [msg["content"] for msg in view] == ["Сообщение 0", "Сообщение 1", "Сообщение 2"]
+        assert [msg["content"] for msg in extended] == ["Сообщение 1", "Сообщение 2", "Ответ"]
+        assert extended[0] is view[1]  # Словари сообщений переиспользуются
+        assert extended.token_counts == [msg.tokens for msg in history_manager.user_sessions[1]]
+        assert extended.encoded() == b",".join(
+            json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8") for msg in extended
+        )
+    
+    def test_apply_summary_after_clear_is_ignored(self, history_manager: HistoryManager) -> None:
+        """Тест что устаревшая сводка не применяется к новой сессии."""
+        user_id = "test_user"
+        for i in range(4):
+            history_manager.add_message(user_id, "user", f"Старое {i}")
+        batch, _ = history_manager.get_compaction_batch(user_id, keep=1)
+        
+        history_manager.clear_user_history(user_id)
+        history_manager.add_message(user_id, "user", "Новое")
+        
+        assert history_manager.apply_summary(user_id, batch, "Сводка") is False
+        assert user_id not in history_manager.summaries
+        assert history_manager.get_context_messages(user_id) == [{"role": "user", "content": "Новое"}]
+    
     def test_clear_user_history_existing(self, history_manager: HistoryManager) -> None:
         """Тест очистки истории существующего пользователя."""
         user_id = "test_user"
@@ -130,26 +207,165 @@ class TestHistoryManager:
     
     def test_clear_old_sessions(self, history_manager: HistoryManager) -> None:
         """Тест очистки старых сессий.""" 
-        from src.utils.history import DialogMessage
+        import time
         
-        # Создаем старую сессию
-        old_time = datetime.now() - timedelta(seconds=3700)  # Старше session_ttl
-        recent_time = datetime.now() - timedelta(seconds=100)  # Свежая
+        now = time.monotonic()
         
-        history_manager.user_sessions = {
-            "old_user": [
-                DialogMessage("user", "старое сообщение", old_time)
-            ],
-            "recent_user": [
-                DialogMessage("user", "свежее сообщение", recent_time)
-            ]
-        }
+        # Создаем старую и свежую сессии
+        with patch("src.utils.history.time.monotonic", return_value=now - 3700):  # Старше session_ttl
+            history_manager.add_message("old_user", "user", "старое сообщение")
+        with patch("src.utils.history.time.monotonic", return_value=now - 100):  # Свежая
+            history_manager.add_message("recent_user", "user", "свежее сообщение")
         
         cleared_count = history_manager.clear_old_sessions()
         
         assert cleared_count == 1
         assert "old_user" not in history_manager.user_sessions
         assert "recent_user" in history_manager.user_sessions
+        
+        # Свежая сессия истекает только после session_ttl с последнего сообщения
+        assert history_manager.clear_old_sessions(now + 3400) == 0
+        assert history_manager.clear_old_sessions(now + 3600 + history_manager.expiry_resolution) == 1
+        assert history_manager._expiry_wheel == {}
+    
+    def test_expiry_moves_with_activity(self, history_manager: HistoryManager) -> None:
+        """Тест что новое сообщение продлевает сессию, а очистка истории убирает её из колеса."""
+        import time
+        
+        now = time.monotonic()
+        with patch("src.utils.history.time.monotonic", return_value=now):
+            history_manager.add_message("user_1", "user", "раз")
+            history_manager.add_message("user_2", "user", "раз")
+        with patch("src.utils.history.time.monotonic", return_value=now + 1800):
+            history_manager.add_message("user_1", "user", "два")
+        history_manager.clear_user_history("user_2")
+        
+        assert history_manager.clear_old_sessions(now + 3700) == 0
+        assert "user_1" in history_manager.user_sessions
+        assert history_manager.clear_old_sessions(now + 5500) == 1
+        assert history_manager._expiry_ticks == {}
+    
+    @pytest.mark.asyncio
+    async def test_expiry_background_task(self) -> None:
+        """Тест фоновой задачи очистки."""
+        import asyncio
+        
+        manager = HistoryManager(session_ttl=0, expiry_resolution=0.01)
+        manager.add_message("user_1", "user", "Привет")
+        
+        await manager.start()
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            await manager.close()
+        
+        assert manager.get_session_count() == 0
+    
+    def test_numeric_user_id_stored_as_int(self, history_manager: HistoryManager) -> None:
+        """Тест что числовые ID Telegram хранятся как int."""
+        history_manager.add_message("123456789", "user", "Привет")
+        
+        assert 123456789 in history_manager.user_sessions
+        assert history_manager.get_user_message_count("123456789") == 1
+        assert history_manager.get_user_message_count(123456789) == 1
+        assert history_manager.clear_user_history("123456789") is True
+    
+    def test_message_ring_overwrites_oldest(self) -> None:
+        """Тест кольцевого буфера: порядок, индексы и вытеснение."""
+        from src.utils.history import DialogMessage, MessageRing
+        
+        ring = MessageRing(3)
+        evicted = [ring.append(DialogMessage("user", str(i), float(i))) for i in range(5)]
+        
+        assert evicted == [False, False, False, True, True]
+        assert [msg.content for msg in ring] == ["2", "3", "4"]
+        assert ring[0].content == "2"
+        assert ring[-1].content == "4"
+        assert ring.last().content == "4"
+        assert len(ring) == 3
+        with pytest.raises(IndexError):
+            ring[3]
+        
+        ring.pack()
+        assert ring.packed_size > 0
+        assert len(ring) == 3
+        assert ring.last().content == "4"  # Обращение распаковывает
+        assert ring.packed_size == 0
+        assert [msg.content for msg in ring] == ["2", "3", "4"]
+    
+    def test_memory_budget_evicts_least_recently_active(self) -> None:
+        """Тест что сверх бюджета памяти вытесняются самые давно активные сессии."""
+        import sys
+        from src.utils.history import SESSION_OVERHEAD_BYTES, MESSAGE_OVERHEAD_BYTES
+        
+        text = "ж" * 500
+        session_bytes = SESSION_OVERHEAD_BYTES + MESSAGE_OVERHEAD_BYTES + sys.getsizeof(text)
+        manager = HistoryManager(max_bytes=session_bytes * 3 + 500)
+        
+        for user in ("1", "2", "3"):
+            manager.add_message(user, "user", text)
+        manager.add_message("1", "user", "ага")  # "1" снова активен, самый давний - "2"
+        manager.add_message("4", "user", text)
+        
+        assert manager.get_user_message_count("2") == 0
+        assert manager.get_user_message_count("1") == 2
+        assert manager.get_user_message_count("4") == 1
+        stats = manager.get_stats()
+        assert stats["evictions"] == 1
+        assert stats["sessions"] == 3
+        assert stats["resident_bytes"] <= stats["max_bytes"]
+    
+    def test_single_session_over_budget_not_logged(self) -> None:
+        """Тест что без вытеснений сообщение о бюджете не пишется в лог."""
+        manager = HistoryManager(max_bytes=100)
+        with patch("src.utils.history.logger") as mock_logger:
+            for i in range(5):
+                manager.add_message("1", "user", f"Длинное сообщение номер {i}")
+        
+        assert manager.get_stats()["evictions"] == 0
+        assert not any("Evicted" in str(call) for call in mock_logger.info.call_args_list)
+    
+    def test_resident_bytes_accounting(self, history_manager: HistoryManager) -> None:
+        """Тест что учет памяти следует за вытеснением из кольца, сводкой и очисткой."""
+        for i in range(25):
+            history_manager.add_message("7", "user", f"Сообщение номер {i:02d}")
+        full = history_manager.resident_bytes
+        history_manager.add_message("7", "user", "Сообщение номер 99")
+        assert history_manager.resident_bytes == full  # Вытеснено сообщение того же размера
+        
+        batch, _ = history_manager.get_compaction_batch("7", keep=2)
+        history_manager.apply_summary("7", batch, "Коротко")
+        assert history_manager.resident_bytes < full
+        
+        history_manager.clear_user_history("7")
+        assert history_manager.resident_bytes == 0
+        assert history_manager.get_stats()["evictions"] == 0
+    
+    def test_idle_sessions_compressed_and_restored(self, history_manager: HistoryManager) -> None:
+        """Тест сжатия простаивающих сессий и прозрачной распаковки."""
+        import time
+        
+        for i in range(10):
+            history_manager.add_message("1", "user", f"Ну конечно, вопрос номер {i} гениален.")
+        history_manager.add_message("2", "user", "Свежее сообщение")
+        before = history_manager.get_context_messages("1")
+        resident = history_manager.resident_bytes
+        
+        now = time.monotonic() + history_manager.compress_after + 1
+        with patch("src.utils.history.time.monotonic", return_value=now - 10):
+            history_manager.get_context_messages("2")  # "2" недавно активна
+        
+        assert history_manager.compress_idle_sessions(now=now) == 1
+        assert history_manager.get_stats()["compressed"] == 1
+        assert history_manager.get_user_message_count("1") == 10  # Без распаковки
+        assert history_manager.resident_bytes < resident
+        
+        assert history_manager.get_context_messages("1") == before
+        history_manager.add_message("1", "assistant", "Ответ")
+        assert history_manager.get_user_message_count("1") == 11
+        stats = history_manager.get_stats()
+        assert stats["compressed"] == 0
+        assert stats["decompressions"] == 1
 
 
 class TestMessageValidator: